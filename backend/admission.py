@@ -0,0 +1,219 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+
+class RateLimited(Exception):
+    """Raised when a request is rejected by a rate limit or a full queue."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allow ``rate`` requests per second on average, in bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount=1):
+        """Seconds until ``amount`` tokens are available; 0 if they are available now."""
+        self._refill()
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def try_take(self, amount=1):
+        """Take ``amount`` tokens if they are available; returns whether they were taken."""
+        if self.wait_time(amount) > 0:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class SessionRateLimiter:
+    """Token bucket per client, for requests that start provider work."""
+
+    def __init__(self, requests_per_minute, burst, max_clients=10000):
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()  # client key -> TokenBucket, least recently used first
+
+    def check(self, client_key):
+        """Count a request from a client, raising RateLimited if it is over its limit."""
+        if self.rate <= 0:
+            return
+        bucket = self.buckets.get(client_key)
+        if bucket is None:
+            bucket = self.buckets[client_key] = TokenBucket(self.rate, self.burst)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        self.buckets.move_to_end(client_key)
+        if not bucket.try_take():
+            raise RateLimited('Too many requests, please slow down', retry_after=round(bucket.wait_time(), 2))
+
+
+class Waiter:
+    __slots__ = ('event', 'on_position', 'position')
+
+    def __init__(self, on_position):
+        # Imported on use, so asgi_app can share this module without loading eventlet
+        from eventlet.event import Event
+        self.event = Event()
+        self.on_position = on_position
+        self.position = None
+
+
+class ModelQueue:
+    """Requests waiting for one model's rate limit, served round-robin across sessions."""
+
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.waiting = OrderedDict()  # session key -> deque of Waiters, in rotation order
+        self.size = 0
+        self.dispatcher = None
+
+
+class FairScheduler:
+    """Admit provider calls at each model's rate limit, fairly across sessions.
+
+    Calls that find a token go straight through. Others wait in a per-session
+    queue, and a dispatcher hands out tokens round-robin across sessions as
+    they refill, so one busy session cannot starve the rest. Waiters are told
+    their position in line whenever it changes.
+    """
+
+    def __init__(self, requests_per_minute, burst, max_queued=200):
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self.max_queued = max_queued
+        self.queues = {}  # model name -> ModelQueue
+
+    def wait_for_slot(self, model_name, session_key, on_position=None):
+        """Block until the model's rate limit admits one call for this session.
+
+        ``on_position(position)`` is called with the 1-based place in line
+        while waiting. Raises RateLimited if the model's queue is full.
+        """
+        if self.rate <= 0:
+            return
+        queue = self.queues.get(model_name)
+        if queue is None:
+            queue = self.queues[model_name] = ModelQueue(self.rate, self.burst)
+        if not queue.size and queue.bucket.try_take():
+            return
+        if queue.size >= self.max_queued:
+            raise RateLimited(f'{model_name} is at capacity, please try again later',
+                              retry_after=round(queue.size / self.rate, 2))
+
+        waiter = Waiter(on_position)
+        queue.waiting.setdefault(session_key, deque()).append(waiter)
+        queue.size += 1
+        self._report_positions(queue)
+        if queue.dispatcher is None:
+            import eventlet
+            queue.dispatcher = eventlet.spawn(self._dispatch, queue)
+        try:
+            waiter.event.wait()
+        finally:
+            if not waiter.event.ready():
+                # Stopped while waiting: give up the place in line
+                self._remove(queue, session_key, waiter)
+                self._report_positions(queue)
+
+    def _dispatch(self, queue):
+        import eventlet
+        try:
+            while queue.size:
+                wait = queue.bucket.wait_time()
+                if wait > 0:
+                    eventlet.sleep(wait)
+                    continue
+                queue.bucket.try_take()
+                session_key, waiters = next(iter(queue.waiting.items()))
+                waiter = waiters.popleft()
+                queue.size -= 1
+                # Rotate: the session goes to the back of the line
+                del queue.waiting[session_key]
+                if waiters:
+                    queue.waiting[session_key] = waiters
+                waiter.event.send()
+                self._report_positions(queue)
+        finally:
+            queue.dispatcher = None
+
+    def _remove(self, queue, session_key, waiter):
+        waiters = queue.waiting.get(session_key)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            queue.size -= 1
+            if not waiters:
+                del queue.waiting[session_key]
+
+    def _report_positions(self, queue):
+        """Tell waiters whose place in line changed; the order follows the round-robin rotation."""
+        position = 0
+        rotations = max((len(waiters) for waiters in queue.waiting.values()), default=0)
+        for index in range(rotations):
+            for waiters in queue.waiting.values():
+                if index >= len(waiters):
+                    continue
+                position += 1
+                waiter = waiters[index]
+                if waiter.on_position and waiter.position != position:
+                    waiter.position = position
+                    waiter.on_position(position)
+
+    def stats(self):
+        return {model_name: queue.size for model_name, queue in self.queues.items()}
+
+
+class AsyncRateLimiter:
+    """Per-model rate limits for the asyncio server, first come first served.
+
+    The asyncio counterpart of FairScheduler without the per-session
+    rotation: callers queue on a lock per model and take tokens in arrival
+    order. Raises RateLimited once ``max_queued`` callers are waiting.
+    """
+
+    def __init__(self, requests_per_minute, burst, max_queued=200):
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self.max_queued = max_queued
+        self.buckets = {}  # model name -> TokenBucket
+        self.locks = {}  # model name -> asyncio.Lock
+        self.waiting = {}  # model name -> callers queued
+
+    async def wait_for_slot(self, model_name):
+        if self.rate <= 0:
+            return
+        bucket = self.buckets.get(model_name)
+        if bucket is None:
+            bucket = self.buckets[model_name] = TokenBucket(self.rate, self.burst)
+            self.locks[model_name] = asyncio.Lock()
+            self.waiting[model_name] = 0
+        if not self.waiting[model_name] and bucket.try_take():
+            return
+        if self.waiting[model_name] >= self.max_queued:
+            raise RateLimited(f'{model_name} is at capacity, please try again later',
+                              retry_after=round(self.waiting[model_name] / self.rate, 2))
+        self.waiting[model_name] += 1
+        try:
+            async with self.locks[model_name]:
+                while not bucket.try_take():
+                    await asyncio.sleep(bucket.wait_time())
+        finally:
+            self.waiting[model_name] -= 1
+
+    def stats(self):
+        return dict(self.waiting)
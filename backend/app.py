@@ -1,164 +1,210 @@
 import eventlet
 eventlet.monkey_patch()
 
-from flask import Flask, request
-from flask_socketio import SocketIO
+from flask import Flask, Response, request
+from flask_socketio import SocketIO, join_room
 from flask_cors import CORS
-from crewai import Agent, Task, Crew, Process
-from dotenv import load_dotenv
+from config import (
+    AGENT_CACHE_SIZE, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, CHAT_HISTORY_MAX_ITEMS, CHAT_HISTORY_PAGE_SIZE,
+    CHAT_HISTORY_PATH, LLM_QUEUE_LIMIT, LLM_WORKER_THREADS, METRICS_LOG, ORCHESTRATOR_IDLE_TTL,
+    ORCHESTRATOR_MAX_SESSIONS, PIPELINE_TURNS, PREFETCH_NEXT_BATCH, PREFETCH_TOKENS_PER_MINUTE, PROVIDER_BATCHING,
+    PROVIDER_MAX_CONCURRENCY, PROVIDER_MAX_CONNECTIONS, PROVIDER_QUEUE_LIMIT, PROVIDER_REQUESTS_PER_MINUTE,
+    PROVIDER_REQUEST_BURST, SESSION_REQUESTS_PER_MINUTE, SESSION_REQUEST_BURST, SINGLE_AI_CONTEXT_TOKENS,
+    SINGLE_AI_STREAMING, SOCKETIO_MESSAGE_QUEUE, SOCKETIO_SERIALIZER, STARTUP_WARMUP, STOP_QUIET_TARGET_MS,
+    STREAM_FLUSH_BYTES, STREAM_FLUSH_INTERVAL, WORKER_ID
+)
+from llm import (
+    FakeStreamingLLM, agent_messages, create_streaming_llm, estimate_tokens, instruct_prompt, is_fake_model,
+    prompt_messages, usage_from_crew_metrics
+)
+from model_configs import MODEL_CONFIGS
+from providers import ProviderRegistry
+from admission import FairScheduler, RateLimited, SessionRateLimiter, TokenBucket
+from resilience import create_resilience_policy
+from metrics import MetricsRegistry
+from cancellation import CancellationToken, GenerationCancelled
+from execution import LazyModule, WorkerPool, run_cancellable, spawned_greenlets
+from response_cache import ResponseCache, create_response_cache
+from history_store import ChatHistoryStore, page_request
+from session_state import create_session_state_store, issue_access_token, public_state
+from context_window import token_budget, truncate_to_tokens
+from conversation import Conversation, ConversationRegistry
+from personas import (
+    DEFAULT_PERSONA, PERSONA_DIR, SINGLE_AI_CONTEXT_MESSAGE, SINGLE_AI_SYSTEM_MESSAGE, PersonaRegistry
+)
+from streaming import StreamEmitter, split_text
+from batching import RequestCoalescer
+from collections import OrderedDict
+from contextlib import nullcontext
+import greenlet
 import os
+import time
 
-# Load environment variables
-load_dotenv()
-
-# Model configurations with provider grouping
-MODEL_CONFIGS = {
-    "providers": {
-        "openai": {
-            "name": "OpenAI",
-            "icon": "openai-icon.png",
-            "models": {
-                # GPT-4 Models
-                "gpt-4o-mini": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
-                "gpt-4-0125-preview": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
-                "gpt-4-1106-preview": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
-                "gpt-4": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
-                
-                # GPT-3.5 Models
-                "gpt-3.5-turbo-0125": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
-                "gpt-3.5-turbo-1106": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
-                "gpt-3.5-turbo": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
-            },
-            "features": {
-                "voice_input": True,
-                "streaming": True
-            }
-        },
-        "anthropic": {
-            "name": "Anthropic",
-            "icon": "anthropic-icon.png",
-            "models": {
-                "claude-3-opus": {"api_key": os.getenv("ANTHROPIC_API_KEY"), "provider": "anthropic"},
-                "claude-3-sonnet": {"api_key": os.getenv("ANTHROPIC_API_KEY"), "provider": "anthropic"},
-                "claude-2.1": {"api_key": os.getenv("ANTHROPIC_API_KEY"), "provider": "anthropic"},
-            },
-            "features": {
-                "voice_input": True,
-                "streaming": True
-            }
-        },
-        "deepseek": {
-            "name": "DeepSeek",
-            "icon": "deepseek-icon.png",
-            "models": {
-                "deepseek-r1": {"api_key": os.getenv("DEEPSEEK_API_KEY"), "provider": "deepseek"},
-                "deepseek-chat": {"api_key": os.getenv("DEEPSEEK_API_KEY"), "provider": "deepseek"},
-                "deepseek-coder": {"api_key": os.getenv("DEEPSEEK_API_KEY"), "provider": "deepseek"},
-            },
-            "features": {
-                "voice_input": False,
-                "streaming": True
-            }
-        },
-        "llama": {
-            "name": "Llama",
-            "icon": "llama-icon.png",
-            "models": {
-                "llama-2-70b-chat": {"api_key": os.getenv("LLAMA_API_KEY"), "provider": "llama", "endpoint": os.getenv("LLAMA_API_ENDPOINT")},
-                "llama-2-13b-chat": {"api_key": os.getenv("LLAMA_API_KEY"), "provider": "llama", "endpoint": os.getenv("LLAMA_API_ENDPOINT")},
-                "llama-2-7b-chat": {"api_key": os.getenv("LLAMA_API_KEY"), "provider": "llama", "endpoint": os.getenv("LLAMA_API_ENDPOINT")},
-            },
-            "features": {
-                "voice_input": False,
-                "streaming": True
-            }
-        },
-        "mixtral": {
-            "name": "Mixtral",
-            "icon": "mixtral-icon.png",
-            "models": {
-                "mixtral-8x7b": {"api_key": os.getenv("MIXTRAL_API_KEY"), "provider": "mixtral", "endpoint": os.getenv("MIXTRAL_API_ENDPOINT")}
-            },
-            "features": {
-                "voice_input": False,
-                "streaming": True
-            }
-        }
-    },
-    "default_model": os.getenv("DEFAULT_MODEL", "gpt-4o-mini")
-}
+# CrewAI takes seconds to import, so it is loaded on first use or by warm_up(),
+# not before the server can accept connections
+crewai = LazyModule('crewai')
 
 app = Flask(__name__)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    async_mode='eventlet',
+    message_queue=SOCKETIO_MESSAGE_QUEUE,
+    serializer=SOCKETIO_SERIALIZER
+)
+
+# Shared, connection-pooled provider clients for every configured model
+provider_registry = ProviderRegistry(MODEL_CONFIGS, PROVIDER_MAX_CONNECTIONS, PROVIDER_MAX_CONCURRENCY)
 
 def get_model_config(model_name):
-    """Get the configuration for a specific model."""
-    # For now, always return gpt-4o-mini configuration
-    return {
-        "api_key": os.getenv("OPENAI_API_KEY"),
-        "provider": "openai"
-    }
-
-class ConversationOrchestrator:
-    def __init__(self, socket):
+    """Get the configuration for a specific model, or None if it is not configured."""
+    return provider_registry.get_model_config(model_name)
+
+class AgentCache:
+    """LRU cache of built CrewAI agents, keyed by everything their prompts depend on."""
+    
+    def __init__(self, max_size=AGENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get_or_create(self, key, factory):
+        """Return the cached value for key, building it with factory() on a miss."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        
+        self.misses += 1
+        value = factory()
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return value
+    
+    def clear(self):
+        self.entries.clear()
+
+agent_cache = AgentCache()
+
+# Cached agents only hold the prompts call_crew_agent() sends; each call borrows its own CrewAI LLM
+AGENT_OPTIONS = {"allow_delegation": False, "verbose": True}
+
+def call_crew_agent(agent, task, model_name, max_tokens=None):
+    """Send a single-agent task to a model, capped at max_tokens; returns the reply and its token usage.
+    
+    CrewAI 1.x cannot kick off a crew under eventlet: its event bus runs an
+    asyncio loop on a green thread, so kickoff() finds that loop running.
+    The agent's prompts go to the model as a one-agent crew would send them,
+    on the calling greenlet, whose sockets eventlet makes cooperative.
+    Cached agents are shared between sessions and only read here; the call
+    gets a CrewAI LLM of its own.
+    """
+    messages = agent_messages(agent.role, agent.goal, agent.backstory, task.description, task.expected_output)
+    with provider_registry.lend_crew_llm(model_name, max_tokens) as llm:
+        before = llm.get_token_usage_summary()
+        reply = llm.call(messages)
+        return str(reply).strip(), usage_from_crew_metrics(llm.get_token_usage_summary(), before)
+
+# Persona prompts, loaded and compiled once; add a JSON file to add a persona
+persona_registry = PersonaRegistry(os.getenv("PERSONA_DIR", PERSONA_DIR))
+
+# Keeps batched completions requests and other blocking calls off the eventlet hub
+llm_pool = WorkerPool(LLM_WORKER_THREADS, LLM_QUEUE_LIMIT)
+
+# Responses for repeated prompts; None when RESPONSE_CACHE_BACKEND=off
+response_cache = create_response_cache()
+
+chat_history_store = ChatHistoryStore(CHAT_HISTORY_PATH, CHAT_HISTORY_MAX_ITEMS)
+
+llm_resilience = create_resilience_policy(MODEL_CONFIGS.get("default_model"))
+
+# Prometheus metrics, served on /metrics
+metrics = MetricsRegistry(log_stages=METRICS_LOG)
+token_counter = metrics.counter(
+    "multiai_tokens_total",
+    "Prompt, cached prompt and completion tokens of provider calls by model; estimated when the provider reports none."
+)
+provider_call_counter = metrics.counter("multiai_provider_calls_total", "Provider call attempts by model and outcome.")
+provider_batch_counter = metrics.counter(
+    "multiai_provider_batches_total", "Batched completions requests to self-hosted models, by model."
+)
+batched_turn_counter = metrics.counter(
+    "multiai_provider_batched_turns_total", "Simulator turns sent in batched requests, by model."
+)
+
+def send_provider_batch(key, requests):
+    """Send a batch of coalesced turns for one model and reply limit as one completions request."""
+    model_name, max_tokens = key
+    provider_batch_counter.inc(model=model_name)
+    batched_turn_counter.inc(len(requests), model=model_name)
+    # The batch, not each turn in it, takes one of the provider's call slots
+    with provider_registry.limit(model_name):
+        return llm_pool.execute(
+            provider_registry.complete_batch,
+            model_name,
+            [instruct_prompt(messages) for messages in requests],
+            max_tokens
+        )
+
+provider_batcher = RequestCoalescer(send_provider_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS / 1000)
+
+def record_tokens(model_name, prompt, completion, usage=None):
+    """Count a provider call's tokens, from the provider's usage report when there is one.
+    
+    Returns the counts, estimated or reported.
+    """
+    if usage is None:
+        usage = {'prompt': estimate_tokens(prompt), 'completion': estimate_tokens(completion), 'cached': 0}
+    token_counter.inc(usage['prompt'], model=model_name, kind='prompt')
+    token_counter.inc(usage['completion'], model=model_name, kind='completion')
+    if usage['cached']:
+        # Prompt tokens served from the provider's prompt cache, part of the prompt count
+        token_counter.inc(usage['cached'], model=model_name, kind='cached_prompt')
+    return usage
+
+# Admission control: per-address request limits, and per-model provider rate limits
+request_limiter = SessionRateLimiter(SESSION_REQUESTS_PER_MINUTE, SESSION_REQUEST_BURST)
+provider_scheduler = FairScheduler(PROVIDER_REQUESTS_PER_MINUTE, PROVIDER_REQUEST_BURST, PROVIDER_QUEUE_LIMIT)
+
+prefetch_budget = TokenBucket(PREFETCH_TOKENS_PER_MINUTE / 60, PREFETCH_TOKENS_PER_MINUTE)
+prefetch_counter = metrics.counter(
+    "multiai_prefetch_turns_total",
+    "Next-batch turns generated ahead, by outcome: used, dropped, or skipped by the spend cap."
+)
+
+def report_stop_latency(cancel_token, label):
+    """Log how long a generation took to go quiet after a stop request."""
+    stop_latency_ms = cancel_token.elapsed_since_cancel_ms()
+    if stop_latency_ms is None:
+        return
+    print(f"{label} stopped {stop_latency_ms:.1f}ms after stop request")
+    if stop_latency_ms > STOP_QUIET_TARGET_MS:
+        print(f"Warning: stop latency exceeded target of {STOP_QUIET_TARGET_MS:.0f}ms")
+
+class ConversationOrchestrator(Conversation):
+    """Runs a session's conversation on greenlets, with CrewAI agents, and emits its events to ``socket``."""
+    
+    def __init__(self, socket, session_id='default', state_store=None):
+        super().__init__(session_id, state_store)
         self.socket = socket
-        self.config = {}
-        self.conversation_history = []
-        self.chat_history_storage = {}  # Store chat histories by user/session ID
         self.stop_requested = False
-        self.current_round = 0
-        self.total_rounds = 10
-        self.is_continuation = False
-        self.response_length = 0  # Track response length
-        self.max_response_length = 2000  # Default max response length
+        self.cancel_token = CancellationToken()
+        self.is_running = False
     
     def store_chat_history(self, session_id, history_item):
         """Store chat history for a specific session."""
-        if session_id not in self.chat_history_storage:
-            self.chat_history_storage[session_id] = []
-        self.chat_history_storage[session_id].append(history_item)
+        chat_history_store.append(session_id, history_item)
     
-    def get_chat_history(self, session_id):
-        """Retrieve chat history for a specific session."""
-        return self.chat_history_storage.get(session_id, [])
+    def get_chat_history(self, session_id, limit=CHAT_HISTORY_PAGE_SIZE, before_id=None):
+        """Retrieve a page of chat history for a specific session."""
+        return chat_history_store.read(session_id, limit, before_id)
     
     def clear_chat_history(self, session_id):
         """Clear chat history for a specific session."""
-        if session_id in self.chat_history_storage:
-            del self.chat_history_storage[session_id]
-    
-    def parse_user_input(self, data):
-        """Parse user input with enhanced configuration options."""
-        self.is_continuation = data.get('is_continuation', False)
-        if not self.is_continuation:
-            # Reset config for new conversation
-            self.config = {
-                "background": data.get('prompt', ''),
-                "rounds": data.get('rounds', self.total_rounds),
-                "agent_count": data.get('agent_count', 2),
-                "personality": data.get('personality', 'SARCASTIC_NETIZEN'),
-                "models": {
-                    "A": data.get('models', {}).get('A', MODEL_CONFIGS.get("default_model")),
-                    "B": data.get('models', {}).get('B', MODEL_CONFIGS.get("default_model"))
-                },
-                "max_response_length": data.get('max_response_length', self.max_response_length),
-                "voice_input": data.get('voice_input', False),
-                "session_id": data.get('session_id', 'default')
-            }
-            self.conversation_history = []
-            self.current_round = 0
-            self.response_length = 0
-        else:
-            # For continuation, keep existing config and history
-            self.stop_requested = False
-            
-        return self.config
-    
-    def check_response_length(self, message):
-        """Check if response length is within limits."""
-        self.response_length += len(message)
-        return self.response_length <= self.config.get('max_response_length', self.max_response_length)
+        chat_history_store.clear(session_id)
     
     def process_voice_input(self, audio_data):
         """Process voice input if enabled."""
@@ -169,432 +215,499 @@ class ConversationOrchestrator:
         # This would integrate with a speech-to-text service
         return None
     
-    def format_conversation_history(self):
-        if not self.conversation_history:
-            return ""
-        return "\n".join([
-            f"{msg['agent']}: {msg['message']}" 
-            for msg in self.conversation_history[-4:]  # Keep last 4 messages for context
-        ])
-    
     def create_agent_with_model(self, role, goal, backstory, model_name):
         """Create an agent with the specified model configuration."""
         model_config = get_model_config(model_name)
         if not model_config:
             raise ValueError(f"Invalid model configuration for {model_name}")
             
-        # Set up agent configuration
-        agent_config = {
-            "role": role,
-            "goal": goal,
-            "backstory": backstory,
-            "verbose": True,
-            "allow_delegation": False,
-            "llm_model": model_name
-        }
-        
-        # Add provider-specific configurations
-        if model_config["provider"] == "openai":
-            agent_config["api_key"] = model_config["api_key"]
-        elif model_config["provider"] in ["llama", "mixtral"]:
-            agent_config["api_key"] = model_config["api_key"]
-            agent_config["endpoint"] = model_config["endpoint"]
-        elif model_config["provider"] == "anthropic":
-            agent_config["api_key"] = model_config["api_key"]
-            agent_config["provider"] = "anthropic"
-        elif model_config["provider"] == "deepseek":
-            agent_config["api_key"] = model_config["api_key"]
-            agent_config["provider"] = "deepseek"
-            
-        return Agent(**agent_config)
+        return crewai.Agent(role=role, goal=goal, backstory=backstory, **AGENT_OPTIONS)
+    
+    def get_agent(self, role, goal, backstory, model_name):
+        """Return the cached agent for these prompts on a model."""
+        return agent_cache.get_or_create(
+            ('AGENT', role, goal, backstory, model_name),
+            lambda: self.create_agent_with_model(role, goal, backstory, model_name)
+        )
     
     def create_agents(self):
         scenario = self.config.get('background', '一个场景')
-        personality = self.config.get('personality', 'SARCASTIC_NETIZEN')
+        personality = self.config.get('personality', DEFAULT_PERSONA)
         model_a = self.config.get('models', {}).get('A', MODEL_CONFIGS.get("default_model"))
         model_b = self.config.get('models', {}).get('B', MODEL_CONFIGS.get("default_model"))
         
-        if personality == 'RAP_BATTLE':
-            agent_a = self.create_agent_with_model(
-                role='地下说唱歌手',
-                goal=f'在"{scenario}"的场景下用犀利的韵脚和节奏击败对手',
-                backstory=f"""你是一个地下说唱歌手，正在{scenario}中进行即兴battle。你的说唱风格：
-                - 押韵要求：每句必须押韵，韵脚要新颖
-                - 节奏把控：保持4/4拍的基本节奏
-                - 内容特点：讽刺性强，直击对手软肋
-                - 表达方式：暴躁直接，不留情面
-                - 说唱技巧：运用双关语、比喻等修辞手法
-                
-                注意事项：
-                1. 每次回复要包含2-4句押韵的歌词
-                2. 必须紧扣对方上一轮的内容进行反击
-                3. 歌词要有创意，不能重复老梗
-                4. 保持说唱的节奏感和韵律感
-                5. 可以适当使用英文说唱元素
-                6. 要体现说唱文化，但不要过度使用脏话
-                7. 每句都要带有攻击性，但要有艺术性
-                8. 始终围绕当前场景展开battle""",
-                model_name=model_a
-            )
-            
-            agent_b = self.create_agent_with_model(
-                role='新生代说唱歌手',
-                goal=f'在"{scenario}"的场景下用新潮的说唱风格和创意反击对手',
-                backstory=f"""你是新生代说唱歌手，正在{scenario}中进行即兴battle。你的说唱特点：
-                - 押韵特色：多重韵、交叉韵的灵活运用
-                - 节奏特点：擅长切换不同的flow
-                - 内容风格：充满新时代元素和梗
-                - 表达方式：既有硬核也有轻快的反讽
-                - 说唱技巧：擅长运用各种修辞和双关语
-                
-                注意事项：
-                1. 每次回复要包含2-4句押韵的歌词
-                2. 要对应对手的flow进行回应
-                3. 多运用新潮的网络用语和梗
-                4. 保持说唱的节奏感和韵律感
-                5. 中英混合说唱要自然流畅
-                6. 展现年轻一代的说唱特色
-                7. 反击要巧妙，不是简单的互骂
-                8. 始终围绕当前场景展开battle""",
-                model_name=model_b
+        # Agents only depend on these settings, so batches and sessions can share them
+        with metrics.time_stage('create_agents'):
+            return agent_cache.get_or_create(
+                (personality, scenario, model_a, model_b),
+                lambda: self.build_agents(scenario, personality, model_a, model_b)
             )
-            
-            return [agent_a, agent_b]
-        elif personality == 'PROFESSIONAL_TECH':
-            agent_a = self.create_agent_with_model(
-                role='资深技术专家',
-                goal=f'在"{scenario}"的场景下进行专业且深入的技术讨论',
-                backstory=f"""你是一位经验丰富的技术专家，正在{scenario}中进行技术交流。你的特点：
-                - 深入浅出地解释复杂概念
-                - 关注技术细节和最佳实践
-                - 分享实战经验和踩坑经历
-                - 保持专业和理性的讨论态度
-                - 善于引导技术思考
-                
-                注意事项：
-                1. 每次回复要包含具体的技术观点
-                2. 使用准确的技术术语
-                3. 结合实际案例说明问题
-                4. 保持专业客观的态度
-                5. 适当引用业界最佳实践
-                6. 回应要有深度，不流于表面
-                7. 可以提出技术改进建议
-                8. 始终围绕当前技术场景展开讨论""",
-                model_name=model_a
-            )
-            
-            agent_b = self.create_agent_with_model(
-                role='技术探索者',
-                goal=f'在"{scenario}"的场景下通过提问和讨论深化技术理解',
-                backstory=f"""你是一个充满求知欲的技术学习者，正在{scenario}中进行技术交流。你的特点：
-                - 提出深度技术问题
-                - 分享学习心得和困惑
-                - 善于总结和归纳
-                - 注重实践验证
-                - 乐于技术交流
-                
-                注意事项：
-                1. 提出有深度的技术问题
-                2. 分享个人的技术见解
-                3. 探讨实现方案的优劣
-                4. 讨论技术选型的考虑
-                5. 关注性能和可维护性
-                6. 提出可能存在的技术风险
-                7. 探讨未来技术发展方向
-                8. 始终围绕当前技术场景展开讨论""",
-                model_name=model_b
+    
+    def build_agents(self, scenario, personality, model_a, model_b):
+        """Build the agent pair for a scenario, personality and model choice."""
+        persona = persona_registry.get(personality)
+        return [
+            self.get_agent(
+                template.role,
+                template.goal.render(scenario=scenario),
+                template.backstory.render(scenario=scenario),
+                model_name
             )
-            
-            return [agent_a, agent_b]
-            
-        # Original SARCASTIC_NETIZEN case
-        agent_a = self.create_agent_with_model(
-            role='暴躁网友',
-            goal=f'在"{scenario}"的场景下用最新网络梗和热点无情嘲讽对方',
-            backstory=f"""你是一个暴躁的网络喷子，正在{scenario}中。你说话毒舌尖锐但很有梗。
-            你要始终围绕"{scenario}"这个场景和话题进行吐槽和互怼。
-
-            你的说话风格：
-            - 说话犀利直接，不会拐弯抹角
-            - 擅长抓住对方的小辫子疯狂输出
-            - 对任何话题都能找到吐槽点
-            - 熟悉各种网络热梗，但绝不生搬硬套
-            - 讽刺技能点满，但有自己独特的风格
-
-            注意事项：
-            1. 不要重复使用同样的词汇和句式
-            2. 每句话都要带刺，但要有梗，不是单纯骂人
-            3. 紧扣对方说过的话进行反击
-            4. 不要太过友善，要保持杠精本色
-            5. 避免过度使用"哈哈"、"绝对"等词
-            6. 保持简短但犀利的回复（1-2句话）
-            7. 不要重复对方的话，而是抓住对方话里的破绽进行攻击
-            8. 始终围绕当前场景展开讨论，不要偏离主题""",
-            model_name=model_a
-        )
+            for template, model_name in zip(persona.agents, (model_a, model_b))
+        ]
+    
+    def run_agent_task(self, agent, task, model_name):
+        """Run a single-agent task, answering repeated prompts from the response cache."""
+        use_cache = response_cache and self.config.get('use_cache', True)
+        if use_cache:
+            # A reply cut short by a smaller budget is not served to a turn with a larger one
+            cached = response_cache.get(ResponseCache.make_key(
+                model_name, agent.backstory, task.description, self.reply_token_limit(model_name)
+            ))
+            if cached is not None:
+                return cached
         
-        agent_b = self.create_agent_with_model(
-            role='阴阳怪气王',
-            goal=f'在"{scenario}"的场景下用阴阳怪气的方式回怼对方',
-            backstory=f"""你是一个擅长阴阳怪气的网友，正在{scenario}中。你说话表面温和但处处带刺。
-            你要始终围绕"{scenario}"这个场景和话题进行反讽和互怼。
-
-            你的说话风格：
-            - 表面甜美实则暗藏杀机
-            - 每句话都带着浓浓的反讽意味
-            - 擅长用对方的话来反击对方
-            - 能把最毒的话用最温柔的方式说出来
-            - 段位极高，绝不轻易被激怒
-
-            注意事项：
-            1. 不要真情实感，保持阴阳怪气的风格
-            2. 避免重复使用相同的句式和词汇
-            3. 回应要有层次，不是简单的互怼
-            4. 要抓住对方话语中的破绽进行反击
-            5. 避免过度使用"笑死"、"太可爱了"等网络用语
-            6. 保持简短但致命的回复（1-2句话）
-            7. 用最温柔的语气说最毒的话
-            8. 始终围绕当前场景展开讨论，不要偏离主题""",
-            model_name=model_b
-        )
+        result, answered_by = self.execute_agent_task(agent, task, model_name)
+        if use_cache:
+            # A fallback's or hedge's reply is cached as that model's, not the requested one's
+            response_cache.set(ResponseCache.make_key(
+                answered_by, agent.backstory, task.description, self.reply_token_limit(answered_by)
+            ), result)
+        return result
+    
+    def execute_agent_task(self, agent, task, model_name):
+        """Call the provider for a single-agent task, with retries, hedging and fallback.
         
-        return [agent_a, agent_b]
+        Returns the reply and the model that gave it. The whole call,
+        including queued and hedged requests, is aborted if the conversation
+        is stopped.
+        """
+        return run_cancellable(
+            self.cancel_token,
+            llm_resilience.call,
+            lambda attempt_model: (self.call_agent_model(agent, task, model_name, attempt_model), attempt_model),
+            model_name
+        )
     
-    def create_conversation_task(self, agent, context, is_first_round=False):
-        scenario = self.config.get('background', '一个场景')
-        conversation_history = self.format_conversation_history()
-        personality = self.config.get('personality', 'SARCASTIC_NETIZEN')
+    def call_agent_model(self, agent, task, model_name, attempt_model):
+        """Make one provider call for a task on attempt_model, the agent's model or a hedge/fallback.
         
-        if personality == 'RAP_BATTLE':
-            base_task = f"""你是一个说唱歌手，正在进行即兴battle。
-            当前场景：{scenario}
-            
-            对话要求：
-            1. 每次回复要包含2-4句押韵的歌词
-            2. 保持说唱的节奏感和韵律感
-            3. 紧扣场景和对手的内容进行battle
-            4. 展现个人说唱特色和风格
-            
-            之前的对话记录：
-            {conversation_history}
-            """
-            
-            if is_first_round:
-                if "Agent A" in agent.role:
-                    task_description = base_task + f"""
-                    作为开场，你要针对"{scenario}"这个场景开启battle。
-                    用地下说唱的犀利风格，展现你的气场。
-                    """
-                else:
-                    task_description = base_task + f"""
-                    对方已经开启battle，用你的新生代说唱风格强势回应。
-                    展现年轻一代的创新和活力。
-                    """
-            else:
-                task_description = base_task + f"""
-                基于当前场景和对话记录，继续battle。
-                保持节奏感和韵律感，展现你的说唱特色。
-                """
-            
-            return Task(
-                description=task_description,
-                expected_output="2-4句押韵的说唱歌词，展现个人风格。",
-                agent=agent
-            )
-        elif personality == 'PROFESSIONAL_TECH':
-            base_task = f"""你是一个技术专家，正在进行技术讨论。
-            当前场景：{scenario}
-            
-            对话要求：
-            1. 每次回复要有具体的技术内容
-            2. 使用准确的技术术语
-            3. 保持专业的讨论态度
-            4. 围绕技术话题深入展开
-            
-            之前的对话记录：
-            {conversation_history}
-            """
-            
-            if is_first_round:
-                if "Agent A" in agent.role:
-                    task_description = base_task + f"""
-                    作为资深技术专家，你要针对"{scenario}"这个场景进行技术分析。
-                    从技术架构、实现方案、最佳实践等角度展开讨论。
-                    分享你的专业见解和实战经验。
-                    """
-                else:
-                    task_description = base_task + f"""
-                    作为技术探索者，针对专家的技术分析提出深度问题。
-                    探讨实现细节、性能优化、可能的技术风险等。
-                    分享你的学习心得和技术思考。
-                    """
-            else:
-                task_description = base_task + f"""
-                基于当前场景和对话记录，继续技术讨论。
-                深入探讨技术细节，分享经验和见解。
-                保持专业的交流氛围。
-                """
-            
-            return Task(
-                description=task_description,
-                expected_output="一个专业的技术回复，包含具体的技术内容和见解，建议2-3句话。",
-                agent=agent
+        The reply is capped at the tokens the response budget has left. With
+        PROVIDER_BATCHING, self-hosted models get the task in a batch with
+        other sessions' turns instead of through CrewAI.
+        """
+        if not get_model_config(attempt_model):
+            raise ValueError(f"Invalid model configuration for {attempt_model}")
+        # What the budget has left now, which may be less than when the batch's agents were built
+        max_tokens = self.reply_token_limit(attempt_model)
+        
+        # Wait for the model's rate limit
+        with metrics.time_stage('provider_queue', model=attempt_model):
+            provider_scheduler.wait_for_slot(
+                attempt_model,
+                self.session_id,
+                lambda position: self.emit_queue_position(attempt_model, position)
             )
-        else:
-            # Original task creation logic for SARCASTIC_NETIZEN
-            base_task = f"""你是一个网络杠精，要在对话中保持自己的人设。
-            当前场景：{scenario}
-            
-            对话要求：
-            1. 每次回复不超过2句话
-            2. 不要重复使用相同的词汇和句式
-            3. 不要真情实感，保持互怼的状态
-            4. 始终围绕当前场景讨论，不要偏离主题
-            
-            之前的对话记录：
-            {conversation_history}
-            """
-            
-            if is_first_round:
-                if "Agent A" in agent.role:
-                    task_description = base_task + f"""
-                    作为开场，你要针对"{scenario}"这个场景进行犀利的吐槽。
-                    直接点出场景中的槽点，语气要暴躁，不留情面。
-                    """
+        batched = PROVIDER_BATCHING and provider_registry.is_self_hosted(attempt_model)
+        outcome = 'error'
+        try:
+            call_slot = nullcontext() if batched else provider_registry.limit(attempt_model)
+            with call_slot, metrics.time_stage('provider_call', model=attempt_model):
+                if batched:
+                    # Stopping abandons the turn, not the batch: other sessions' turns share its request
+                    result = provider_batcher.submit(
+                        (attempt_model, max_tokens),
+                        prompt_messages(agent.backstory, task.description)
+                    ).strip()
+                    usage = None  # Reported for the whole batch only, so estimated per turn
+                elif is_fake_model(attempt_model):
+                    llm = FakeStreamingLLM(max_tokens=max_tokens)
+                    result = llm_pool.execute(
+                        llm.invoke,
+                        prompt_messages(agent.backstory, task.description)
+                    ).strip()
+                    usage = llm.usage
                 else:
-                    task_description = base_task + f"""
-                    对方刚刚针对"{scenario}"进行了吐槽。
-                    用阴阳怪气的方式回应对方的吐槽，表面温和，实则暗藏杀机。
-                    """
-            else:
-                task_description = base_task + f"""
-                基于当前场景和对话记录，继续进行互怼。
-                抓住对方话语中的破绽和漏洞进行反击。
-                不要简单重复对方的话，而是要找到新的角度进行攻击。
-                保持自己的说话风格。
-                """
-            
-            return Task(
-                description=task_description,
-                expected_output="一个简短但犀利的回复，体现角色特点，不超过2句话。",
-                agent=agent
-            )
+                    # Persona prompts keep their static text first, so automatic prefix caching applies
+                    result, usage = call_crew_agent(agent, task, attempt_model, max_tokens)
+            outcome = 'ok'
+            self.add_token_usage(record_tokens(attempt_model, agent.backstory + task.description, result, usage))
+            return result
+        except greenlet.GreenletExit:
+            outcome = 'cancelled'
+            raise
+        finally:
+            provider_call_counter.inc(model=attempt_model, outcome=outcome)
     
-    def process_agent_turn(self, agent, context, current_round, agent_index, is_first_round=False):
-        agent_name = f"Agent {chr(65 + agent_index)}"
+    def prepare_conversation_task(self, agent, agent_index, is_first_round=False):
+        """Render everything in a turn's task except the conversation history.
         
-        # Emit typing indicator
-        socketio.emit('agentTyping', {
+        Returns a function that builds the task from the history at call time.
+        """
+        with metrics.time_stage('create_conversation_task'):
+            persona = persona_registry.get(self.config.get('personality', DEFAULT_PERSONA))
+            prefix, suffix = persona.task_template(agent_index, is_first_round).split(
+                'conversation_history',
+                scenario=self.config.get('background', '一个场景')
+            )
+        
+        def build_task():
+            with metrics.time_stage('build_task'):
+                return crewai.Task(
+                    description=prefix + self.format_conversation_history() + suffix,
+                    expected_output=persona.expected_output,
+                    agent=agent
+                )
+        return build_task
+    
+    def emit_queue_position(self, model_name, position):
+        self.socket.emit('queuePosition', {'model': model_name, 'position': position})
+    
+    def emit_agent_typing(self, current_round, agent_index):
+        self.socket.emit('agentTyping', {
             'round': current_round,
-            'agent': agent_name
+            'agent': f"Agent {chr(65 + agent_index)}"
         })
         
         # Allow frontend to update
         eventlet.sleep(0)
+    
+    def start_agent_call(self, agent, agent_index, build_task):
+        """Build the turn's task from the current history and start its provider call.
         
-        # Create and execute task
-        task = self.create_conversation_task(
-            agent, 
-            context,
-            is_first_round=is_first_round
-        )
+        A call prefetched for this turn is returned instead of starting another.
+        """
+        model_name = self.get_agent_model(agent_index)
+        pending_call = self.take_prefetched(agent_index, model_name)
+        if pending_call is not None:
+            return pending_call
+        task = build_task()
         
-        crew = Crew(
-            agents=[agent],
-            tasks=[task],
-            verbose=True,
-            process=Process.sequential
-        )
+        def call():
+            try:
+                return self.run_agent_task(agent, task, model_name)
+            except GenerationCancelled:
+                # Returned rather than raised: calls started ahead may never be waited on
+                return None
+        pending_call = spawned_greenlets.spawn(call)
+        pending_call.started_at = time.perf_counter()
+        return pending_call
+    
+    def prefetch_next_turn(self, agents):
+        """Start the next batch's first turn now, for a continuation to pick up.
         
-        result = crew.kickoff()
-        result_str = str(result).strip()
+        Skipped when the server-wide prefetch spend cap is used up.
+        """
+        agent_index = 0
+        model_name = self.get_agent_model(agent_index)
+        if not prefetch_budget.try_take(self.reply_token_limit(model_name)):
+            prefetch_counter.inc(outcome='skipped')
+            return
+        # The finished batch's token is spent; stopping cancels the prefetch through this one
+        self.cancel_token = CancellationToken()
+        build_task = self.prepare_conversation_task(agents[agent_index], agent_index)
+        pending_call = self.start_agent_call(agents[agent_index], agent_index, build_task)
+        self.prefetched = (len(self.conversation_history), agent_index, model_name, pending_call)
+    
+    def take_prefetched(self, agent_index, model_name):
+        """Return the prefetched call if it is for this turn; any other prefetch is dropped."""
+        if self.prefetched is None:
+            return None
+        history_length, prefetched_index, prefetched_model, pending_call = self.prefetched
+        if (history_length, prefetched_index, prefetched_model) != (
+                len(self.conversation_history), agent_index, model_name):
+            self.drop_prefetch()
+            return None
+        self.prefetched = None
+        prefetch_counter.inc(outcome='used')
+        # agent_turn times what the turn is waited on for, not the pause before continuing
+        pending_call.started_at = time.perf_counter()
+        return pending_call
+    
+    def drop_prefetch(self):
+        """Abandon a prefetched turn, e.g. on stop, disconnect or a new conversation."""
+        if self.prefetched is None:
+            return
+        pending_call = self.prefetched[-1]
+        self.prefetched = None
+        pending_call.kill()
+        prefetch_counter.inc(outcome='dropped')
+    
+    def collect_agent_turn(self, pending_call, current_round, agent_index):
+        """Wait for a turn's provider call and add the reply to the conversation history.
         
-        # Store message in conversation history
-        self.conversation_history.append({
-            'round': current_round,
-            'agent': agent_name,
-            'message': result_str
-        })
+        Returns the history item, or None if stop_conversation() aborted the call.
+        """
+        result_str = pending_call.wait()
+        if result_str is None:
+            # stop_conversation() aborted the in-flight call; drop the partial turn
+            return None
+        # From the provider call starting to its reply being ready
+        metrics.observe_stage('agent_turn', time.perf_counter() - pending_call.started_at,
+                              model=self.get_agent_model(agent_index))
         
-        # Emit response immediately
-        socketio.emit('conversationUpdate', {
-            'round': current_round,
-            'agent': agent_name,
-            'message': result_str
-        })
+        return self.add_turn(current_round, agent_index, result_str)
+    
+    def publish_agent_turn(self, history_item):
+        """Persist a collected turn and send it to the client."""
+        with metrics.time_stage('publish_turn'):
+            self.store_chat_history(self.session_id, history_item)
+            
+            # Emit response immediately
+            self.socket.emit('conversationUpdate', history_item)
+            self.save_state()
         
         # Allow frontend to update
         eventlet.sleep(0)
+    
+    def process_agent_turn(self, agent, context, current_round, agent_index, is_first_round=False):
+        """Run one turn start to finish; the unpipelined path through run_turns."""
+        self.emit_agent_typing(current_round, agent_index)
+        
+        # Create and execute task
+        build_task = self.prepare_conversation_task(agent, agent_index, is_first_round=is_first_round)
+        pending_call = self.start_agent_call(agent, agent_index, build_task)
+        history_item = self.collect_agent_turn(pending_call, current_round, agent_index)
+        if history_item is None:
+            return context
+        
+        self.publish_agent_turn(history_item)
+        return history_item['message']
+    
+    def emit_round_update(self, current_round):
+        self.socket.emit('roundUpdate', self.round_update(current_round))
+        eventlet.sleep(0)
+    
+    def run_turns(self, agents, turns):
+        """Run a batch of (round, agent_index, is_first_round) turns in order.
+        
+        When pipelining, the next turn's task is pre-rendered while the
+        current call is in flight, and the next call starts before the
+        current reply is stored and emitted. With parallel opening, both
+        agents' first turns of a new conversation are requested at once;
+        the second agent then opens from its own opening instruction,
+        without seeing the first one's reply.
+        """
+        if not self.config.get('pipeline_turns', PIPELINE_TURNS):
+            context = self.config['background']
+            for index, (current_round, agent_index, is_first_round) in enumerate(turns):
+                if self.stop_requested or self.response_budget_exhausted():
+                    return
+                context = self.process_agent_turn(
+                    agents[agent_index], context, current_round, agent_index, is_first_round
+                )
+                if self.stop_requested:
+                    return
+                if (index == len(turns) - 1 or turns[index + 1][0] != current_round
+                        or self.response_budget_exhausted()):
+                    self.emit_round_update(current_round)
+            return
+        
+        if not turns or self.stop_requested or self.response_budget_exhausted():
+            return
         
-        return result_str
+        def prepare(index):
+            _, agent_index, is_first_round = turns[index]
+            return self.prepare_conversation_task(agents[agent_index], agent_index, is_first_round=is_first_round)
+        
+        pending_calls = {0: self.start_agent_call(agents[turns[0][1]], turns[0][1], prepare(0))}
+        try:
+            parallel_opening = (
+                self.config.get('parallel_opening') and not self.conversation_history and len(turns) > 1
+            )
+            if parallel_opening:
+                # Both agents open: the second one's first turn uses its opening instruction too
+                turns[1] = turns[1][:2] + (True,)
+                pending_calls[1] = self.start_agent_call(agents[turns[1][1]], turns[1][1], prepare(1))
+            self.emit_agent_typing(turns[0][0], turns[0][1])
+            
+            for index, (current_round, agent_index, _) in enumerate(turns):
+                has_next = index + 1 < len(turns) and not self.stop_requested
+                
+                # Pre-render the next task while this call is in flight
+                next_task = prepare(index + 1) if has_next and index + 1 not in pending_calls else None
+                
+                history_item = self.collect_agent_turn(pending_calls.pop(index), current_round, agent_index)
+                if history_item is None:
+                    return
+                
+                # Start the next call before the bookkeeping for this one
+                has_next = has_next and not self.stop_requested and not self.response_budget_exhausted()
+                if has_next and next_task:
+                    next_agent_index = turns[index + 1][1]
+                    pending_calls[index + 1] = self.start_agent_call(
+                        agents[next_agent_index], next_agent_index, next_task
+                    )
+                
+                self.publish_agent_turn(history_item)
+                if not has_next:
+                    if not self.stop_requested:
+                        self.emit_round_update(current_round)
+                    return
+                if turns[index + 1][0] != current_round:
+                    self.emit_round_update(current_round)
+                self.emit_agent_typing(turns[index + 1][0], turns[index + 1][1])
+        finally:
+            # Calls started ahead of a stop or error are abandoned
+            for pending_call in pending_calls.values():
+                pending_call.kill()
     
     def run_conversation(self, data):
+        self.is_running = True
         try:
             self.config = self.parse_user_input(data)
             if not self.is_continuation:
-                self.conversation_history = []  # Reset only for new conversations
+                # Reset only for new conversations
+                self.conversation_history = []
+                self.history_context.clear()
             
             self.stop_requested = False
+            if not (self.is_continuation and self.prefetched):
+                self.drop_prefetch()
+                self.cancel_token = CancellationToken()
+            self.save_state()
             agents = self.create_agents()
-            context = self.config['background']
             
             # Initial round update
-            socketio.emit('roundUpdate', {
+            self.socket.emit('roundUpdate', {
                 'round': self.current_round + 1,
-                'total': self.total_rounds
+                'total': self.total_rounds,
+                'usage': self.usage_report()
             })
             eventlet.sleep(0)
             
             # Run for 3 rounds at a time
-            rounds_per_batch = 3
-            start_round = self.current_round
-            end_round = min(start_round + rounds_per_batch, self.total_rounds)
-            
-            for round in range(start_round, end_round):
-                if self.stop_requested:
-                    break
-                    
-                self.current_round = round + 1
-                
-                for agent_index, agent in enumerate(agents):
-                    if self.stop_requested:
-                        break
-                        
-                    context = self.process_agent_turn(
-                        agent,
-                        context,
-                        self.current_round,
-                        agent_index,
-                        is_first_round=(round == 0 and agent_index == 0)
-                    )
-                
-                # Update round progress
-                socketio.emit('roundUpdate', {
-                    'round': self.current_round,
-                    'total': self.total_rounds,
-                    'can_continue': self.current_round < self.total_rounds
-                })
-                eventlet.sleep(0)
+            self.run_turns(agents, self.batch_turns(len(agents)))
             
             if self.stop_requested:
-                socketio.emit('conversationStopped', {
-                    'current_round': self.current_round,
-                    'can_continue': self.current_round < self.total_rounds
-                })
-            elif self.current_round >= self.total_rounds:
-                socketio.emit('conversationComplete')
+                self.socket.emit('conversationStopped', self.stopped_update())
+                report_stop_latency(self.cancel_token, 'Conversation')
             else:
-                socketio.emit('batchComplete', {
-                    'current_round': self.current_round,
-                    'can_continue': True
-                })
+                event, update = self.batch_end()
+                self.socket.emit(event, update)
+                if event == 'batchComplete' and self.config.get('prefetch_next_batch', PREFETCH_NEXT_BATCH):
+                    self.prefetch_next_turn(agents)
             
+        except RateLimited as error:
+            self.socket.emit('error', {'message': str(error), 'retry_after': error.retry_after})
         except Exception as error:
             print(f"Error in conversation: {str(error)}")
-            socketio.emit('error', {'message': str(error)})
+            self.socket.emit('error', {'message': str(error)})
+        finally:
+            self.is_running = False
+            self.save_state()
     
     def stop_conversation(self):
         self.stop_requested = True
+        self.cancel_token.cancel()
+        self.drop_prefetch()
+
+
+class SessionEventBus:
+    """Deliver a session's events to its own room instead of broadcasting to every client."""
+    
+    def __init__(self, socket, room):
+        self.socket = socket
+        self.room = room
+    
+    def emit(self, event, data=None, **kwargs):
+        if data is None:
+            self.socket.emit(event, room=self.room, **kwargs)
+        else:
+            self.socket.emit(event, data, room=self.room, **kwargs)
+
+def session_room(session_key):
+    """Name of the Socket.IO room that receives a session's events."""
+    return f"session:{session_key}"
+
+class OrchestratorRegistry(ConversationRegistry):
+    """Keep one orchestrator per session, its events going to the session's room on ``socket``.
+    
+    Stop requests relayed through a shared ``state_store`` are picked up by
+    a background greenlet.
+    """
+    
+    def __init__(self, socket, state_store=None, max_sessions=ORCHESTRATOR_MAX_SESSIONS,
+                 idle_ttl=ORCHESTRATOR_IDLE_TTL, worker_id=WORKER_ID):
+        super().__init__(self.create_orchestrator, state_store, max_sessions, idle_ttl, worker_id)
+        self.socket = socket
+        if state_store is not None:
+            state_store.subscribe_stops(self.stop_local)
+    
+    def create_orchestrator(self, session_key):
+        return ConversationOrchestrator(
+            SessionEventBus(self.socket, session_room(session_key)),
+            session_key,
+            self.state_store
+        )
+
+session_state = create_session_state_store(ORCHESTRATOR_IDLE_TTL, ORCHESTRATOR_MAX_SESSIONS)
+
+orchestrators = OrchestratorRegistry(socketio, session_state)
+
+# Cancellation tokens for in-flight single AI generations, by socket id
+active_generations = {}
+
+def get_session_key(data=None):
+    """Resolve the registry key for a request: the client's session_id or its socket id."""
+    return (data or {}).get('session_id') or request.sid
+
+def join_session(session_key):
+    """Subscribe the requesting client to a session's events."""
+    join_room(session_room(session_key))
+
+def emit_rate_limited(error, sid):
+    socketio.emit('error', {'message': str(error), 'retry_after': error.retry_after}, room=sid)
+
+def client_address():
+    """The requesting client's address, which keeps its rate limit across reconnects and their new socket ids."""
+    return request.remote_addr or request.sid
+
+def admit_request():
+    """Count a request that starts provider work; tell the client and return False if it is over its limit."""
+    try:
+        request_limiter.check(client_address())
+    except RateLimited as error:
+        emit_rate_limited(error, request.sid)
+        return False
+    return True
+
+def wait_for_provider_slot(sid, model):
+    """Wait for the model's rate limit, telling the client its place in line meanwhile."""
+    provider_scheduler.wait_for_slot(
+        model,
+        sid,
+        lambda position: socketio.emit('queuePosition', {'model': model, 'position': position}, room=sid)
+    )
+
+metrics.gauge_callback(
+    "multiai_greenlets", "Live greenlets running conversations, provider calls and worker pool waits.",
+    lambda: spawned_greenlets.live
+)
+metrics.gauge_callback(
+    "multiai_active_conversations", "Simulator conversations running in this worker.",
+    lambda: sum(orchestrator.is_running for orchestrator in list(orchestrators.sessions.values()))
+)
+metrics.gauge_callback("multiai_sessions", "Sessions held by this worker's registry.", lambda: len(orchestrators.sessions))
+metrics.gauge_callback("multiai_active_generations", "Single AI generations in flight.", lambda: len(active_generations))
+metrics.gauge_callback("multiai_llm_pool_active", "Blocking LLM calls running on worker threads.", lambda: llm_pool.active)
+metrics.gauge_callback("multiai_llm_pool_waiting", "Blocking LLM calls waiting for a worker thread.", lambda: llm_pool.waiting)
+metrics.gauge_callback(
+    "multiai_provider_queue_depth", "Provider calls waiting for a model's rate limit.",
+    lambda: [({'model': model_name}, depth) for model_name, depth in provider_scheduler.stats().items()]
+)
+metrics.counter_callback(
+    "multiai_response_cache_total", "Response cache lookups by result.",
+    lambda: [({'result': 'hit'}, response_cache.hits), ({'result': 'miss'}, response_cache.misses)] if response_cache else []
+)
+metrics.counter_callback(
+    "multiai_agent_cache_total", "Agent cache lookups by result.",
+    lambda: [({'result': 'hit'}, agent_cache.hits), ({'result': 'miss'}, agent_cache.misses)]
+)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @socketio.on('connect')
 def handle_connect():
@@ -603,169 +716,345 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     print('Client disconnected:', request.sid)
+    orchestrators.release_sid(request.sid)
+    cancel_token = active_generations.pop(request.sid, None)
+    if cancel_token:
+        cancel_token.cancel()
 
 @socketio.on('stopConversation')
-def handle_stop_conversation():
+def handle_stop_conversation(data=None):
     print('Stop conversation requested by:', request.sid)
-    orchestrator = ConversationOrchestrator(socketio)
-    orchestrator.stop_conversation()
-    socketio.emit('conversationStopped')
+    if data and data.get('session_id'):
+        if not orchestrators.can_access(data['session_id'], request.sid, data.get('access_token')):
+            socketio.emit('error', {'message': 'Not allowed to stop this session'}, room=request.sid)
+            return
+        # The conversation may be running on another worker
+        orchestrators.stop(data['session_id'])
+    else:
+        for orchestrator in orchestrators.sessions_for_sid(request.sid):
+            orchestrator.stop_conversation()
+    socketio.emit('conversationStopped', room=request.sid)
+
+@socketio.on('joinSession')
+def handle_join_session(data):
+    """Observe a session's conversation, wherever it runs, and get its current state.
+    
+    Other clients' sessions need the access token sent to their starter.
+    """
+    session_id = get_session_key(data)
+    if not orchestrators.can_access(session_id, request.sid, (data or {}).get('access_token')):
+        socketio.emit('error', {'message': 'Not allowed to join this session'}, room=request.sid)
+        return
+    # Joined sessions can be stopped and continued from this socket, like started ones
+    orchestrators.bind_sid(request.sid, session_id)
+    join_session(session_id)
+    orchestrator = orchestrators.get(session_id)
+    if orchestrator is not None and orchestrator.is_running:
+        snapshot = orchestrator.snapshot()
+    else:
+        snapshot = orchestrators.load_state(session_id)
+    socketio.emit('sessionState', {'session_id': session_id, 'state': public_state(snapshot)}, room=request.sid)
 
 @socketio.on('getChatHistory')
 def handle_get_chat_history(data):
     """Handle request for chat history."""
-    session_id = data.get('session_id', 'default')
-    orchestrator = ConversationOrchestrator(socketio)
-    history = orchestrator.get_chat_history(session_id)
-    socketio.emit('chatHistory', {'history': history})
+    session_id = get_session_key(data)
+    if not orchestrators.can_access(session_id, request.sid, (data or {}).get('access_token')):
+        socketio.emit('error', {'message': "Not allowed to read this session's history"}, room=request.sid)
+        return
+    try:
+        limit, before_id = page_request(data, CHAT_HISTORY_PAGE_SIZE)
+    except ValueError as error:
+        socketio.emit('error', {'message': str(error)}, room=request.sid)
+        return
+    history, next_cursor = chat_history_store.read(session_id, limit=limit, before_id=before_id)
+    socketio.emit('chatHistory', {'history': history, 'next_cursor': next_cursor}, room=request.sid)
 
 @socketio.on('clearChatHistory')
 def handle_clear_chat_history(data):
     """Handle request to clear chat history."""
-    session_id = data.get('session_id', 'default')
-    orchestrator = ConversationOrchestrator(socketio)
-    orchestrator.clear_chat_history(session_id)
-    socketio.emit('chatHistoryCleared', {'session_id': session_id})
+    session_id = get_session_key(data)
+    if not orchestrators.can_access(session_id, request.sid, (data or {}).get('access_token')):
+        socketio.emit('error', {'message': "Not allowed to clear this session's history"}, room=request.sid)
+        return
+    chat_history_store.clear(session_id)
+    socketio.emit('chatHistoryCleared', {'session_id': session_id}, room=request.sid)
 
 @socketio.on('voiceInput')
 def handle_voice_input(data):
     """Handle voice input from client."""
     audio_data = data.get('audio')
-    session_id = data.get('session_id', 'default')
-    orchestrator = ConversationOrchestrator(socketio)
+    session_id = get_session_key(data)
+    if not admit_request():
+        return
+    try:
+        orchestrator = orchestrators.get_or_create(session_id, request.sid)
+    except RuntimeError as error:
+        socketio.emit('error', {'message': str(error)}, room=request.sid)
+        return
     
     # Process voice input
     text = orchestrator.process_voice_input(audio_data)
     if text:
         # If voice processing successful, start conversation with transcribed text
         data['prompt'] = text
-        eventlet.spawn(orchestrator.run_conversation, data)
+        join_session(session_id)
+        spawned_greenlets.spawn(orchestrator.run_conversation, data)
     else:
-        socketio.emit('error', {'message': 'Voice input processing failed'})
+        socketio.emit('error', {'message': 'Voice input processing failed'}, room=request.sid)
 
 @socketio.on('getModelConfig')
 def handle_get_model_config():
     """Handle request for model configuration."""
-    socketio.emit('modelConfig', {'config': MODEL_CONFIGS})
+    socketio.emit('modelConfig', {'config': MODEL_CONFIGS}, room=request.sid)
+
+@socketio.on('getPersonas')
+def handle_get_personas():
+    """Handle request for the available conversation personas."""
+    socketio.emit('personas', {'personas': persona_registry.summaries()}, room=request.sid)
 
 @socketio.on('startConversation')
 def handle_start_conversation(data):
     """Handle start conversation request with enhanced features."""
     if not data.get('prompt') and not data.get('is_continuation'):
-        socketio.emit('error', {'message': 'No prompt provided'})
+        socketio.emit('error', {'message': 'No prompt provided'}, room=request.sid)
+        return
+    if not admit_request():
         return
     
-    # Store session ID for chat history
-    session_id = data.get('session_id', 'default')
+    # Reuse the session's orchestrator so stop/continue/history reach it
+    session_id = get_session_key(data)
+    if orchestrators.access_token_hash(session_id) and not orchestrators.can_access(
+            session_id, request.sid, data.get('access_token')):
+        socketio.emit('error', {'message': 'Not allowed to continue this session'}, room=request.sid)
+        return
+    try:
+        orchestrator = orchestrators.get_or_create(session_id, request.sid)
+    except RuntimeError as error:
+        socketio.emit('error', {'message': str(error)}, room=request.sid)
+        return
+    if orchestrator.access_token_hash is None:
+        # Lets the client rejoin, stop or continue the session from another connection
+        access_token, orchestrator.access_token_hash = issue_access_token()
+        socketio.emit('sessionToken', {'session_id': session_id, 'access_token': access_token}, room=request.sid)
     
-    # Create orchestrator instance
-    orchestrator = ConversationOrchestrator(socketio)
+    if orchestrator.is_running or orchestrators.is_running_elsewhere(session_id):
+        socketio.emit('error', {'message': 'Conversation already running'}, room=request.sid)
+        return
+    
+    # Conversation events go to the session's room only
+    join_session(session_id)
     
     # Start conversation in a new greenlet
-    eventlet.spawn(orchestrator.run_conversation, data)
+    spawned_greenlets.spawn(orchestrator.run_conversation, data)
+
+def stream_single_ai_response(sid, model, model_config, system_message, message, cache_key=None):
+    """Forward provider tokens to the requesting client as they arrive, coalesced into fewer packets."""
+    stream = StreamEmitter(
+        lambda payload: socketio.emit('messageStream', payload, room=sid),
+        STREAM_FLUSH_INTERVAL,
+        STREAM_FLUSH_BYTES
+    )
+    try:
+        # Model tag goes out first so the client can render before the first token
+        stream.write(f"[{model}] ")
+        
+        response = response_cache.get(cache_key) if cache_key else None
+        if response is not None:
+            stream.write(response)
+        else:
+            llm = create_streaming_llm(provider_registry.chat_model(model))
+            messages = prompt_messages(
+                system_message,
+                message,
+                static_prefix=SINGLE_AI_SYSTEM_MESSAGE.format(model=model),
+                provider=model_config['provider']
+            )
+            wait_for_provider_slot(sid, model)
+            tokens = []
+            with provider_registry.limit(model):
+                call_started = time.perf_counter()
+                for token in llm.stream(messages):
+                    tokens.append(token)
+                    stream.write(token)
+                    if len(tokens) == 1:
+                        # The first token goes out at once, whatever the window
+                        stream.flush()
+                        metrics.observe_stage('single_ai_first_token', time.perf_counter() - call_started, model=model)
+            response = ''.join(tokens)
+            record_tokens(model, system_message + message, response, llm.usage)
+            if cache_key:
+                response_cache.set(cache_key, response)
+        
+        # The last tokens go out with the completion marker
+        stream.close()
+        return response
+    finally:
+        # Stopped mid-stream: drop buffered tokens and the pending flush
+        stream.discard()
+
+def get_single_ai_agent(model, model_config):
+    """Return the cached single AI chat agent for a model."""
+    def build_agent():
+        return crewai.Agent(
+            role='AI Assistant',
+            goal='Provide helpful and contextually aware responses to user queries',
+            backstory=SINGLE_AI_SYSTEM_MESSAGE.format(model=model),
+            **AGENT_OPTIONS
+        )
+    return agent_cache.get_or_create(('SINGLE_AI', model), build_agent)
 
 @socketio.on('singleAIMessage')
 def handle_single_ai_message(data):
     """Handle single AI chat messages with streaming support and context awareness."""
     message = data.get('message')
-    context = data.get('context', '')  # Get previous context if available
-    session_id = data.get('session_id', 'default')
+    session_id = get_session_key(data)
     model = data.get('model', MODEL_CONFIGS.get("default_model"))  # Get specified model or use default
+    # Previous context if available, keeping its most recent part within the model's budget
+    context = truncate_to_tokens(
+        data.get('context', ''),
+        token_budget([model], SINGLE_AI_CONTEXT_TOKENS, window_fraction=0.5)
+    )
     
     if not message:
         socketio.emit('error', {'message': 'No message provided'}, room=request.sid)
         return
+    if orchestrators.access_token_hash(session_id) and not orchestrators.can_access(
+            session_id, request.sid, data.get('access_token')):
+        socketio.emit('error', {'message': "Not allowed to add to this session's history"}, room=request.sid)
+        return
+    # Lets this socket read back the history it writes under its own session_id
+    orchestrators.bind_sid(request.sid, session_id)
+    if not admit_request():
+        return
+    
+    # Register the generation so stopGeneration can abort it
+    cancel_token = CancellationToken()
+    active_generations[request.sid] = cancel_token
+    started = time.perf_counter()
         
     try:
-        # Create system message with context and model info
-        system_message = """You are a helpful AI assistant that provides clear and concise responses.
-        You are currently running as the {model} model.
-        Maintain a natural, conversational tone while being informative and accurate.
+        chat_history_store.append(session_id, {'role': 'user', 'content': message, 'model': model})
         
-        Previous conversation context:
-        {context}
-        
-        Remember the context above when responding to the user's next message.""".format(
-            model=model,
+        # Create system message with context and model info
+        system_message = SINGLE_AI_SYSTEM_MESSAGE.format(model=model) + SINGLE_AI_CONTEXT_MESSAGE.format(
             context=context
         )
         
         # Get model configuration
         model_config = get_model_config(model)
+        if not model_config:
+            raise ValueError(f"Invalid model configuration for {model}")
         
-        # Create an agent for single AI chat with context
-        agent = Agent(
-            role='AI Assistant',
-            goal='Provide helpful and contextually aware responses to user queries',
-            backstory=system_message,
-            allow_delegation=False,
-            verbose=True,
-            llm_model=model,  # Use the specified model
-            **model_config  # Add model-specific configuration
-        )
-        
-        # Create a task for the agent
-        task = Task(
-            description=message,
-            expected_output="A helpful and contextually relevant response to the user's query.",
-            agent=agent
-        )
-        
-        # Create a crew with just this agent
-        crew = Crew(
-            agents=[agent],
-            tasks=[task],
-            verbose=True,
-            process=Process.sequential
-        )
-        
-        # Get the response
-        response = str(crew.kickoff()).strip()
-        
-        # Add model information to the response
-        response = f"[{model}] {response}"
+        cache_key = None
+        if response_cache and data.get('use_cache', True):
+            # Single AI replies are not capped
+            cache_key = ResponseCache.make_key(model, system_message, message, None)
         
-        # Split response into words instead of characters
-        words = response.split()
-        chunks = []
-        current_chunk = []
+        if data.get('stream', SINGLE_AI_STREAMING):
+            response = run_cancellable(
+                cancel_token,
+                stream_single_ai_response,
+                request.sid, model, model_config, system_message, message, cache_key
+            )
+            chat_history_store.append(session_id, {'role': 'assistant', 'content': response, 'model': model})
+            return
         
-        # Group words into chunks
-        for word in words:
-            current_chunk.append(word)
-            if len(' '.join(current_chunk)) >= 10:  # Adjust chunk size based on word count
-                chunks.append(' '.join(current_chunk))
-                current_chunk = []
+        # Get the response, from the cache when this exact prompt was answered before
+        response = response_cache.get(cache_key) if cache_key else None
+        if response is None and is_fake_model(model):
+            run_cancellable(cancel_token, wait_for_provider_slot, request.sid, model)
+            response = run_cancellable(
+                cancel_token,
+                llm_pool.execute,
+                FakeStreamingLLM().invoke,
+                prompt_messages(system_message, message)
+            ).strip()
+            record_tokens(model, system_message + message, response)
+            if cache_key:
+                response_cache.set(cache_key, response)
+        elif response is None:
+            # Reuse the model's agent; the per-message context goes into the task
+            agent = get_single_ai_agent(model, model_config)
+            
+            # Create a task for the agent
+            task = crewai.Task(
+                description=SINGLE_AI_CONTEXT_MESSAGE.format(context=context).strip() + "\n\n" + message,
+                expected_output="A helpful and contextually relevant response to the user's query.",
+                agent=agent
+            )
+            
+            run_cancellable(cancel_token, wait_for_provider_slot, request.sid, model)
+            with provider_registry.limit(model):
+                response, usage = run_cancellable(cancel_token, call_crew_agent, agent, task, model)
+            record_tokens(model, system_message + message, response, usage)
+            if cache_key:
+                response_cache.set(cache_key, response)
         
-        # Add any remaining words
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
+        chat_history_store.append(session_id, {'role': 'assistant', 'content': response, 'model': model})
         
-        # Stream the chunks
-        for i, chunk in enumerate(chunks):
-            # Add space between chunks if not at the start
-            if i > 0:
-                chunk = ' ' + chunk
-            
-            # Small delay between chunks
-            eventlet.sleep(0.05)  # 50ms delay between chunks
+        # Send the finished response in pieces of the streaming packet size
+        pieces = split_text(f"[{model}] {response}", STREAM_FLUSH_BYTES)
+        for index, piece in enumerate(pieces):
+            # Let other greenlets run between pieces
+            eventlet.sleep(0)
+            cancel_token.raise_if_cancelled()
             
-            # Send chunk with completion status
             socketio.emit('messageStream', {
-                'content': chunk,
-                'isComplete': i == len(chunks) - 1
+                'content': piece,
+                'isComplete': index == len(pieces) - 1
             }, room=request.sid)
             
+    except GenerationCancelled:
+        socketio.emit('messageStream', {
+            'content': '',
+            'isComplete': True,
+            'stopped': True
+        }, room=request.sid)
+        report_stop_latency(cancel_token, 'Generation')
+    except RateLimited as error:
+        emit_rate_limited(error, request.sid)
     except Exception as error:
         print(f"Error in single AI conversation: {str(error)}")
         socketio.emit('error', {'message': str(error)}, room=request.sid)
+    finally:
+        metrics.observe_stage('single_ai_message', time.perf_counter() - started, model=model)
+        if active_generations.get(request.sid) is cancel_token:
+            del active_generations[request.sid]
 
 @socketio.on('stopGeneration')
 def handle_stop_generation():
     """Handle request to stop AI response generation."""
-    # TODO: Implement actual stopping mechanism
-    socketio.emit('message', {'content': '[Generation stopped by user]'})
+    cancel_token = active_generations.get(request.sid)
+    if cancel_token:
+        # Kills the provider request and the chunk emitter for this client
+        cancel_token.cancel()
+    socketio.emit('message', {'content': '[Generation stopped by user]'}, room=request.sid)
+
+def warm_up():
+    """Load what the first requests need, once the server already accepts connections.
+    
+    Runs on the hub, which it holds up while the imports run: their green
+    locks and timers must belong to the hub's thread, not a tpool thread's.
+    """
+    started = time.perf_counter()
+    try:
+        crewai.load()
+        default_model = MODEL_CONFIGS.get("default_model")
+        if default_model:
+            # Imports the provider's LangChain package and creates its pooled client
+            provider_registry.chat_model(default_model)
+        # tiktoken's encoding is loaded, or downloaded, on first use
+        estimate_tokens("warm up")
+    except Exception as error:
+        print(f"Warm-up failed, loading on first use instead: {str(error)}")
+    metrics.observe_stage('warm_up', time.perf_counter() - started)
+    print(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+if STARTUP_WARMUP:
+    # Starts at the hub's first switch, when the server is already listening
+    eventlet.spawn(warm_up)
 
 if __name__ == '__main__':
     print("Starting server with eventlet...")
-    socketio.run(app, port=5000, debug=True) 
\ No newline at end of file
+    socketio.run(app, port=int(os.getenv("PORT", "5000")), debug=True) 
\ No newline at end of file
@@ -0,0 +1,715 @@
+"""Asyncio serving mode: the Socket.IO events of app.py on an ASGI server, without eventlet.
+
+    uvicorn asgi_app:app --port 5000
+
+Provider calls use the chat models' async clients, so no worker threads
+are needed. The simulator calls the models with the persona prompts
+directly rather than through CrewAI, and provider calls wait for their
+model's rate limit in one line rather than in per-session queues.
+Settings, conversation state and multi-worker mode (SOCKETIO_MESSAGE_QUEUE
+and SESSION_STATE_URL) are shared with app.py; calls to a Redis state
+store are single round trips made on the event loop.
+"""
+import asyncio
+import os
+import time
+
+import socketio
+
+from admission import AsyncRateLimiter, RateLimited, SessionRateLimiter, TokenBucket
+from batching import AsyncRequestCoalescer
+from config import (
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, CHAT_HISTORY_MAX_ITEMS, CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_PATH, METRICS_LOG,
+    ORCHESTRATOR_IDLE_TTL, ORCHESTRATOR_MAX_SESSIONS, PIPELINE_TURNS, PREFETCH_NEXT_BATCH, PREFETCH_TOKENS_PER_MINUTE,
+    PROVIDER_BATCHING, PROVIDER_MAX_CONCURRENCY, PROVIDER_MAX_CONNECTIONS, PROVIDER_QUEUE_LIMIT,
+    PROVIDER_REQUESTS_PER_MINUTE, PROVIDER_REQUEST_BURST, SESSION_REQUESTS_PER_MINUTE, SESSION_REQUEST_BURST,
+    SINGLE_AI_CONTEXT_TOKENS, SINGLE_AI_STREAMING, SOCKETIO_MESSAGE_QUEUE, SOCKETIO_SERIALIZER, STREAM_FLUSH_BYTES,
+    STREAM_FLUSH_INTERVAL
+)
+from context_window import token_budget, truncate_to_tokens
+from conversation import Conversation, ConversationRegistry
+from history_store import ChatHistoryStore, page_request
+from llm import create_streaming_llm, estimate_tokens, instruct_prompt, prompt_messages
+from metrics import MetricsRegistry
+from model_configs import MODEL_CONFIGS
+from personas import (
+    DEFAULT_PERSONA, PERSONA_DIR, SINGLE_AI_CONTEXT_MESSAGE, SINGLE_AI_SYSTEM_MESSAGE, PersonaRegistry
+)
+from providers import ProviderRegistry
+from resilience import create_resilience_policy
+from response_cache import ResponseCache, create_response_cache
+from session_state import create_session_state_store, issue_access_token, public_state
+from streaming import coalesce_stream, split_text
+
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    cors_allowed_origins='*',
+    client_manager=socketio.AsyncRedisManager(SOCKETIO_MESSAGE_QUEUE) if SOCKETIO_MESSAGE_QUEUE else None,
+    serializer=SOCKETIO_SERIALIZER
+)
+
+# Shared provider clients; chat models get pooled async HTTP clients too
+provider_registry = ProviderRegistry(
+    MODEL_CONFIGS, PROVIDER_MAX_CONNECTIONS, PROVIDER_MAX_CONCURRENCY, async_clients=True
+)
+persona_registry = PersonaRegistry(os.getenv("PERSONA_DIR", PERSONA_DIR))
+response_cache = create_response_cache()
+chat_history_store = ChatHistoryStore(CHAT_HISTORY_PATH, CHAT_HISTORY_MAX_ITEMS)
+
+llm_resilience = create_resilience_policy(MODEL_CONFIGS.get("default_model"))
+
+request_limiter = SessionRateLimiter(SESSION_REQUESTS_PER_MINUTE, SESSION_REQUEST_BURST)
+provider_limiter = AsyncRateLimiter(PROVIDER_REQUESTS_PER_MINUTE, PROVIDER_REQUEST_BURST, PROVIDER_QUEUE_LIMIT)
+
+metrics = MetricsRegistry(log_stages=METRICS_LOG)
+token_counter = metrics.counter(
+    "multiai_tokens_total",
+    "Prompt, cached prompt and completion tokens of provider calls by model; estimated when the provider reports none."
+)
+provider_call_counter = metrics.counter("multiai_provider_calls_total", "Provider call attempts by model and outcome.")
+provider_batch_counter = metrics.counter(
+    "multiai_provider_batches_total", "Batched completions requests to self-hosted models, by model."
+)
+batched_turn_counter = metrics.counter(
+    "multiai_provider_batched_turns_total", "Simulator turns sent in batched requests, by model."
+)
+prefetch_budget = TokenBucket(PREFETCH_TOKENS_PER_MINUTE / 60, PREFETCH_TOKENS_PER_MINUTE)
+prefetch_counter = metrics.counter(
+    "multiai_prefetch_turns_total",
+    "Next-batch turns generated ahead, by outcome: used, dropped, or skipped by the spend cap."
+)
+
+
+async def send_provider_batch(key, requests):
+    """Send a batch of coalesced turns for one model and reply limit as one completions request."""
+    model_name, max_tokens = key
+    provider_batch_counter.inc(model=model_name)
+    batched_turn_counter.inc(len(requests), model=model_name)
+    async with provider_registry.async_limit(model_name):
+        return await provider_registry.acomplete_batch(
+            model_name, [instruct_prompt(messages) for messages in requests], max_tokens
+        )
+
+
+provider_batcher = AsyncRequestCoalescer(send_provider_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS / 1000)
+
+
+def record_tokens(model_name, prompt, completion, usage=None):
+    """Count a provider call's tokens, from the provider's usage report when there is one.
+
+    Returns the counts, estimated or reported.
+    """
+    if usage is None:
+        usage = {'prompt': estimate_tokens(prompt), 'completion': estimate_tokens(completion), 'cached': 0}
+    token_counter.inc(usage['prompt'], model=model_name, kind='prompt')
+    token_counter.inc(usage['completion'], model=model_name, kind='completion')
+    if usage['cached']:
+        token_counter.inc(usage['cached'], model=model_name, kind='cached_prompt')
+    return usage
+
+
+async def call_model(model_name, system, human, static_prefix="", max_tokens=None, batch=False):
+    """Call a model after waiting for its rate limit, with retries, timeout and fallback.
+
+    Returns the reply, its token usage and the model that gave it, the
+    fallback model when it had to step in. ``max_tokens`` is a function of
+    the model answering, or None for no limit. With ``batch`` and
+    PROVIDER_BATCHING, self-hosted models get the call in a batch with other
+    sessions' calls.
+    """
+    async def attempt(attempt_model):
+        with metrics.time_stage('provider_queue', model=attempt_model):
+            await provider_limiter.wait_for_slot(attempt_model)
+        limit = max_tokens(attempt_model) if max_tokens else None
+        outcome = 'error'
+        try:
+            if batch and PROVIDER_BATCHING and provider_registry.is_self_hosted(attempt_model):
+                with metrics.time_stage('provider_call', model=attempt_model):
+                    result = (await provider_batcher.submit(
+                        (attempt_model, limit), prompt_messages(system, human)
+                    )).strip()
+                usage = None
+            else:
+                llm = create_streaming_llm(provider_registry.chat_model(attempt_model, limit), limit)
+                provider = provider_registry.get_model_config(attempt_model)['provider']
+                async with provider_registry.async_limit(attempt_model):
+                    with metrics.time_stage('provider_call', model=attempt_model):
+                        result = (await llm.ainvoke(prompt_messages(system, human, static_prefix, provider))).strip()
+                usage = llm.usage
+            outcome = 'ok'
+            return result, record_tokens(attempt_model, system + human, result, usage), attempt_model
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
+        finally:
+            provider_call_counter.inc(model=attempt_model, outcome=outcome)
+
+    return await llm_resilience.acall(attempt, model_name)
+
+
+def session_room(session_key):
+    """Name of the Socket.IO room that receives a session's events."""
+    return f"session:{session_key}"
+
+
+def abandon_reply(reply):
+    """Let go of a reply task nobody will wait for: cancel it, or retrieve its error if it already failed."""
+    if reply.done():
+        if not reply.cancelled():
+            reply.exception()  # Retrieved, so a failed reply is not reported as unhandled
+    else:
+        reply.cancel()
+
+
+class AsyncConversation(Conversation):
+    """One session's simulator conversation, run as an asyncio task.
+
+    Emits the same events as app.py's ConversationOrchestrator; stopping
+    cancels the task, and with it the provider calls in flight.
+    """
+
+    def __init__(self, session_id, state_store=None):
+        super().__init__(session_id, state_store)
+        self.room = session_room(session_id)
+        self.task = None
+        self.is_running = False
+
+    async def emit(self, event, data=None):
+        await sio.emit(event, data, room=self.room)
+
+    def agent_system_prompt(self, template, scenario):
+        """The system prompt CrewAI would build for the agent: its static part first."""
+        static_prefix = f"You are {template.role}. {template.backstory.static_prefix}"
+        system = (
+            f"You are {template.role}. {template.backstory.render(scenario=scenario)}\n"
+            f"Your personal goal is: {template.goal.render(scenario=scenario)}"
+        )
+        return system, static_prefix
+
+    def turn_prompt(self, persona, agent_index, is_first_round):
+        """A turn's model, system prompt, task and static prompt prefix."""
+        scenario = self.config.get('background', '一个场景')
+        model_name = self.get_agent_model(agent_index)
+        if provider_registry.get_model_config(model_name) is None:
+            raise ValueError(f"Invalid model configuration for {model_name}")
+
+        system, static_prefix = self.agent_system_prompt(persona.agents[agent_index], scenario)
+        with metrics.time_stage('build_task'):
+            task = persona.task_template(agent_index, is_first_round).render(
+                scenario=scenario,
+                conversation_history=self.format_conversation_history()
+            )
+            task += f"\n\nThis is the expected criteria for your final answer: {persona.expected_output}"
+        return model_name, system, task, static_prefix
+
+    async def generate_reply(self, model_name, system, task, static_prefix):
+        """A turn's reply, from the response cache or the model."""
+        use_cache = response_cache and self.config.get('use_cache', True)
+        result = None
+        if use_cache:
+            # A reply cut short by a smaller budget is not served to a turn with a larger one
+            result = response_cache.get(
+                ResponseCache.make_key(model_name, system, task, self.reply_token_limit(model_name))
+            )
+        if result is None:
+            result, usage, answered_by = await call_model(
+                model_name, system, task, static_prefix, self.reply_token_limit, batch=True
+            )
+            self.add_token_usage(usage)
+            if use_cache:
+                # A fallback's or hedge's reply is cached as that model's, not the requested one's
+                response_cache.set(
+                    ResponseCache.make_key(answered_by, system, task, self.reply_token_limit(answered_by)), result
+                )
+        return result
+
+    def start_turn(self, persona, agent_index, is_first_round):
+        """Render a turn's prompt from the history so far and start its reply.
+
+        A reply prefetched for this turn is picked up instead. Returns the
+        turn's model, its reply task and when the turn started waiting on it.
+        """
+        model_name, system, task, static_prefix = self.turn_prompt(persona, agent_index, is_first_round)
+        reply = self.take_prefetched(agent_index, model_name)
+        if reply is None:
+            reply = asyncio.create_task(self.generate_reply(model_name, system, task, static_prefix))
+        return model_name, reply, time.perf_counter()
+
+    async def collect_turn(self, pending_turn, current_round, agent_index):
+        """Wait for a started turn's reply and add it to the conversation history."""
+        model_name, reply, started = pending_turn
+        result = await reply
+        metrics.observe_stage('agent_turn', time.perf_counter() - started, model=model_name)
+        return self.add_turn(current_round, agent_index, result)
+
+    async def publish_turn(self, history_item):
+        """Persist a collected turn and send it to the session's room."""
+        with metrics.time_stage('publish_turn'):
+            chat_history_store.append(self.session_id, history_item)
+            await self.emit('conversationUpdate', history_item)
+            self.save_state()
+
+    def prefetch_next_turn(self, persona):
+        """Start the next batch's first turn now, for a continuation to pick up.
+
+        Skipped when the server-wide prefetch spend cap is used up.
+        """
+        agent_index = 0
+        model_name, system, task, static_prefix = self.turn_prompt(persona, agent_index, False)
+        if not prefetch_budget.try_take(self.reply_token_limit(model_name)):
+            prefetch_counter.inc(outcome='skipped')
+            return
+        reply = asyncio.create_task(self.generate_reply(model_name, system, task, static_prefix))
+        self.prefetched = (len(self.conversation_history), agent_index, model_name, reply)
+
+    def take_prefetched(self, agent_index, model_name):
+        """Return the prefetched reply task if it is for this turn; any other prefetch is dropped."""
+        if self.prefetched is None:
+            return None
+        history_length, prefetched_index, prefetched_model, reply = self.prefetched
+        if (history_length, prefetched_index, prefetched_model) != (
+                len(self.conversation_history), agent_index, model_name):
+            self.drop_prefetch()
+            return None
+        self.prefetched = None
+        prefetch_counter.inc(outcome='used')
+        return reply
+
+    def drop_prefetch(self):
+        """Abandon a prefetched turn, e.g. on stop, disconnect or a new conversation."""
+        if self.prefetched is None:
+            return
+        reply = self.prefetched[-1]
+        self.prefetched = None
+        abandon_reply(reply)
+        prefetch_counter.inc(outcome='dropped')
+
+    async def emit_agent_typing(self, current_round, agent_index):
+        await self.emit('agentTyping', {'round': current_round, 'agent': f"Agent {chr(65 + agent_index)}"})
+
+    async def emit_round_update(self, current_round):
+        await self.emit('roundUpdate', self.round_update(current_round))
+
+    async def run_turns(self, persona, turns):
+        """Run a batch of (round, agent_index, is_first_round) turns in order.
+
+        Pipelined and opened in parallel as in app.py's run_turns: the next
+        turn's reply is started before the current one is stored and
+        emitted.
+        """
+        if not self.config.get('pipeline_turns', PIPELINE_TURNS):
+            for index, (current_round, agent_index, is_first_round) in enumerate(turns):
+                if self.response_budget_exhausted():
+                    return
+                await self.emit_agent_typing(current_round, agent_index)
+                history_item = await self.collect_turn(
+                    self.start_turn(persona, agent_index, is_first_round), current_round, agent_index
+                )
+                await self.publish_turn(history_item)
+                if (index == len(turns) - 1 or turns[index + 1][0] != current_round
+                        or self.response_budget_exhausted()):
+                    await self.emit_round_update(current_round)
+            return
+
+        if not turns or self.response_budget_exhausted():
+            return
+
+        def start(index):
+            _, agent_index, is_first_round = turns[index]
+            return self.start_turn(persona, agent_index, is_first_round)
+
+        pending_turns = {0: start(0)}
+        try:
+            if self.config.get('parallel_opening') and not self.conversation_history and len(turns) > 1:
+                # Both agents open: the second one's first turn uses its opening instruction too
+                turns[1] = turns[1][:2] + (True,)
+                pending_turns[1] = start(1)
+            await self.emit_agent_typing(turns[0][0], turns[0][1])
+
+            for index, (current_round, agent_index, _) in enumerate(turns):
+                history_item = await self.collect_turn(pending_turns.pop(index), current_round, agent_index)
+
+                # Start the next reply before the bookkeeping for this one
+                has_next = index + 1 < len(turns) and not self.response_budget_exhausted()
+                if has_next and index + 1 not in pending_turns:
+                    pending_turns[index + 1] = start(index + 1)
+
+                await self.publish_turn(history_item)
+                if not has_next:
+                    await self.emit_round_update(current_round)
+                    return
+                if turns[index + 1][0] != current_round:
+                    await self.emit_round_update(current_round)
+                await self.emit_agent_typing(turns[index + 1][0], turns[index + 1][1])
+        finally:
+            # Replies started ahead of a stop or error are abandoned
+            for _, reply, _ in pending_turns.values():
+                abandon_reply(reply)
+
+    async def run_conversation(self, data):
+        try:
+            self.config = self.parse_user_input(data)
+            if not self.is_continuation:
+                self.drop_prefetch()
+            self.save_state()
+            persona = persona_registry.get(self.config.get('personality', DEFAULT_PERSONA))
+            await self.emit('roundUpdate', {
+                'round': self.current_round + 1, 'total': self.total_rounds, 'usage': self.usage_report()
+            })
+
+            # Run for 3 rounds at a time
+            await self.run_turns(persona, self.batch_turns(len(persona.agents)))
+
+            event, update = self.batch_end()
+            await self.emit(event, update)
+            if event == 'batchComplete' and self.config.get('prefetch_next_batch', PREFETCH_NEXT_BATCH):
+                self.prefetch_next_turn(persona)
+        except asyncio.CancelledError:
+            await self.emit('conversationStopped', self.stopped_update())
+        except RateLimited as error:
+            await self.emit('error', {'message': str(error), 'retry_after': error.retry_after})
+        except Exception as error:
+            print(f"Error in conversation: {str(error)}")
+            await self.emit('error', {'message': str(error)})
+        finally:
+            self.is_running = False
+            self.save_state()
+
+    def start(self, data):
+        self.is_running = True
+        self.task = asyncio.create_task(self.run_conversation(data))
+        # Cancelled before it got to run, the task never reaches run_conversation's finally
+        self.task.add_done_callback(lambda task: setattr(self, 'is_running', False))
+
+    def stop_conversation(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.drop_prefetch()
+
+
+session_state = create_session_state_store(ORCHESTRATOR_IDLE_TTL, ORCHESTRATOR_MAX_SESSIONS)
+
+conversations = ConversationRegistry(lambda session_key: AsyncConversation(session_key, session_state), session_state)
+
+# Handler tasks of in-flight single AI generations, by socket id
+active_generations = {}
+
+metrics.gauge_callback(
+    "multiai_active_conversations", "Simulator conversations running in this worker.",
+    lambda: sum(conversation.is_running for conversation in list(conversations.sessions.values()))
+)
+metrics.gauge_callback("multiai_sessions", "Sessions held by this worker's registry.", lambda: len(conversations.sessions))
+metrics.gauge_callback("multiai_active_generations", "Single AI generations in flight.", lambda: len(active_generations))
+metrics.gauge_callback("multiai_asyncio_tasks", "Live asyncio tasks in this worker.", lambda: len(asyncio.all_tasks()))
+metrics.gauge_callback(
+    "multiai_provider_queue_depth", "Provider calls waiting for a model's rate limit.",
+    lambda: [({'model': model_name}, depth) for model_name, depth in provider_limiter.stats().items()]
+)
+metrics.counter_callback(
+    "multiai_response_cache_total", "Response cache lookups by result.",
+    lambda: [({'result': 'hit'}, response_cache.hits), ({'result': 'miss'}, response_cache.misses)] if response_cache else []
+)
+
+
+def get_session_key(sid, data=None):
+    """Resolve the registry key for a request: the client's session_id or its socket id."""
+    return (data or {}).get('session_id') or sid
+
+
+async def emit_error(message, sid, retry_after=None):
+    payload = {'message': message}
+    if retry_after is not None:
+        payload['retry_after'] = retry_after
+    await sio.emit('error', payload, room=sid)
+
+
+def client_address(sid):
+    """A client's address, which keeps its rate limit across reconnects and their new socket ids."""
+    # Engine.IO's ASGI environ reports every client as 127.0.0.1; the ASGI scope has the real one
+    client = ((sio.get_environ(sid) or {}).get('asgi.scope') or {}).get('client')
+    return client[0] if client else sid
+
+
+async def admit_request(sid):
+    """Count a request that starts provider work; tell the client and return False if it is over its limit."""
+    try:
+        request_limiter.check(client_address(sid))
+    except RateLimited as error:
+        await emit_error(str(error), sid, error.retry_after)
+        return False
+    return True
+
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    print('Client connected:', sid)
+
+
+@sio.event
+async def disconnect(sid, reason=None):
+    print('Client disconnected:', sid)
+    conversations.release_sid(sid)
+    generation = active_generations.pop(sid, None)
+    if generation:
+        generation.cancel()
+
+
+@sio.on('stopConversation')
+async def handle_stop_conversation(sid, data=None):
+    print('Stop conversation requested by:', sid)
+    if data and data.get('session_id'):
+        if not conversations.can_access(data['session_id'], sid, data.get('access_token')):
+            await emit_error('Not allowed to stop this session', sid)
+            return
+        # The conversation may be running on another worker
+        conversations.stop(data['session_id'])
+    else:
+        for conversation in conversations.sessions_for_sid(sid):
+            conversation.stop_conversation()
+    await sio.emit('conversationStopped', room=sid)
+
+
+@sio.on('joinSession')
+async def handle_join_session(sid, data):
+    """Observe a session's conversation, wherever it runs, and get its current state.
+
+    Other clients' sessions need the access token sent to their starter.
+    """
+    session_id = get_session_key(sid, data)
+    if not conversations.can_access(session_id, sid, (data or {}).get('access_token')):
+        await emit_error('Not allowed to join this session', sid)
+        return
+    conversations.bind_sid(sid, session_id)
+    await sio.enter_room(sid, session_room(session_id))
+    conversation = conversations.get(session_id)
+    if conversation is not None and conversation.is_running:
+        snapshot = conversation.snapshot()
+    else:
+        snapshot = conversations.load_state(session_id)
+    await sio.emit('sessionState', {'session_id': session_id, 'state': public_state(snapshot)}, room=sid)
+
+
+@sio.on('getChatHistory')
+async def handle_get_chat_history(sid, data):
+    session_id = get_session_key(sid, data)
+    if not conversations.can_access(session_id, sid, (data or {}).get('access_token')):
+        await emit_error("Not allowed to read this session's history", sid)
+        return
+    try:
+        limit, before_id = page_request(data, CHAT_HISTORY_PAGE_SIZE)
+    except ValueError as error:
+        await emit_error(str(error), sid)
+        return
+    history, next_cursor = chat_history_store.read(session_id, limit=limit, before_id=before_id)
+    await sio.emit('chatHistory', {'history': history, 'next_cursor': next_cursor}, room=sid)
+
+
+@sio.on('clearChatHistory')
+async def handle_clear_chat_history(sid, data):
+    session_id = get_session_key(sid, data)
+    if not conversations.can_access(session_id, sid, (data or {}).get('access_token')):
+        await emit_error("Not allowed to clear this session's history", sid)
+        return
+    chat_history_store.clear(session_id)
+    await sio.emit('chatHistoryCleared', {'session_id': session_id}, room=sid)
+
+
+@sio.on('voiceInput')
+async def handle_voice_input(sid, data):
+    # Voice processing is not implemented in either mode
+    if await admit_request(sid):
+        await emit_error('Voice input processing failed', sid)
+
+
+@sio.on('getModelConfig')
+async def handle_get_model_config(sid, data=None):
+    await sio.emit('modelConfig', {'config': MODEL_CONFIGS}, room=sid)
+
+
+@sio.on('getPersonas')
+async def handle_get_personas(sid, data=None):
+    await sio.emit('personas', {'personas': persona_registry.summaries()}, room=sid)
+
+
+@sio.on('startConversation')
+async def handle_start_conversation(sid, data):
+    if not data.get('prompt') and not data.get('is_continuation'):
+        await emit_error('No prompt provided', sid)
+        return
+    if not await admit_request(sid):
+        return
+
+    session_id = get_session_key(sid, data)
+    if conversations.access_token_hash(session_id) and not conversations.can_access(
+            session_id, sid, data.get('access_token')):
+        await emit_error('Not allowed to continue this session', sid)
+        return
+    try:
+        conversation = conversations.get_or_create(session_id, sid)
+    except RuntimeError as error:
+        await emit_error(str(error), sid)
+        return
+    if conversation.access_token_hash is None:
+        # Lets the client rejoin, stop or continue the session from another connection
+        access_token, conversation.access_token_hash = issue_access_token()
+        await sio.emit('sessionToken', {'session_id': session_id, 'access_token': access_token}, room=sid)
+    if conversation.is_running or conversations.is_running_elsewhere(session_id):
+        await emit_error('Conversation already running', sid)
+        return
+
+    # Conversation events go to the session's room only
+    await sio.enter_room(sid, session_room(session_id))
+    conversation.start(data)
+
+
+async def stream_single_ai_response(sid, model, model_config, system_message, message, cache_key=None):
+    """Forward provider tokens to the requesting client as they arrive, coalesced into fewer packets."""
+    # Model tag goes out first so the client can render before the first token
+    await sio.emit('messageStream', {'content': f"[{model}] ", 'isComplete': False}, room=sid)
+
+    response = response_cache.get(cache_key) if cache_key else None
+    if response is not None:
+        chunks = [response]
+    else:
+        llm = create_streaming_llm(provider_registry.chat_model(model))
+        messages = prompt_messages(
+            system_message,
+            message,
+            static_prefix=SINGLE_AI_SYSTEM_MESSAGE.format(model=model),
+            provider=model_config['provider']
+        )
+        await provider_limiter.wait_for_slot(model)
+        chunks = []
+        async with provider_registry.async_limit(model):
+            call_started = time.perf_counter()
+            async for chunk in coalesce_stream(llm.astream(messages), STREAM_FLUSH_INTERVAL, STREAM_FLUSH_BYTES):
+                if not chunks:
+                    metrics.observe_stage('single_ai_first_token', time.perf_counter() - call_started, model=model)
+                chunks.append(chunk)
+                await sio.emit('messageStream', {'content': chunk, 'isComplete': False}, room=sid)
+        response = ''.join(chunks)
+        record_tokens(model, system_message + message, response, llm.usage)
+        if cache_key:
+            response_cache.set(cache_key, response)
+        chunks = []
+
+    # Cached replies go out whole; streamed ones end with an empty completion marker
+    await sio.emit('messageStream', {'content': ''.join(chunks), 'isComplete': True}, room=sid)
+    return response
+
+
+@sio.on('singleAIMessage')
+async def handle_single_ai_message(sid, data):
+    message = data.get('message')
+    session_id = get_session_key(sid, data)
+    model = data.get('model', MODEL_CONFIGS.get("default_model"))
+    context = truncate_to_tokens(
+        data.get('context', ''),
+        token_budget([model], SINGLE_AI_CONTEXT_TOKENS, window_fraction=0.5)
+    )
+
+    if not message:
+        await emit_error('No message provided', sid)
+        return
+    if conversations.access_token_hash(session_id) and not conversations.can_access(
+            session_id, sid, data.get('access_token')):
+        await emit_error("Not allowed to add to this session's history", sid)
+        return
+    conversations.bind_sid(sid, session_id)
+    if not await admit_request(sid):
+        return
+
+    # Handlers run as their own tasks; stopGeneration cancels this one
+    generation = asyncio.current_task()
+    active_generations[sid] = generation
+    started = time.perf_counter()
+    try:
+        chat_history_store.append(session_id, {'role': 'user', 'content': message, 'model': model})
+        system_message = SINGLE_AI_SYSTEM_MESSAGE.format(model=model) + SINGLE_AI_CONTEXT_MESSAGE.format(
+            context=context
+        )
+        model_config = provider_registry.get_model_config(model)
+        if not model_config:
+            raise ValueError(f"Invalid model configuration for {model}")
+
+        cache_key = None
+        if response_cache and data.get('use_cache', True):
+            # Single AI replies are not capped
+            cache_key = ResponseCache.make_key(model, system_message, message, None)
+
+        if data.get('stream', SINGLE_AI_STREAMING):
+            response = await stream_single_ai_response(sid, model, model_config, system_message, message, cache_key)
+            chat_history_store.append(session_id, {'role': 'assistant', 'content': response, 'model': model})
+            return
+
+        response = response_cache.get(cache_key) if cache_key else None
+        if response is None:
+            response, _, answered_by = await call_model(
+                model, system_message, message, SINGLE_AI_SYSTEM_MESSAGE.format(model=model)
+            )
+            if cache_key:
+                response_cache.set(ResponseCache.make_key(answered_by, system_message, message, None), response)
+        chat_history_store.append(session_id, {'role': 'assistant', 'content': response, 'model': model})
+
+        # Send the finished response in pieces of the streaming packet size
+        pieces = split_text(f"[{model}] {response}", STREAM_FLUSH_BYTES)
+        for index, piece in enumerate(pieces):
+            await sio.emit('messageStream', {'content': piece, 'isComplete': index == len(pieces) - 1}, room=sid)
+
+    except asyncio.CancelledError:
+        await sio.emit('messageStream', {'content': '', 'isComplete': True, 'stopped': True}, room=sid)
+    except RateLimited as error:
+        await emit_error(str(error), sid, error.retry_after)
+    except Exception as error:
+        print(f"Error in single AI conversation: {str(error)}")
+        await emit_error(str(error), sid)
+    finally:
+        metrics.observe_stage('single_ai_message', time.perf_counter() - started, model=model)
+        if active_generations.get(sid) is generation:
+            del active_generations[sid]
+
+
+@sio.on('stopGeneration')
+async def handle_stop_generation(sid, data=None):
+    generation = active_generations.get(sid)
+    if generation:
+        generation.cancel()
+    await sio.emit('message', {'content': '[Generation stopped by user]'}, room=sid)
+
+
+async def metrics_app(scope, receive, send):
+    """Serve /metrics next to the Socket.IO endpoint."""
+    if scope['type'] != 'http' or scope['path'] != '/metrics':
+        await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    body = metrics.render().encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/plain; version=0.0.4'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+background_tasks = set()
+
+
+async def startup():
+    # Stop requests other workers relay for conversations running here
+    background_tasks.add(asyncio.create_task(session_state.listen_stops(conversations.stop_local)))
+
+
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await provider_registry.aclose()
+
+
+app = socketio.ASGIApp(sio, other_asgi_app=metrics_app, on_startup=startup, on_shutdown=shutdown)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("Starting server with asyncio...")
+    uvicorn.run(app, host='127.0.0.1', port=int(os.getenv('PORT', '5000')), log_level='warning')
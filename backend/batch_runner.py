@@ -0,0 +1,176 @@
+"""Run simulator conversations headless for offline evaluation.
+
+Drives ConversationOrchestrator.run_conversation for every
+scenario x personality x model combination, with a concurrency limit,
+and streams one JSONL transcript per conversation to disk as each one
+finishes. Example:
+
+    python batch_runner.py --scenarios scenarios.txt \
+        --personalities SARCASTIC_NETIZEN RAP_BATTLE \
+        --models gpt-4o-mini gpt-4o-mini:deepseek-chat \
+        --concurrency 8 --output transcripts.jsonl
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import time
+
+import eventlet
+import eventlet.queue
+
+# Batch transcripts go to --output, not the server's chat history
+os.environ.setdefault("CHAT_HISTORY_PATH", ":memory:")
+
+import app
+from llm import estimate_tokens
+
+FINAL_EVENTS = ('conversationComplete', 'conversationStopped', 'error')
+
+
+class TranscriptRecorder:
+    """Event sink standing in for Socket.IO that records one conversation."""
+
+    def __init__(self):
+        self.turns = []
+        self.events = []
+        self.error = None
+        self.last_event_at = time.perf_counter()
+
+    def emit(self, event, data=None, **kwargs):
+        now = time.perf_counter()
+        self.events.append(event)
+        if event == 'conversationUpdate':
+            self.turns.append({
+                **data,
+                'latency_ms': round((now - self.last_event_at) * 1000, 1),
+                'tokens': estimate_tokens(data['message'])
+            })
+            self.last_event_at = now
+        elif event == 'error':
+            self.error = data['message']
+
+    @property
+    def finished(self):
+        return any(event in FINAL_EVENTS for event in self.events)
+
+
+def parse_models(model_specs):
+    """Turn "model" or "model_a:model_b" specs into {'A': ..., 'B': ...} pairs."""
+    pairs = []
+    for spec in model_specs:
+        model_a, _, model_b = spec.partition(':')
+        pairs.append({'A': model_a, 'B': model_b or model_a})
+    return pairs
+
+
+def load_scenarios(values):
+    """Read scenarios from the arguments, expanding any that name a file (one per line)."""
+    scenarios = []
+    for value in values:
+        if os.path.isfile(value):
+            with open(value, encoding='utf-8') as scenario_file:
+                scenarios.extend(line.strip() for line in scenario_file if line.strip())
+        else:
+            scenarios.append(value)
+    return scenarios
+
+
+def run_job(job_id, scenario, personality, models, rounds, use_cache):
+    """Run one conversation to completion, continuing batch by batch."""
+    recorder = TranscriptRecorder()
+    orchestrator = app.ConversationOrchestrator(recorder, session_id=f"batch-{job_id}")
+    orchestrator.total_rounds = rounds
+
+    start = time.perf_counter()
+    recorder.last_event_at = start
+    is_continuation = False
+    while not recorder.finished and orchestrator.current_round < rounds:
+        orchestrator.run_conversation({
+            'prompt': scenario,
+            'personality': personality,
+            'models': models,
+            'rounds': rounds,
+            'use_cache': use_cache,
+            'session_id': f"batch-{job_id}",
+            'is_continuation': is_continuation
+        })
+        is_continuation = True
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'id': job_id,
+        'scenario': scenario,
+        'personality': personality,
+        'models': models,
+        'status': next((event for event in recorder.events if event in FINAL_EVENTS), 'complete'),
+        'error': recorder.error,
+        'rounds': orchestrator.current_round,
+        'latency_ms': round(elapsed_ms, 1),
+        'output_tokens': sum(turn['tokens'] for turn in recorder.turns),
+        'turns': recorder.turns
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', required=True,
+                        help="scenario strings, or files with one scenario per line")
+    parser.add_argument('--personalities', nargs='+', default=['SARCASTIC_NETIZEN'])
+    parser.add_argument('--models', nargs='+', default=[app.MODEL_CONFIGS.get("default_model")],
+                        help="model for both agents, or model_a:model_b")
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--output', default='transcripts.jsonl')
+    parser.add_argument('--no-cache', action='store_true', help="bypass the response cache")
+    args = parser.parse_args()
+
+    jobs = list(itertools.product(
+        load_scenarios(args.scenarios), args.personalities, parse_models(args.models)
+    ))
+    print(f"Running {len(jobs)} conversations, {args.concurrency} at a time")
+
+    pool = eventlet.GreenPool(args.concurrency)
+    finished = eventlet.queue.Queue()
+
+    def run(job_id, job):
+        try:
+            finished.put(run_job(job_id, *job, args.rounds, not args.no_cache))
+        except Exception as error:
+            finished.put({'id': job_id, 'status': 'error', 'error': str(error)})
+
+    def spawn_jobs():
+        # spawn_n() blocks while the pool is full, so jobs are fed from here while results are written below
+        for job_id, job in enumerate(jobs):
+            pool.spawn_n(run, job_id, job)
+
+    results = []
+    start = time.perf_counter()
+    eventlet.spawn_n(spawn_jobs)
+    with open(args.output, 'w', encoding='utf-8') as output:
+        # Written in completion order, so one slow conversation does not hold back the rest
+        for _ in jobs:
+            result = finished.get()
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+            results.append(result)
+            if 'turns' not in result:
+                print(f"[{result['id']}] error: {result['error']}")
+                continue
+            print(f"[{result['id']}] {result['status']:<20} {result['rounds']} rounds  "
+                  f"{result['latency_ms']:9.1f}ms  {result['output_tokens']:6d} tokens  "
+                  f"{result['personality']} {result['models']['A']}/{result['models']['B']}")
+    elapsed = time.perf_counter() - start
+
+    latencies = [result['latency_ms'] for result in results if 'latency_ms' in result]
+    print(f"\n{len(results)} conversations in {elapsed:.1f}s, "
+          f"{sum(result['status'] == 'error' for result in results)} errors")
+    if latencies:
+        print(f"latency p50 {statistics.median(latencies):.1f}ms  max {max(latencies):.1f}ms, "
+              f"{sum(result.get('output_tokens', 0) for result in results)} output tokens")
+    print(f"Transcripts written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+
+
+class BatchSizeMismatch(ValueError):
+    """Raised when a batch call returns a different number of results than it was sent requests."""
+
+
+def check_batch_results(batch, results):
+    """Fail the whole batch rather than hand its requests someone else's results."""
+    if len(results) != len(batch):
+        raise BatchSizeMismatch(f"Batch of {len(batch)} requests returned {len(results)} results")
+
+
+class RequestCoalescer:
+    """Gather concurrent requests with the same key into batched calls.
+
+    submit() queues a request and waits for its result. A key's batch is
+    sent as ``send_batch(key, requests)`` once ``max_batch_size`` requests
+    are queued, or ``max_wait`` seconds after its first one, whichever
+    comes first; ``send_batch`` returns the results in request order, and
+    an error it raises, or a result count that does not match, goes to
+    every request in the batch. A waiter killed
+    before its batch is sent, e.g. by a stop, leaves the batch.
+    """
+
+    def __init__(self, send_batch, max_batch_size=8, max_wait=0.02):
+        self.send_batch = send_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = {}  # key -> [(request, Event)] not yet sent
+        self.timers = {}  # key -> timer sending the batch at the end of its window
+
+    def submit(self, key, request):
+        # Green-only, like the rest of this class; the asyncio coalescer never imports eventlet
+        import eventlet
+        from eventlet.event import Event
+        event = Event()
+        entry = (request, event)
+        batch = self.pending.setdefault(key, [])
+        batch.append(entry)
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self.timers:
+            self.timers[key] = eventlet.spawn_after(self.max_wait, self._flush, key)
+        try:
+            return event.wait()
+        except BaseException:
+            batch = self.pending.get(key)
+            if batch and entry in batch:
+                batch.remove(entry)
+            raise
+
+    def _flush(self, key):
+        import eventlet
+        batch = self.pending.pop(key, None)
+        timer = self.timers.pop(key, None)
+        if batch:
+            eventlet.spawn_n(self._send, key, batch)
+        if timer is not None:
+            # Last, as cancelling yields to other greenlets; a no-op when called from the timer itself
+            timer.cancel()
+
+    def _send(self, key, batch):
+        try:
+            results = self.send_batch(key, [request for request, _ in batch])
+            check_batch_results(batch, results)
+        except Exception as error:
+            for _, event in batch:
+                event.send_exception(error)
+            return
+        for (_, event), result in zip(batch, results):
+            event.send(result)
+
+
+class AsyncRequestCoalescer:
+    """RequestCoalescer for an asyncio event loop: ``await send_batch(key, requests)``.
+
+    A cancelled waiter leaves its batch if the batch has not been sent.
+    """
+
+    def __init__(self, send_batch, max_batch_size=8, max_wait=0.02):
+        self.send_batch = send_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = {}  # key -> [(request, Future)] not yet sent
+        self.timers = {}  # key -> TimerHandle sending the batch at the end of its window
+        self.sending = set()  # Batch tasks, referenced until they finish
+
+    async def submit(self, key, request):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = (request, future)
+        batch = self.pending.setdefault(key, [])
+        batch.append(entry)
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            batch = self.pending.get(key)
+            if batch and entry in batch:
+                batch.remove(entry)
+            raise
+
+    def _flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(key, None)
+        if batch:
+            task = asyncio.ensure_future(self._send(key, batch))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def _send(self, key, batch):
+        try:
+            results = await self.send_batch(key, [request for request, _ in batch])
+            check_batch_results(batch, results)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,899 @@
+"""Backend micro-benchmarks.
+
+Run from the backend directory, e.g. ``python benchmarks.py agent-setup``.
+Importing app applies the same eventlet monkey patching as the server.
+"""
+import argparse
+import os
+import re
+import statistics
+import time
+
+import eventlet
+
+# Keep benchmark runs out of the real chat history
+os.environ.setdefault("CHAT_HISTORY_PATH", ":memory:")
+# Measure the backend itself: fake model available, no admission limits in the way
+os.environ.setdefault("ENABLE_FAKE_LLM", "true")
+os.environ.setdefault("SESSION_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("PROVIDER_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("LLM_QUEUE_LIMIT", "100000")
+os.environ.setdefault("PROVIDER_MAX_CONCURRENCY", "1000")
+# No background imports competing with what is measured; startup turns it back on
+os.environ.setdefault("STARTUP_WARMUP", "false")
+
+import app
+import config
+
+
+def time_calls(func, iterations, before_each=None):
+    """Return the wall-clock duration of each call in milliseconds."""
+    samples = []
+    for _ in range(iterations):
+        if before_each:
+            before_each()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(label, samples):
+    print(
+        f"{label:<40} mean {statistics.mean(samples):8.3f}ms  "
+        f"p50 {percentile(samples, 0.50):8.3f}ms  p99 {percentile(samples, 0.99):8.3f}ms"
+    )
+
+
+def bench_agent_setup(args):
+    """Per-message setup cost of single AI chat and simulator batches, cold vs cached."""
+    model = args.model
+    model_config = app.get_model_config(model)
+
+    def single_ai_setup():
+        agent = app.get_single_ai_agent(model, model_config)
+        task = app.crewai.Task(
+            description="Hello",
+            expected_output="A helpful and contextually relevant response to the user's query.",
+            agent=agent
+        )
+        app.agent_messages(agent.role, agent.goal, agent.backstory, task.description, task.expected_output)
+
+    orchestrator = app.ConversationOrchestrator(app.socketio)
+    orchestrator.parse_user_input({
+        'prompt': '深夜的便利店',
+        'personality': args.personality,
+        'models': {'A': model, 'B': model}
+    })
+
+    report("single AI setup (uncached)", time_calls(single_ai_setup, args.iterations, app.agent_cache.clear))
+    report("single AI setup (cached)", time_calls(single_ai_setup, args.iterations))
+    report("simulator create_agents (uncached)", time_calls(orchestrator.create_agents, args.iterations, app.agent_cache.clear))
+    report("simulator create_agents (cached)", time_calls(orchestrator.create_agents, args.iterations))
+    agents = orchestrator.create_agents()
+    report("simulator turn task", time_calls(
+        lambda: orchestrator.prepare_conversation_task(agents[0], 0)(), args.iterations
+    ))
+
+
+def bench_hub_latency(args):
+    """Event latency while sessions run blocking LLM calls on the hub vs in the worker pool."""
+    # Stands in for un-patched I/O or CPU work inside CrewAI: blocks its whole thread
+    blocking_sleep = eventlet.patcher.original('time').sleep
+
+    def fake_llm_call():
+        blocking_sleep(args.llm_latency)
+
+    def measure(run_call):
+        lags = []
+        running = [True]
+
+        def probe():
+            # A 10ms timer stands in for any other client's socket event
+            while running[0]:
+                start = time.perf_counter()
+                eventlet.sleep(0.01)
+                lags.append((time.perf_counter() - start) * 1000 - 10)
+
+        def session():
+            for _ in range(args.turns):
+                run_call(fake_llm_call)
+
+        prober = eventlet.spawn(probe)
+        sessions = eventlet.GreenPool(args.sessions)
+        for _ in range(args.sessions):
+            sessions.spawn(session)
+        sessions.waitall()
+        running[0] = False
+        prober.wait()
+        return lags
+
+    print(f"{args.sessions} sessions x {args.turns} turns, {args.llm_latency * 1000:.0f}ms blocking call per turn")
+    report("event latency, calls on hub", measure(lambda call: call()))
+    report("event latency, calls in worker pool", measure(app.llm_pool.execute))
+
+
+def bench_pipeline(args):
+    """Simulator rounds per minute against a latency-injecting fake LLM."""
+    os.environ["FAKE_LLM_FIRST_TOKEN_LATENCY"] = str(args.llm_latency)
+    modes = [
+        ("sequential", {'pipeline_turns': False}),
+        ("pipelined", {'pipeline_turns': True}),
+        ("pipelined + parallel opening", {'pipeline_turns': True, 'parallel_opening': True}),
+    ]
+
+    print(f"{args.batches} batches per conversation, {args.llm_latency * 1000:.0f}ms per fake LLM call")
+    for label, options in modes:
+        orchestrator = app.ConversationOrchestrator(app.socketio, session_id=f"bench-{label}")
+        start = time.perf_counter()
+        for batch in range(args.batches):
+            orchestrator.run_conversation({
+                'prompt': '深夜的便利店',
+                'personality': args.personality,
+                'models': {'A': 'fake-stream', 'B': 'fake-stream'},
+                'use_cache': False,
+                'is_continuation': batch > 0,
+                **options
+            })
+        elapsed = time.perf_counter() - start
+        print(f"{label:<40} {orchestrator.current_round} rounds in {elapsed:6.2f}s  "
+              f"{orchestrator.current_round / elapsed * 60:7.1f} rounds/minute")
+
+
+def bench_prefetch(args):
+    """Wait from continuing a conversation to its first new turn, with and without prefetching."""
+    os.environ["FAKE_LLM_FIRST_TOKEN_LATENCY"] = str(args.llm_latency)
+
+    class EventClock:
+        """Stands in for the session's socket, noting when each event is first sent."""
+
+        def __init__(self):
+            self.sent_at = {}
+
+        def emit(self, event, data=None, **kwargs):
+            self.sent_at.setdefault(event, time.perf_counter())
+
+    print(f"{args.llm_latency * 1000:.0f}ms per fake LLM call, continuing {args.think_time:.1f}s after batchComplete")
+    for prefetch in (False, True):
+        waits = []
+        for iteration in range(args.iterations):
+            clock = EventClock()
+            orchestrator = app.ConversationOrchestrator(clock, session_id=f"bench-prefetch-{prefetch}-{iteration}")
+            options = {
+                'prompt': '深夜的便利店',
+                'personality': args.personality,
+                'models': {'A': 'fake-stream', 'B': 'fake-stream'},
+                'use_cache': False,
+                'prefetch_next_batch': prefetch
+            }
+            orchestrator.run_conversation(options)
+            eventlet.sleep(args.think_time)
+            clock.sent_at.clear()
+            start = time.perf_counter()
+            orchestrator.run_conversation({**options, 'is_continuation': True})
+            waits.append((clock.sent_at['conversationUpdate'] - start) * 1000)
+        report("continue to first turn, " + ("prefetched" if prefetch else "not prefetched"), waits)
+
+
+def bench_response_budget(args):
+    """Tokens generated and time taken per conversation as max_response_length caps generation."""
+    os.environ["FAKE_LLM_FIRST_TOKEN_LATENCY"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_TOKEN_DELAY"] = str(args.token_delay)
+    os.environ["FAKE_LLM_REPLY_WORDS"] = str(args.words)
+
+    print(f"{args.words}-word fake replies, {args.token_delay * 1000:.0f}ms per token, "
+          f"{config.TURN_MAX_TOKENS} tokens per turn at most")
+    for budget in args.budgets:
+        orchestrator = app.ConversationOrchestrator(app.socketio, session_id=f"bench-budget-{budget}")
+        start = time.perf_counter()
+        batch = 0
+        while batch == 0 or orchestrator.current_round < orchestrator.total_rounds:
+            orchestrator.run_conversation({
+                'prompt': '深夜的便利店',
+                'personality': args.personality,
+                'models': {'A': 'fake-stream', 'B': 'fake-stream'},
+                'use_cache': False,
+                'max_response_length': budget,
+                'is_continuation': batch > 0
+            })
+            batch += 1
+            if orchestrator.response_budget_exhausted():
+                break
+        elapsed = time.perf_counter() - start
+        usage = orchestrator.usage_report()
+        print(f"max_response_length {budget:<8} {len(orchestrator.conversation_history):3d} turns in {elapsed:6.2f}s  "
+              f"{usage['completion_tokens']:6d} completion tokens  "
+              f"{usage['response_length']:6d} characters kept")
+
+
+def bench_emit_fanout(args):
+    """Cost of a conversation's events with many clients connected: broadcast vs session room."""
+    clients = [app.socketio.test_client(app.app) for _ in range(args.clients)]
+    # One client owns the session; the rest are other users' connections
+    owner_sid = app.socketio.server.manager.sid_from_eio_sid(clients[0].eio_sid, '/')
+    app.socketio.server.enter_room(owner_sid, app.session_room('bench'), namespace='/')
+    bus = app.SessionEventBus(app.socketio, app.session_room('bench'))
+    update = {'round': 1, 'agent': 'Agent A', 'message': '一条普通长度的模拟对话消息' * 4}
+
+    def broadcast():
+        app.socketio.emit('conversationUpdate', update)
+
+    def targeted():
+        bus.emit('conversationUpdate', update)
+
+    print(f"{args.clients} connected clients, {args.iterations} conversationUpdate events")
+    report("broadcast emit", time_calls(broadcast, args.iterations))
+    report("session room emit", time_calls(targeted, args.iterations))
+    for client in clients:
+        client.disconnect()
+
+
+def bench_context_window(args):
+    """Prompt history tokens and render time per round as a conversation grows."""
+    from llm import estimate_tokens
+
+    orchestrator = app.ConversationOrchestrator(app.socketio)
+    orchestrator.parse_user_input({
+        'prompt': '深夜的便利店',
+        'personality': args.personality,
+        'models': {'A': args.model, 'B': args.model}
+    })
+    message = '一条普通长度的模拟对话消息，' * 4
+    rounds = args.rounds or 1000
+    print(f"History budget {orchestrator.history_context.token_budget} tokens for {args.model}")
+    for current_round in range(1, rounds + 1):
+        for agent in ('Agent A', 'Agent B'):
+            orchestrator.conversation_history.append({'round': current_round, 'agent': agent, 'message': message})
+            orchestrator.history_context.append(agent, message)
+        if current_round in (1, 10, 100, rounds):
+            samples = time_calls(orchestrator.format_conversation_history, args.iterations)
+            tokens = estimate_tokens(orchestrator.format_conversation_history())
+            report(f"round {current_round:<5} {tokens:5d} history tokens", samples)
+
+
+def bench_provider_pool(args):
+    """Provider calls against the local mock server: shared pooled client vs a new client per call."""
+    import json
+    import urllib.request
+
+    import httpx
+    from langchain_openai import ChatOpenAI
+    from mock_provider import start_mock_provider
+    from providers import ProviderRegistry
+
+    base_url, mock = start_mock_provider(args.mock_port, args.llm_latency)
+    model_configs = {"providers": {"llama": {"models": {
+        "llama-2-13b-chat": {"api_key": "mock", "provider": "llama", "endpoint": base_url}
+    }}}}
+    messages = [("system", "You are terse."), ("human", "深夜的便利店")]
+
+    def connections():
+        with urllib.request.urlopen(base_url.replace("/v1", "/stats")) as response:
+            return json.load(response)["connections"]
+
+    def measure(label, call):
+        before = connections()
+        samples = time_calls(call, args.iterations)
+        report(label, samples)
+        opened = connections() - before - 1  # Minus the second stats request's own connection
+        print(f"{'':<40} {opened} new connections for {args.iterations} calls")
+
+    try:
+        registry = ProviderRegistry(model_configs)
+        measure("pooled client", lambda: registry.chat_model("llama-2-13b-chat").invoke(messages))
+        measure("new client per call", lambda: ChatOpenAI(
+            model="llama-2-13b-chat", api_key="mock", base_url=base_url, http_client=httpx.Client()
+        ).invoke(messages))
+        registry.close()
+    finally:
+        mock.kill()
+
+
+def bench_micro_batch(args):
+    """Turns from many sessions against a one-engine stand-in server: a request per turn vs micro-batched."""
+    import json
+    import urllib.request
+
+    from batching import RequestCoalescer
+    from llm import prompt_messages
+    from mock_provider import start_mock_provider
+
+    model_name = "llama-2-13b-chat"
+    base_url, mock = start_mock_provider(args.mock_port, args.llm_latency, args.item_latency, serial=True)
+    model_config = app.MODEL_CONFIGS["providers"]["llama"]["models"][model_name]
+    model_config.update(api_key="mock", endpoint=base_url)
+    messages = prompt_messages("You are terse.", "深夜的便利店")
+
+    def requests_served():
+        with urllib.request.urlopen(base_url.replace("/v1", "/stats")) as response:
+            return json.load(response)["requests"]
+
+    def per_turn():
+        # The same completions request, with one prompt in it
+        app.send_provider_batch((model_name, None), [messages])
+
+    def measure(label, call):
+        latencies = []
+
+        def session():
+            for _ in range(args.turns):
+                start = time.perf_counter()
+                call()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        before = requests_served()
+        pool = eventlet.GreenPool(args.sessions)
+        start = time.perf_counter()
+        for _ in range(args.sessions):
+            pool.spawn(session)
+        pool.waitall()
+        elapsed = time.perf_counter() - start
+        requests = requests_served() - before
+        print(f"{label:<40} {len(latencies) / elapsed:7.1f} turns/s  {requests} requests")
+        report("  turn latency", latencies)
+
+    print(f"{args.sessions} sessions x {args.turns} turns; engine takes {args.llm_latency * 1000:.0f}ms "
+          f"per request plus {args.item_latency * 1000:.0f}ms per further prompt in a batch")
+    try:
+        measure("request per turn", per_turn)
+        for batch_size in args.batch_sizes:
+            coalescer = RequestCoalescer(app.send_provider_batch, batch_size, args.batch_wait_ms / 1000)
+            measure(f"micro-batched, up to {batch_size}", lambda: coalescer.submit((model_name, None), messages))
+    finally:
+        mock.kill()
+
+
+def bench_prompt_cache(args):
+    """Cached prompt tokens the mock provider reports for persona prompts: scenario first vs static text first."""
+    from llm import create_streaming_llm, prompt_messages
+    from mock_provider import start_mock_provider
+    from providers import ProviderRegistry
+
+    base_url, mock = start_mock_provider(args.mock_port, args.llm_latency)
+    model_configs = {"providers": {"llama": {"models": {
+        "llama-2-13b-chat": {"api_key": "mock", "provider": "llama", "endpoint": base_url}
+    }}}}
+    persona = app.persona_registry.get(args.personality)
+    agent = persona.agents[0]
+
+    def system_prompt(layout, scenario):
+        if layout == "scenario first":
+            # The old f-string prompts named the scenario in their first line
+            return f"你正在{scenario}中。\n" + agent.backstory.static_prefix
+        return agent.backstory.render(scenario=scenario)
+
+    def run(layout, registry):
+        prompt_tokens = cached_tokens = 0
+        samples = []
+        for session in range(args.sessions):
+            scenario = f"场景{session}：深夜的便利店"
+            history = []
+            for turn in range(args.turns):
+                prefix, suffix = persona.task_template(0, turn == 0).split('conversation_history', scenario=scenario)
+                messages = prompt_messages(
+                    system_prompt(layout, scenario), prefix + "\n".join(history) + suffix,
+                    static_prefix=agent.backstory.static_prefix, provider="llama"
+                )
+                llm = create_streaming_llm(registry.chat_model("llama-2-13b-chat"))
+                start = time.perf_counter()
+                reply = "".join(llm.stream(messages)) if turn % 2 else llm.invoke(messages)
+                samples.append((time.perf_counter() - start) * 1000)
+                history.append(f"Agent A: {reply}")
+                prompt_tokens += llm.usage["prompt"]
+                cached_tokens += llm.usage["cached"]
+        return samples, prompt_tokens, cached_tokens
+
+    try:
+        print(f"{args.sessions} sessions x {args.turns} turns, {args.personality}; "
+              f"usage as reported to the client, streamed and plain calls alternating")
+        for layout in ("scenario first", "static first"):
+            registry = ProviderRegistry(model_configs)
+            samples, prompt_tokens, cached_tokens = run(layout, registry)
+            registry.close()
+            report(layout, samples)
+            print(f"{'':<40} {cached_tokens}/{prompt_tokens} prompt tokens cached "
+                  f"({cached_tokens / max(1, prompt_tokens):.0%})")
+    finally:
+        mock.kill()
+
+
+def bench_rate_limit(args):
+    """Bursts against a provider that answers 429 over its rate limit: direct calls vs the fair scheduler."""
+    from admission import FairScheduler, TokenBucket
+
+    provider_rpm = args.provider_rpm
+    # One heavy session fires many more calls than the others
+    requests = {f"session-{index}": args.turns for index in range(args.sessions)}
+    requests["heavy"] = args.turns * 10
+
+    def run(scheduler):
+        provider = TokenBucket(provider_rpm / 60, burst=5)
+        finished = {}
+        outcomes = {'ok': 0, '429': 0}
+
+        def call(session_key):
+            if scheduler:
+                scheduler.wait_for_slot("model", session_key)
+            if not provider.try_take():
+                outcomes['429'] += 1
+                return
+            eventlet.sleep(args.llm_latency)
+            outcomes['ok'] += 1
+            finished[session_key] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pool = eventlet.GreenPool(10000)
+        for session_key, count in requests.items():
+            for _ in range(count):
+                pool.spawn(call, session_key)
+        pool.waitall()
+        elapsed = time.perf_counter() - start
+        light = [finished[key] for key in requests if key != "heavy" and key in finished]
+        return outcomes, elapsed, light, finished.get("heavy")
+
+    total = sum(requests.values())
+    print(f"{total} calls from {len(requests)} sessions against a {provider_rpm:.0f} requests/minute provider")
+    for label, scheduler in (("direct", None), ("fair scheduler", FairScheduler(provider_rpm, 5, max_queued=total))):
+        outcomes, elapsed, light, heavy = run(scheduler)
+        print(f"{label:<16} {outcomes['ok']:5d} ok  {outcomes['429']:5d} 429s  "
+              f"{outcomes['ok'] / elapsed * 60:7.1f} ok/minute  "
+              f"light sessions done by {max(light, default=0):5.2f}s, heavy by {heavy or 0:5.2f}s")
+
+
+def bench_resilience(args):
+    """Turn latency and failures against a flaky, heavy-tailed provider, with and without the policy.
+
+    Turns run ``--sessions`` at a time, as concurrent conversations would.
+    """
+    import random
+
+    from resilience import ResiliencePolicy
+
+    random.seed(1)
+
+    def flaky_call(model_name):
+        roll = random.random()
+        if roll < args.failure_rate:
+            eventlet.sleep(args.llm_latency)
+            raise ConnectionError("provider reset the connection")
+        # One call in fifty is ten times slower than usual
+        eventlet.sleep(args.llm_latency * (10 if roll > 0.98 else random.uniform(0.8, 1.2)))
+        return "reply"
+
+    policies = [
+        ("no policy", None),
+        ("retries", ResiliencePolicy(retries=2, backoff=0.05, timeout=args.llm_latency * 20)),
+        ("retries + hedging at p95", ResiliencePolicy(retries=2, backoff=0.05, timeout=args.llm_latency * 20,
+                                                      hedge=True)),
+    ]
+    turns = (args.rounds or 50) * 2
+    print(f"{turns} turns, {args.sessions} at a time, {args.llm_latency * 1000:.0f}ms typical call, "
+          f"{args.failure_rate:.0%} failures, 2% of calls 10x slower")
+    for label, policy in policies:
+        def timed_turn(_):
+            start = time.perf_counter()
+            failed = False
+            try:
+                if policy:
+                    policy.call(flaky_call, "flaky-model")
+                else:
+                    flaky_call("flaky-model")
+            except ConnectionError:
+                failed = True
+            return (time.perf_counter() - start) * 1000, failed
+
+        results = list(eventlet.GreenPool(args.sessions).imap(timed_turn, range(turns)))
+        failures = sum(failed for _, failed in results)
+        report(f"{label} ({failures} failed)", [elapsed for elapsed, _ in results])
+
+
+EVENT_NAME = re.compile(r'\["([^"]+)"')
+
+
+def resident_memory():
+    """Resident set size of this process in bytes (Linux), or 0 where unavailable."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def bench_load(args):
+    """Socket.IO clients driving conversations and single AI messages against the fake LLM."""
+    import gc
+    from socketio import packet
+
+    os.environ["FAKE_LLM_FIRST_TOKEN_LATENCY"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_TOKEN_DELAY"] = str(args.token_delay)
+    print(f"Fake LLM: {args.llm_latency * 1000:.0f}ms to first token, {args.token_delay * 1000:.0f}ms per token; "
+          f"{app.LLM_WORKER_THREADS} worker threads, {app.PROVIDER_MAX_CONCURRENCY} concurrent provider calls")
+
+    for session_count in args.session_counts:
+        gc.collect()
+        memory_before = resident_memory()
+        clients = [app.socketio.test_client(app.app) for _ in range(session_count)]
+
+        # Timestamp every event as the server sends it
+        events = {client.eio_sid: [] for client in clients}
+        send_eio_packet = app.socketio.server._send_eio_packet
+
+        def timed_send_eio_packet(eio_sid, eio_pkt):
+            if eio_sid in events and isinstance(eio_pkt.data, str) and eio_pkt.data[:1] == str(packet.EVENT):
+                event_name = EVENT_NAME.search(eio_pkt.data)
+                if event_name:
+                    events[eio_sid].append((time.perf_counter(), event_name.group(1)))
+            return send_eio_packet(eio_sid, eio_pkt)
+        app.socketio.server._send_eio_packet = timed_send_eio_packet
+
+        def wait_for(event_names):
+            while not all(any(name in event_names for _, name in sent) for sent in events.values()):
+                eventlet.sleep(0.01)
+
+        try:
+            # Simulator: one batch per session
+            started = {}
+            start = time.perf_counter()
+            for index, client in enumerate(clients):
+                started[client.eio_sid] = time.perf_counter()
+                client.emit('startConversation', {
+                    'prompt': '深夜的便利店',
+                    'personality': args.personality,
+                    'models': {'A': 'fake-stream', 'B': 'fake-stream'},
+                    'use_cache': False,
+                    'session_id': f"load-{session_count}-{index}"
+                })
+            wait_for(('batchComplete', 'conversationComplete', 'error'))
+            conversation_elapsed = time.perf_counter() - start
+            first_event, turn_gaps, turns, errors = [], [], 0, 0
+            for eio_sid, sent in events.items():
+                first_event.append((sent[0][0] - started[eio_sid]) * 1000)
+                updates = [at for at, name in sent if name == 'conversationUpdate']
+                turns += len(updates)
+                errors += sum(name == 'error' for _, name in sent)
+                turn_gaps.extend((later - earlier) * 1000 for earlier, later in zip(updates, updates[1:]))
+                sent.clear()
+
+            # Single AI chat: one streamed message per session, sent concurrently
+            started = {}
+            start = time.perf_counter()
+            pool = eventlet.GreenPool(session_count)
+            for client in clients:
+                started[client.eio_sid] = time.perf_counter()
+                pool.spawn(client.emit, 'singleAIMessage', {
+                    'message': '你好', 'model': 'fake-stream', 'use_cache': False, 'stream': True
+                })
+            pool.waitall()
+            wait_for(('messageStream',))
+            single_elapsed = time.perf_counter() - start
+            first_token, complete = [], []
+            for eio_sid, sent in events.items():
+                stream_events = [at for at, name in sent if name == 'messageStream']
+                errors += sum(name == 'error' for _, name in sent)
+                if len(stream_events) > 1:
+                    # The first messageStream event is the model tag, sent before the provider call
+                    first_token.append((stream_events[1] - started[eio_sid]) * 1000)
+                complete.append((stream_events[-1] - started[eio_sid]) * 1000)
+
+            gc.collect()
+            memory_per_session = (resident_memory() - memory_before) / session_count
+        finally:
+            app.socketio.server._send_eio_packet = send_eio_packet
+            for client in clients:
+                client.disconnect()
+
+        print(f"\n{session_count} sessions: {turns} turns in {conversation_elapsed:.2f}s "
+              f"({turns / conversation_elapsed:.1f} turns/s), {session_count} messages in "
+              f"{single_elapsed:.2f}s ({session_count / single_elapsed:.1f} messages/s), {errors} errors, "
+              f"{memory_per_session / 1024:.1f}KiB RSS per session")
+        report("  conversation first event", first_event)
+        if turn_gaps:
+            report("  conversation turn interval", turn_gaps)
+        if first_token:
+            report("  single AI first token", first_token)
+        report("  single AI complete", complete)
+
+
+def bench_stream_emit(args):
+    """messageStream packets per streamed reply: one per token vs coalesced by window and size."""
+    from socketio import packet
+
+    from llm import FakeStreamingLLM
+    from streaming import StreamEmitter
+
+    try:
+        from socketio.msgpack_packet import MsgPackPacket
+        import msgpack  # noqa: F401  Optional; only needed for binary framing
+    except ImportError:
+        MsgPackPacket = None
+
+    llm = FakeStreamingLLM(first_token_latency=args.llm_latency, token_delay=args.token_delay, reply_words=args.words)
+    print(f"{args.words}-word fake replies, {args.token_delay * 1000:.0f}ms per token, "
+          f"{app.STREAM_FLUSH_INTERVAL * 1000:.0f}ms / {app.STREAM_FLUSH_BYTES}B flush policy")
+
+    def run(coalesce):
+        sent = []
+
+        def emit(payload):
+            sent.append((time.perf_counter(), payload))
+
+        stream = StreamEmitter(emit, app.STREAM_FLUSH_INTERVAL, app.STREAM_FLUSH_BYTES)
+        start = time.perf_counter()
+        for index, token in enumerate(llm.stream([("human", "深夜的便利店")])):
+            if not coalesce:
+                emit({'content': token, 'isComplete': False})
+                continue
+            stream.write(token)
+            if index == 0:
+                stream.flush()
+        if coalesce:
+            stream.close()
+        else:
+            emit({'content': '', 'isComplete': True})
+        return start, sent
+
+    for label, coalesce in (("per token", False), ("coalesced", True)):
+        packets, json_bytes, msgpack_bytes, first, complete = [], [], [], [], []
+        for _ in range(args.iterations):
+            start, sent = run(coalesce)
+            packets.append(len(sent))
+            encoded = [packet.Packet(packet.EVENT, data=['messageStream', payload]).encode() for _, payload in sent]
+            json_bytes.append(sum(len(frame.encode('utf-8')) for frame in encoded))
+            if MsgPackPacket:
+                msgpack_bytes.append(sum(
+                    len(MsgPackPacket(packet.EVENT, data=['messageStream', payload]).encode()) for _, payload in sent
+                ))
+            first.append((sent[0][0] - start) * 1000)
+            complete.append((sent[-1][0] - start) * 1000)
+        framing = f", {statistics.mean(msgpack_bytes):.0f}B msgpack" if msgpack_bytes else ""
+        print(f"{label:<40} {statistics.mean(packets):.1f} packets, {statistics.mean(json_bytes):.0f}B JSON{framing}")
+        report("  first packet", first)
+        report("  complete", complete)
+
+
+def bench_cross_worker(args):
+    """Two workers sharing session state: stop and observe a conversation from the other one.
+
+    Both registries run in this process, under their own worker ids, with a
+    Redis store each on one fakeredis server; Socket.IO emits are not relayed.
+    """
+    import fakeredis
+    from session_state import RedisSessionStateStore
+
+    class EventLog:
+        def __init__(self):
+            self.events = []
+
+        def emit(self, event, data=None, **kwargs):
+            self.events.append((time.perf_counter(), event))
+
+    server = fakeredis.FakeServer()
+    os.environ["FAKE_LLM_FIRST_TOKEN_LATENCY"] = str(args.llm_latency)
+    worker_a = app.OrchestratorRegistry(
+        EventLog(), RedisSessionStateStore(fakeredis.FakeRedis(server=server), 60), worker_id='worker-a'
+    )
+    worker_b = app.OrchestratorRegistry(
+        EventLog(), RedisSessionStateStore(fakeredis.FakeRedis(server=server), 60), worker_id='worker-b'
+    )
+
+    stop_latencies = []
+    for iteration in range(args.iterations):
+        session_key = f"bench-{iteration}"
+        orchestrator = worker_a.get_or_create(session_key)
+        runner = eventlet.spawn(orchestrator.run_conversation, {
+            'prompt': '深夜的便利店',
+            'personality': args.personality,
+            'models': {'A': 'fake-stream', 'B': 'fake-stream'},
+            'use_cache': False
+        })
+        # Observe from worker B until worker A has published a turn
+        while not (worker_b.load_state(session_key) or {}).get('conversation_history'):
+            eventlet.sleep(0.005)
+        assert worker_b.is_running_elsewhere(session_key), "worker B does not see worker A running"
+
+        stop_at = time.perf_counter()
+        worker_b.stop(session_key)
+        runner.wait()
+        quiet_at = max(at for at, _ in worker_a.socket.events)
+        stop_latencies.append((quiet_at - stop_at) * 1000)
+        state = worker_b.load_state(session_key)
+        assert not state['is_running'], "worker A did not stop"
+
+    print(f"{args.iterations} conversations started on worker A, stopped from worker B")
+    report("cross-worker stop latency", stop_latencies)
+
+
+ENGINE_COMMANDS = {
+    # Not app.py's __main__, which runs Flask in debug mode with the reloader
+    'eventlet': ['-c', "import os, app; app.socketio.run(app.app, host='127.0.0.1', port=int(os.environ['PORT']))"],
+    'asyncio': ['-m', 'asgi_app'],
+}
+
+
+def start_server(engine, port, env):
+    """Run one serving mode in a child process; returns it once it accepts connections."""
+    import subprocess
+    import sys
+    import urllib.request
+
+    process = subprocess.Popen(
+        [sys.executable, *ENGINE_COMMANDS[engine]],
+        env={**env, 'PORT': str(port)},
+        stdout=subprocess.DEVNULL
+    )
+    for _ in range(600):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/socket.io/?EIO=4&transport=polling"):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{engine} server did not start on port {port}")
+
+
+def bench_engines(args):
+    """Concurrent-session capacity and event latency of the eventlet and asyncio serving modes.
+
+    Both servers run as child processes with the fake LLM and are driven
+    over real WebSocket connections by load_client.py.
+    """
+    import json
+    import subprocess
+    import sys
+
+    env = {
+        **os.environ,
+        'FAKE_LLM_FIRST_TOKEN_LATENCY': str(args.llm_latency),
+        'FAKE_LLM_TOKEN_DELAY': str(args.token_delay),
+        # Room for every session's provider calls at once in both modes
+        'LLM_WORKER_THREADS': str(max(20, max(args.session_counts))),
+        'ORCHESTRATOR_MAX_SESSIONS': str(max(1000, sum(args.session_counts))),
+        'STARTUP_WARMUP': 'true',
+    }
+    print(f"Fake LLM: {args.llm_latency * 1000:.0f}ms to first token, {args.token_delay * 1000:.0f}ms per token")
+    for engine in args.engines:
+        server = start_server(engine, args.server_port, env)
+        try:
+            for session_count in args.session_counts:
+                output = subprocess.run(
+                    [sys.executable, 'load_client.py', '--url', f"http://127.0.0.1:{args.server_port}",
+                     '--sessions', str(session_count), '--personality', args.personality,
+                     '--server-pid', str(server.pid)],
+                    capture_output=True, text=True, check=True
+                ).stdout
+                result = json.loads(output.splitlines()[-1])
+                print(f"\n{engine}, {session_count} sessions: {result['turns']} turns in "
+                      f"{result['conversation_seconds']:.2f}s ({result['turns'] / result['conversation_seconds']:.1f} turns/s), "
+                      f"{session_count} messages in {result['single_ai_seconds']:.2f}s "
+                      f"({session_count / result['single_ai_seconds']:.1f} messages/s), {result['errors']} errors, "
+                      f"{result['server_memory_per_session'] / 1024:.1f}KiB server RSS per session")
+                report("  conversation first event", result['first_event'])
+                if result['turn_gaps']:
+                    report("  conversation turn interval", result['turn_gaps'])
+                if result['first_token']:
+                    report("  single AI first token", result['first_token'])
+                report("  single AI complete", result['complete'])
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def bench_startup(args):
+    """Cold start of the eventlet server: import time, first connect and first responses.
+
+    Each start is a fresh server process, with a probing client already
+    waiting for it; times are from spawning the server. The server warms
+    up in the background unless BENCH_STARTUP_WARMUP=false.
+    """
+    import json
+    import subprocess
+    import sys
+
+    env = {
+        **os.environ,
+        'FAKE_LLM_FIRST_TOKEN_LATENCY': str(args.llm_latency),
+        'FAKE_LLM_TOKEN_DELAY': str(args.token_delay),
+        'PORT': str(args.server_port),
+        'STARTUP_WARMUP': os.getenv("BENCH_STARTUP_WARMUP", "true")
+    }
+    import_times = []
+    labels = {
+        'connect': "first connect",
+        'personas': "first persona list",
+        'single_ai_first_token': "first single AI token",
+        'conversation_first_turn': "first simulator turn"
+    }
+    samples = {name: [] for name in labels}
+    for _ in range(args.starts):
+        output = subprocess.run(
+            [sys.executable, '-c', "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        import_times.append(float(output.splitlines()[-1]) * 1000)
+
+        probe = subprocess.Popen(
+            [sys.executable, 'load_client.py', '--probe', '--url', f"http://127.0.0.1:{args.server_port}"],
+            stdout=subprocess.PIPE, text=True
+        )
+        probe.stdout.readline()  # The client is up and polling
+        spawned_at = time.time()
+        server = subprocess.Popen([sys.executable, *ENGINE_COMMANDS['eventlet']], env=env, stdout=subprocess.DEVNULL)
+        try:
+            output, _ = probe.communicate(timeout=300)
+        finally:
+            server.terminate()
+            server.wait()
+        result = json.loads(output.splitlines()[-1])
+        for name, at in result.items():
+            if name in samples and at is not None:
+                samples[name].append((at - spawned_at) * 1000)
+
+    print(f"{args.starts} cold starts, fake LLM {args.llm_latency * 1000:.0f}ms to first token")
+    report("import app", import_times)
+    for name, values in samples.items():
+        if values:
+            report(f"{labels[name]} after spawn", values)
+
+
+BENCHMARKS = {
+    'agent-setup': bench_agent_setup,
+    'hub-latency': bench_hub_latency,
+    'pipeline': bench_pipeline,
+    'response-budget': bench_response_budget,
+    'prefetch': bench_prefetch,
+    'emit-fanout': bench_emit_fanout,
+    'cross-worker': bench_cross_worker,
+    'context-window': bench_context_window,
+    'provider-pool': bench_provider_pool,
+    'micro-batch': bench_micro_batch,
+    'rate-limit': bench_rate_limit,
+    'resilience': bench_resilience,
+    'load': bench_load,
+    'prompt-cache': bench_prompt_cache,
+    'stream-emit': bench_stream_emit,
+    'engines': bench_engines,
+    'startup': bench_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--model', default=app.MODEL_CONFIGS.get("default_model"))
+    parser.add_argument('--personality', default='SARCASTIC_NETIZEN')
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument('--batches', type=int, default=2)
+    parser.add_argument('--rounds', type=int, help="conversation rounds (context-window: 1000, resilience: 50)")
+    parser.add_argument('--mock-port', type=int, default=8001)
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    parser.add_argument('--token-delay', type=float, default=0.005, help="seconds per fake LLM token")
+    parser.add_argument('--words', type=int, default=200, help="words per fake LLM reply")
+    parser.add_argument('--item-latency', type=float, default=0.01,
+                        help="extra seconds the stand-in engine takes per further prompt in a batch")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--batch-wait-ms', type=float, default=20)
+    parser.add_argument('--think-time', type=float, default=1.0, help="seconds between batchComplete and continuing")
+    parser.add_argument('--budgets', type=int, nargs='+', default=[100000, 2000, 500],
+                        help="max_response_length values, in characters")
+    parser.add_argument('--session-counts', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--provider-rpm', type=float, default=600, help="provider rate limit, requests per minute")
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--server-port', type=int, default=5055)
+    parser.add_argument('--starts', type=int, default=3, help="server processes to cold-start")
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINE_COMMANDS), default=sorted(ENGINE_COMMANDS))
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import time
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is stopped before it completes."""
+
+
+class CancellationToken:
+    """Cooperative stop signal shared by a generation and whoever may stop it."""
+
+    def __init__(self):
+        self.cancelled = False
+        self.cancelled_at = None
+        self._callbacks = []
+
+    def cancel(self):
+        """Mark the token cancelled and run the registered abort callbacks."""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.cancelled_at = time.monotonic()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Register a callback to run on cancel; returns a function that unregisters it."""
+        if self.cancelled:
+            callback()
+            return lambda: None
+        self._callbacks.append(callback)
+
+        def unregister():
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+        return unregister
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled()
+
+    def elapsed_since_cancel_ms(self):
+        """Milliseconds since cancel() was called, or None if it was not."""
+        if self.cancelled_at is None:
+            return None
+        return (time.monotonic() - self.cancelled_at) * 1000
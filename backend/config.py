@@ -0,0 +1,106 @@
+"""Server settings, read from the environment and .env.
+
+app.py and asgi_app.py both take their settings from here, so the two
+serving modes read the same variables with the same defaults. The last
+group only applies to the eventlet server, which runs CrewAI.
+"""
+import os
+import socket as socket_lib
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Stream provider tokens for single AI chat unless a request opts out
+SINGLE_AI_STREAMING = os.getenv("SINGLE_AI_STREAMING", "true").lower() == "true"
+
+# Streamed tokens are coalesced into one messageStream packet per window or size
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", "30")) / 1000
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "256"))
+
+# Session registry limits
+ORCHESTRATOR_MAX_SESSIONS = int(os.getenv("ORCHESTRATOR_MAX_SESSIONS", "1000"))
+ORCHESTRATOR_IDLE_TTL = float(os.getenv("ORCHESTRATOR_IDLE_TTL", "1800"))  # seconds
+
+# Overlap each simulator turn's provider call with the bookkeeping around it
+PIPELINE_TURNS = os.getenv("PIPELINE_TURNS", "true").lower() == "true"
+
+# Generate the next batch's first turn after batchComplete, so continuing does not wait
+# for it; speculative calls share a server-wide spend cap, charged at their max_tokens
+PREFETCH_NEXT_BATCH = os.getenv("PREFETCH_NEXT_BATCH", "false").lower() == "true"
+PREFETCH_TOKENS_PER_MINUTE = float(os.getenv("PREFETCH_TOKENS_PER_MINUTE", "20000"))
+
+# Simulator turns for self-hosted models (those with an endpoint: llama, mixtral) from
+# all sessions are gathered into batched completions requests, of up to BATCH_MAX_SIZE
+# prompts, sent at most BATCH_MAX_WAIT_MS after the first one
+PROVIDER_BATCHING = os.getenv("PROVIDER_BATCHING", "false").lower() == "true"
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "20"))
+
+# Prompt token budgets: simulator history per turn, and the client context in single AI chat.
+# Each is also capped at a fraction of the smallest context window among the models involved.
+CONTEXT_HISTORY_TOKENS = int(os.getenv("CONTEXT_HISTORY_TOKENS", "400"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "0"))  # 0 drops older turns unsummarized
+SINGLE_AI_CONTEXT_TOKENS = int(os.getenv("SINGLE_AI_CONTEXT_TOKENS", "2000"))
+
+# Pooled connections per provider, and how many calls each provider serves at once
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", "20"))
+PROVIDER_MAX_CONCURRENCY = int(os.getenv("PROVIDER_MAX_CONCURRENCY", "10"))
+
+# Requests per minute each client address may start (conversations, messages); 0 disables the limit
+SESSION_REQUESTS_PER_MINUTE = float(os.getenv("SESSION_REQUESTS_PER_MINUTE", "30"))
+SESSION_REQUEST_BURST = int(os.getenv("SESSION_REQUEST_BURST", "10"))
+# Provider calls per minute per model, shared fairly across sessions; 0 disables the limit
+PROVIDER_REQUESTS_PER_MINUTE = float(os.getenv("PROVIDER_REQUESTS_PER_MINUTE", "500"))
+PROVIDER_REQUEST_BURST = int(os.getenv("PROVIDER_REQUEST_BURST", "20"))
+PROVIDER_QUEUE_LIMIT = int(os.getenv("PROVIDER_QUEUE_LIMIT", "200"))  # waiting calls per model
+
+# Resilience for simulator turns: retries with jittered backoff, a per-call timeout,
+# optional hedged requests, then one attempt on the default model
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))  # seconds, doubled per retry
+LLM_RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX", "8"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))  # seconds per attempt
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+# Hedge after this long; unset uses the model's observed p95 latency
+LLM_HEDGE_AFTER_MS = os.getenv("LLM_HEDGE_AFTER_MS")
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL")  # unset hedges to the same model
+LLM_FALLBACK = os.getenv("LLM_FALLBACK", "true").lower() == "true"
+
+# Also print each stage timing as a JSON log line
+METRICS_LOG = os.getenv("METRICS_LOG", "false").lower() == "true"
+
+# Persistent chat history
+CHAT_HISTORY_PATH = os.getenv("CHAT_HISTORY_PATH", "chat_history.db")
+CHAT_HISTORY_MAX_ITEMS = int(os.getenv("CHAT_HISTORY_MAX_ITEMS", "1000"))  # per session
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+
+# Multi-worker mode: a Redis-compatible queue relays emits between workers, and
+# SESSION_STATE_URL (see session_state.py) shares conversation state between them
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+
+# Socket.IO packet encoding: "default" (JSON text frames) or "msgpack" (binary frames,
+# needs the msgpack package here and socket.io-msgpack-parser in the client)
+SOCKETIO_SERIALIZER = os.getenv("SOCKETIO_SERIALIZER", "default")
+WORKER_ID = os.getenv("WORKER_ID", f"{socket_lib.gethostname()}:{os.getpid()}")
+# A running conversation whose state has not been saved for this long is assumed orphaned
+SESSION_RUNNING_TIMEOUT = float(os.getenv("SESSION_RUNNING_TIMEOUT", "300"))  # seconds
+
+# Per-turn reply cap in tokens; max_response_length (characters per conversation) lowers it as it runs out
+TURN_MAX_TOKENS = int(os.getenv("TURN_MAX_TOKENS", "256"))
+
+
+# The eventlet server's own settings, for CrewAI agents, worker threads and stop reporting
+
+# Target time from a stop request until the conversation goes quiet
+STOP_QUIET_TARGET_MS = float(os.getenv("STOP_QUIET_TARGET_MS", "200"))
+
+# Number of built agent sets kept for reuse across turns and sessions
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "256"))
+
+# Worker threads for blocking LLM calls, and how many calls may wait for one
+LLM_WORKER_THREADS = int(os.getenv("LLM_WORKER_THREADS", "20"))
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "100"))
+
+# Load CrewAI and the default model's client in the background at startup; off leaves it to first use
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
@@ -0,0 +1,158 @@
+from collections import deque
+
+from llm import estimate_tokens
+
+# Context window sizes in tokens, matched by model name prefix (longest prefix wins)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "claude-3": 200000,
+    "claude-2": 100000,
+    "deepseek": 64000,
+    "llama-2": 4096,
+    "mixtral": 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Most tokens a model generates in one reply, matched like the context windows
+MODEL_MAX_OUTPUT_TOKENS = {
+    "gpt-4o": 16384,
+    "gpt-4-0125": 4096,
+    "gpt-4-1106": 4096,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 4096,
+    "claude-3": 4096,
+    "claude-2": 4096,
+    "deepseek": 8192,
+    "llama-2": 2048,
+    "mixtral": 4096,
+}
+DEFAULT_MAX_OUTPUT_TOKENS = 2048
+
+
+def _match_prefix(table, model_name, default):
+    matches = [prefix for prefix in table if (model_name or "").startswith(prefix)]
+    if not matches:
+        return default
+    return table[max(matches, key=len)]
+
+
+def context_window(model_name):
+    """Return the context window of a model, in tokens."""
+    return _match_prefix(MODEL_CONTEXT_WINDOWS, model_name, DEFAULT_CONTEXT_WINDOW)
+
+
+def max_output_tokens(model_name):
+    """Return the most tokens a model generates in one reply."""
+    return _match_prefix(MODEL_MAX_OUTPUT_TOKENS, model_name, DEFAULT_MAX_OUTPUT_TOKENS)
+
+
+def reply_token_limit(model_name, remaining_chars, turn_max_tokens, step=64):
+    """max_tokens for a reply, given how many characters of a response budget are left.
+
+    A token is at least about one character (a CJK character is about one
+    token), so ``remaining_chars`` tokens cannot run far past the budget;
+    callers trim the reply to the exact budget. The limit is rounded up to
+    a multiple of ``step``, so a model only ever needs a few variants.
+    """
+    ceiling = min(turn_max_tokens, max_output_tokens(model_name))
+    limit = min(ceiling, max(1, remaining_chars))
+    return min(ceiling, -(-limit // step) * step)
+
+
+def token_budget(model_names, max_tokens, window_fraction):
+    """Budget for a prompt section shared by several models.
+
+    The budget is ``max_tokens``, capped at ``window_fraction`` of the
+    smallest window among the models.
+    """
+    smallest_window = min(context_window(model_name) for model_name in model_names)
+    return max(1, min(max_tokens, int(smallest_window * window_fraction)))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Keep the end of text, the most recent part of a transcript, within max_tokens."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Longest suffix that fits; token counts grow monotonically with suffix length
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[-middle:]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[len(text) - low:]
+
+
+def truncating_summarizer(max_tokens, turn_chars=40):
+    """Summarize evicted turns by keeping the opening of each, within max_tokens.
+
+    Needs no extra LLM call. Anything with the same (summary, evicted_lines)
+    signature, such as an LLM-backed summarizer, can be used instead.
+    """
+    def summarize(summary, evicted_lines):
+        clipped = [
+            line if len(line) <= turn_chars else line[:turn_chars] + "…"
+            for line in evicted_lines
+        ]
+        combined = "\n".join(filter(None, [summary] + clipped))
+        truncated = truncate_to_tokens(combined, max_tokens)
+        if truncated != combined and "\n" in truncated:
+            truncated = truncated.split("\n", 1)[1]  # Drop the partial oldest line
+        return truncated
+    return summarize
+
+
+class ConversationContext:
+    """Rendered conversation history that stays within a token budget.
+
+    Turns are rendered once, as they are added, and kept in a running
+    string; the oldest turns are dropped from its front once the budget is
+    exceeded, optionally folding them into a summary first. The most recent
+    turn is always kept.
+    """
+
+    def __init__(self, token_budget, summarizer=None):
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self.lines = deque()  # (line, tokens), oldest first
+        self.total_tokens = 0
+        self.rendered = ""
+        self.summary = ""
+
+    def append(self, agent, message):
+        line = f"{agent}: {message}"
+        tokens = estimate_tokens(line) + 1  # + the newline joining it
+        self.lines.append((line, tokens))
+        self.total_tokens += tokens
+        self.rendered = f"{self.rendered}\n{line}" if self.rendered else line
+
+        evicted = []
+        while self.total_tokens > self.token_budget and len(self.lines) > 1:
+            old_line, old_tokens = self.lines.popleft()
+            self.total_tokens -= old_tokens
+            self.rendered = self.rendered[len(old_line) + 1:]
+            evicted.append(old_line)
+        if evicted and self.summarizer:
+            self.summary = self.summarizer(self.summary, evicted)
+
+    def render(self):
+        if not self.summary:
+            return self.rendered
+        return f"Earlier in the conversation:\n{self.summary}\n\n{self.rendered}"
+
+    def rebuild(self, history):
+        """Reset from a list of history items, e.g. after restoring a session."""
+        self.clear()
+        for item in history:
+            self.append(item['agent'], item['message'])
+
+    def clear(self):
+        self.lines.clear()
+        self.total_tokens = 0
+        self.rendered = ""
+        self.summary = ""
@@ -0,0 +1,373 @@
+import time
+from collections import OrderedDict
+
+from config import (
+    CONTEXT_HISTORY_TOKENS, CONTEXT_SUMMARY_TOKENS, ORCHESTRATOR_IDLE_TTL, ORCHESTRATOR_MAX_SESSIONS, PIPELINE_TURNS,
+    PREFETCH_NEXT_BATCH, SESSION_RUNNING_TIMEOUT, TURN_MAX_TOKENS, WORKER_ID
+)
+from context_window import ConversationContext, reply_token_limit, token_budget, truncating_summarizer
+from model_configs import MODEL_CONFIGS
+from personas import DEFAULT_PERSONA
+from session_state import check_access_token
+
+
+class Conversation:
+    """A simulator conversation's state, settings and response budget, whichever server runs it.
+
+    app.py's ConversationOrchestrator runs the turns on greenlets and
+    asgi_app.py's AsyncConversation as an asyncio task; both keep the
+    state here, so they parse the same settings, spend the same budget and
+    save the same snapshots. Subclasses provide ``is_running``,
+    stop_conversation() and drop_prefetch().
+    """
+
+    rounds_per_batch = 3
+
+    def __init__(self, session_id='default', state_store=None):
+        self.session_id = session_id
+        self.state_store = state_store
+        self.state_updated_at = 0
+        self.config = {}
+        self.conversation_history = []
+        self.history_context = self.create_history_context()
+        self.current_round = 0  # Rounds every agent has spoken in
+        self.total_rounds = 10
+        self.agent_count = 2  # Agents per round, as batch_turns() was last asked for
+        self.is_continuation = False
+        self.response_length = 0  # Characters of replies so far, against max_response_length
+        self.max_response_length = 2000  # Default max response length
+        self.token_usage = self.empty_token_usage()
+        self.prefetched = None  # (history length, agent index, model, call) of the next batch's first turn
+        self.access_token_hash = None  # Of the token given to the client that started the session
+        self.worker_id = WORKER_ID  # The worker running it, as saved with its state
+
+    def snapshot(self):
+        """Everything another worker needs to observe or continue this conversation."""
+        return {
+            'config': self.config,
+            'conversation_history': self.conversation_history,
+            'current_round': self.current_round,
+            'total_rounds': self.total_rounds,
+            'response_length': self.response_length,
+            'token_usage': self.token_usage,
+            'is_running': self.is_running,
+            'worker_id': self.worker_id,
+            'updated_at': self.state_updated_at,
+            'access_token_hash': self.access_token_hash
+        }
+
+    def restore(self, snapshot):
+        """Load state saved by snapshot(), possibly on another worker."""
+        self.config = snapshot['config']
+        self.conversation_history = snapshot['conversation_history']
+        self.current_round = snapshot['current_round']
+        self.total_rounds = snapshot['total_rounds']
+        self.response_length = snapshot['response_length']
+        self.token_usage = snapshot.get('token_usage') or self.empty_token_usage()
+        self.access_token_hash = snapshot.get('access_token_hash') or self.access_token_hash
+        self.state_updated_at = snapshot['updated_at']
+        self.drop_prefetch()
+        self.history_context = self.create_history_context()
+        self.history_context.rebuild(self.conversation_history)
+
+    def save_state(self):
+        """Publish the conversation state to the shared store, if there is one."""
+        if self.state_store is None:
+            return
+        self.state_updated_at = time.time()
+        try:
+            self.state_store.save(self.session_id, self.snapshot())
+        except Exception as error:
+            print(f"Error saving session state: {str(error)}")
+
+    def parse_user_input(self, data):
+        """Parse user input with enhanced configuration options."""
+        self.is_continuation = data.get('is_continuation', False)
+        if not self.is_continuation:
+            # Reset config for new conversation
+            self.config = {
+                "background": data.get('prompt', ''),
+                "rounds": data.get('rounds', self.total_rounds),
+                "agent_count": data.get('agent_count', 2),
+                "personality": data.get('personality', DEFAULT_PERSONA),
+                "models": {
+                    "A": data.get('models', {}).get('A', MODEL_CONFIGS.get("default_model")),
+                    "B": data.get('models', {}).get('B', MODEL_CONFIGS.get("default_model"))
+                },
+                "max_response_length": data.get('max_response_length', self.max_response_length),
+                "voice_input": data.get('voice_input', False),
+                "use_cache": data.get('use_cache', True),
+                "pipeline_turns": data.get('pipeline_turns', PIPELINE_TURNS),
+                "parallel_opening": data.get('parallel_opening', False),
+                "prefetch_next_batch": data.get('prefetch_next_batch', PREFETCH_NEXT_BATCH),
+                "session_id": data.get('session_id', 'default')
+            }
+            self.conversation_history = []
+            self.history_context = self.create_history_context()
+            self.current_round = 0
+            self.response_length = 0
+            self.token_usage = self.empty_token_usage()
+        return self.config
+
+    def check_response_length(self, message):
+        """Count a reply against the response budget, trimmed to what is left of it.
+
+        Returns the reply as it is kept.
+        """
+        message = message[:self.remaining_response_length()]
+        self.response_length += len(message)
+        return message
+
+    def remaining_response_length(self):
+        return max(0, self.config.get('max_response_length', self.max_response_length) - self.response_length)
+
+    def response_budget_exhausted(self):
+        return self.remaining_response_length() <= 0
+
+    def reply_token_limit(self, model_name):
+        """max_tokens for the next reply: the per-turn cap, lowered as the response budget runs out."""
+        return reply_token_limit(model_name, self.remaining_response_length(), TURN_MAX_TOKENS)
+
+    @staticmethod
+    def empty_token_usage():
+        return {'prompt_tokens': 0, 'completion_tokens': 0, 'cached_prompt_tokens': 0}
+
+    def add_token_usage(self, usage):
+        self.token_usage['prompt_tokens'] += usage['prompt']
+        self.token_usage['completion_tokens'] += usage['completion']
+        self.token_usage['cached_prompt_tokens'] += usage['cached']
+
+    def usage_report(self):
+        """Conversation usage so far, as sent with roundUpdate."""
+        return {
+            'response_length': self.response_length,
+            'max_response_length': self.config.get('max_response_length', self.max_response_length),
+            **self.token_usage
+        }
+
+    def create_history_context(self):
+        """Empty history context sized for both agents' models."""
+        models = self.config.get('models', {})
+        budget = token_budget(
+            [models.get('A', MODEL_CONFIGS.get("default_model")), models.get('B', MODEL_CONFIGS.get("default_model"))],
+            CONTEXT_HISTORY_TOKENS,
+            window_fraction=0.25
+        )
+        summarizer = truncating_summarizer(CONTEXT_SUMMARY_TOKENS) if CONTEXT_SUMMARY_TOKENS > 0 else None
+        return ConversationContext(budget, summarizer)
+
+    def format_conversation_history(self):
+        # Maintained turn by turn in add_turn(), within the token budget
+        return self.history_context.render()
+
+    def get_agent_model(self, agent_index):
+        return self.config.get('models', {}).get(chr(65 + agent_index), MODEL_CONFIGS.get("default_model"))
+
+    def batch_turns(self, agent_count):
+        """The next batch's (round, agent_index, is_first_round) turns: up to rounds_per_batch rounds.
+
+        A round cut short by a stop is finished first, from the agent after
+        the last one that spoke.
+        """
+        self.agent_count = agent_count
+        start_round = self.current_round
+        end_round = min(start_round + self.rounds_per_batch, self.total_rounds)
+        turns = [
+            (round + 1, agent_index, round == 0 and agent_index == 0)
+            for round in range(start_round, end_round)
+            for agent_index in range(agent_count)
+        ]
+        spoken = 0
+        for history_item in reversed(self.conversation_history):
+            if history_item['round'] != start_round + 1:
+                break
+            spoken += 1
+        return turns[spoken:]
+
+    def add_turn(self, current_round, agent_index, reply):
+        """Add a turn's reply, trimmed to the response budget, to the history; returns its history item.
+
+        The round counts as done once its last agent has spoken.
+        """
+        history_item = {
+            'round': current_round,
+            'agent': f"Agent {chr(65 + agent_index)}",
+            'message': self.check_response_length(reply)
+        }
+        self.conversation_history.append(history_item)
+        self.history_context.append(history_item['agent'], history_item['message'])
+        if agent_index == self.agent_count - 1:
+            self.current_round = current_round
+        return history_item
+
+    def round_update(self, current_round):
+        """roundUpdate for the end of a round."""
+        return {
+            'round': current_round,
+            'total': self.total_rounds,
+            'can_continue': current_round < self.total_rounds and not self.response_budget_exhausted(),
+            'usage': self.usage_report()
+        }
+
+    def batch_end(self):
+        """The event, and its data, that ends a batch that was not stopped."""
+        if self.current_round >= self.total_rounds or self.response_budget_exhausted():
+            return 'conversationComplete', {
+                'reason': 'rounds' if self.current_round >= self.total_rounds else 'max_response_length',
+                'usage': self.usage_report()
+            }
+        return 'batchComplete', {'current_round': self.current_round, 'can_continue': True}
+
+    def stopped_update(self):
+        """conversationStopped for a stopped batch."""
+        return {'current_round': self.current_round, 'can_continue': self.current_round < self.total_rounds}
+
+
+class ConversationRegistry:
+    """Keep one conversation per session so every handler reaches the live one.
+
+    Sessions idle for longer than ``idle_ttl`` seconds are evicted, and the
+    least recently used idle session makes room once ``max_sessions`` is hit.
+    Sessions with a running conversation are never evicted.
+    ``create_conversation(session_key)`` builds a session's Conversation.
+
+    With a shared ``state_store`` the registry is one of several workers:
+    conversations are hydrated from the state another worker saved, and
+    stop requests are relayed to whichever worker runs the conversation;
+    the server passes those it receives to stop_local(). ``worker_id``
+    tells this worker's saved state apart from the others'.
+    """
+
+    def __init__(self, create_conversation, state_store=None, max_sessions=ORCHESTRATOR_MAX_SESSIONS,
+                 idle_ttl=ORCHESTRATOR_IDLE_TTL, worker_id=WORKER_ID):
+        self.create_conversation = create_conversation
+        self.state_store = state_store
+        self.worker_id = worker_id
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.sessions = OrderedDict()  # session key -> conversation, least recently used first
+        self.last_seen = {}
+        self.sid_sessions = {}  # socket id -> session keys it started
+
+    def get(self, session_key):
+        """Return the conversation for a session, or None if there is none."""
+        self.evict_idle()
+        conversation = self.sessions.get(session_key)
+        if conversation is not None:
+            self._touch(session_key)
+        return conversation
+
+    def get_or_create(self, session_key, sid=None):
+        """Return the conversation for a session, creating it if needed."""
+        conversation = self.get(session_key)
+        if conversation is None:
+            self._make_room()
+            conversation = self.create_conversation(session_key)
+            conversation.worker_id = self.worker_id
+            self.sessions[session_key] = conversation
+            self._touch(session_key)
+        if not conversation.is_running:
+            # Another worker may have run batches of this session since we last saw it
+            snapshot = self.load_state(session_key)
+            if snapshot and snapshot['updated_at'] > conversation.state_updated_at:
+                conversation.restore(snapshot)
+        if sid is not None:
+            self.bind_sid(sid, session_key)
+        return conversation
+
+    def bind_sid(self, sid, session_key):
+        self.sid_sessions.setdefault(sid, set()).add(session_key)
+
+    def access_token_hash(self, session_key):
+        """The hash of the session's access token, or None if no client has started it."""
+        conversation = self.sessions.get(session_key)
+        if conversation is not None and conversation.access_token_hash:
+            return conversation.access_token_hash
+        return (self.load_state(session_key) or {}).get('access_token_hash')
+
+    def can_access(self, session_key, sid, token=None):
+        """Whether a socket may observe, stop or continue a session.
+
+        It may if the session is keyed by its own socket id, it started or
+        joined the session, or it presents the token issued when the session
+        was started.
+        """
+        if session_key == sid or session_key in self.sid_sessions.get(sid, ()):
+            return True
+        return check_access_token(token, self.access_token_hash(session_key))
+
+    def load_state(self, session_key):
+        """Return the session's shared state snapshot, or None."""
+        if self.state_store is None:
+            return None
+        return self.state_store.load(session_key)
+
+    def is_running_elsewhere(self, session_key):
+        """Whether another worker is running this session's conversation right now."""
+        snapshot = self.load_state(session_key)
+        return bool(
+            snapshot
+            and snapshot['is_running']
+            and snapshot['worker_id'] != self.worker_id
+            and time.time() - snapshot['updated_at'] < SESSION_RUNNING_TIMEOUT
+        )
+
+    def stop(self, session_key):
+        """Stop a session's conversation on whichever worker is running it."""
+        self.stop_local(session_key)
+        if self.state_store is not None:
+            self.state_store.publish_stop(session_key)
+
+    def stop_local(self, session_key):
+        conversation = self.sessions.get(session_key)
+        if conversation is not None:
+            conversation.stop_conversation()
+
+    def sessions_for_sid(self, sid):
+        """Return the conversations bound to a socket id."""
+        return [
+            self.sessions[key]
+            for key in self.sid_sessions.get(sid, ())
+            if key in self.sessions
+        ]
+
+    def release_sid(self, sid):
+        """Stop conversations started by a disconnected socket.
+
+        The sessions themselves stay registered until they idle out, so a
+        reconnecting client can still continue or read their history.
+        """
+        for conversation in self.sessions_for_sid(sid):
+            conversation.stop_conversation()
+        self.sid_sessions.pop(sid, None)
+
+    def evict_idle(self, now=None):
+        """Drop sessions that have been idle for longer than the TTL."""
+        now = time.monotonic() if now is None else now
+        for session_key in list(self.sessions):
+            if now - self.last_seen[session_key] < self.idle_ttl:
+                break  # Remaining sessions were seen more recently
+            if self.sessions[session_key].is_running:
+                continue
+            self._remove(session_key)
+
+    def _make_room(self):
+        while len(self.sessions) >= self.max_sessions:
+            idle_key = next(
+                (key for key, conversation in self.sessions.items() if not conversation.is_running),
+                None
+            )
+            if idle_key is None:
+                raise RuntimeError('Too many active sessions, please try again later')
+            self._remove(idle_key)
+
+    def _touch(self, session_key):
+        self.sessions.move_to_end(session_key)
+        self.last_seen[session_key] = time.monotonic()
+
+    def _remove(self, session_key):
+        self.sessions[session_key].drop_prefetch()
+        del self.sessions[session_key]
+        del self.last_seen[session_key]
+        for keys in self.sid_sessions.values():
+            keys.discard(session_key)
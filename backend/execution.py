@@ -0,0 +1,143 @@
+import importlib
+import sys
+
+import eventlet
+import greenlet
+from eventlet import tpool
+from eventlet.event import Event
+from eventlet.semaphore import Semaphore
+
+from cancellation import GenerationCancelled
+
+
+class GreenletCounter:
+    """Count the greenthreads started through spawn() until they exit.
+
+    Backs the multiai_greenlets gauge, which must stay cheap to read at any
+    number of sessions; Socket.IO's per-event greenlets are not counted.
+    """
+
+    def __init__(self):
+        self.live = 0
+
+    def spawn(self, func, *args, **kwargs):
+        """eventlet.spawn(), counted until the greenthread returns, raises or is killed."""
+        self.live += 1
+        worker = eventlet.spawn(func, *args, **kwargs)
+        worker.link(self._exited)
+        return worker
+
+    def _exited(self, worker):
+        self.live -= 1
+
+
+# Conversations, provider calls and worker pool waits started by this worker
+spawned_greenlets = GreenletCounter()
+
+
+def run_cancellable(cancel_token, func, *args, **kwargs):
+    """Run a blocking call in its own greenlet and kill it when the token is cancelled.
+
+    Killing the greenlet unwinds it out of the provider socket it is blocked
+    on, which closes the connection instead of waiting for the completion.
+    That only holds for I/O done on the greenlet itself: for calls handed to
+    a WorkerPool the caller stops waiting immediately, but the thread's
+    request runs to completion, and is billed, before its result is
+    discarded. Provider calls that must stop on cancel therefore run on
+    the calling greenlet, where eventlet makes their sockets cooperative.
+    """
+    cancel_token.raise_if_cancelled()
+    worker = spawned_greenlets.spawn(func, *args, **kwargs)
+    unregister = cancel_token.on_cancel(worker.kill)
+    try:
+        return worker.wait()
+    except greenlet.GreenletExit:
+        raise GenerationCancelled()
+    finally:
+        unregister()
+
+
+class WorkerPoolBusy(Exception):
+    """Raised when the worker pool queue is full."""
+
+
+class WorkerPool:
+    """Run blocking LLM calls on real OS threads, outside the eventlet hub.
+
+    At most ``max_workers`` calls run at once and up to ``max_queue`` more
+    wait for a slot; beyond that, calls fail fast with WorkerPoolBusy
+    instead of piling up behind the provider.
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.slots = Semaphore(max_workers)
+        self.active = 0
+        self.waiting = 0
+        tpool.set_num_threads(max_workers)
+
+    def execute(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on a worker thread and wait cooperatively for the result.
+
+        If the waiting greenlet is killed (see run_cancellable), the thread
+        finishes its call in the background and the result is discarded.
+        The call keeps its slot, and counts as active, until then.
+        """
+        if self.slots.locked() and self.waiting >= self.max_queue:
+            raise WorkerPoolBusy(
+                f"Server is busy ({self.active} calls running, {self.waiting} queued), please try again later"
+            )
+
+        self.waiting += 1
+        try:
+            self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        done = Event()
+
+        def call():
+            # A greenlet of its own waits for the thread, so the slot is released when the thread is done
+            try:
+                done.send(tpool.execute(func, *args, **kwargs))
+            except Exception:
+                done.send_exception(*sys.exc_info())
+            finally:
+                self.active -= 1
+                self.slots.release()
+
+        spawned_greenlets.spawn(call)
+        return done.wait()
+
+
+class LazyModule:
+    """A module imported on first attribute access instead of at startup.
+
+    The import runs on the calling greenlet and holds up the hub while a
+    heavy package such as CrewAI loads; load() can be called ahead of
+    time to warm it up. It is not handed to a tpool thread: the package's
+    module-level green locks and timers would belong to that thread, and
+    the hub dies switching to them later.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+        self.lock = Semaphore()
+
+    @property
+    def loaded(self):
+        return self.module is not None
+
+    def load(self):
+        if self.module is None:
+            # Greenlets share the hub's thread, so the import lock would hand a second one the half-imported module
+            with self.lock:
+                if self.module is None:
+                    self.module = importlib.import_module(self.name)
+        return self.module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
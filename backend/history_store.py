@@ -0,0 +1,99 @@
+import json
+import sqlite3
+import time
+
+
+def page_request(data, page_size):
+    """Read a history request's page size and cursor as (limit, before_id).
+
+    The limit is clamped to 1..page_size; raises ValueError if either value
+    is not an integer.
+    """
+    data = data or {}
+    try:
+        limit = int(data.get('limit', page_size))
+        before_id = None if data.get('before') is None else int(data['before'])
+    except (TypeError, ValueError):
+        raise ValueError("limit and before must be integers") from None
+    return max(1, min(limit, page_size)), before_id
+
+
+class ChatHistoryStore:
+    """Append-only SQLite chat history with paginated reads and a per-session cap.
+
+    Items are appended as JSON with their session and timestamp. Once a
+    session has seen ``compact_every`` appends, its oldest items beyond
+    ``max_items_per_session`` are compacted away.
+    """
+
+    def __init__(self, path, max_items_per_session=1000, compact_every=50):
+        self.max_items_per_session = max_items_per_session
+        self.compact_every = compact_every
+        self.appends_since_compaction = {}
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS chat_history ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "session_id TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "item TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chat_history_session_time "
+            "ON chat_history (session_id, created_at, id)"
+        )
+
+    def append(self, session_id, item):
+        """Append a history item (any JSON-serializable dict) to a session."""
+        self.connection.execute(
+            "INSERT INTO chat_history (session_id, created_at, item) VALUES (?, ?, ?)",
+            (session_id, time.time(), json.dumps(item, ensure_ascii=False))
+        )
+        appends = self.appends_since_compaction.get(session_id, 0) + 1
+        if appends >= self.compact_every:
+            self.compact(session_id)
+            appends = 0
+        self.appends_since_compaction[session_id] = appends
+
+    def read(self, session_id, limit=50, before_id=None):
+        """Return a page of items, oldest first, and the cursor for the page before it.
+
+        Pages are read newest first: pass the returned cursor as ``before_id``
+        to fetch older items. The cursor is None once the start is reached.
+        """
+        query = "SELECT id, created_at, item FROM chat_history WHERE session_id = ?"
+        params = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self.connection.execute(query, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        items = []
+        for row_id, created_at, item in reversed(rows):
+            entry = json.loads(item)
+            entry['id'] = row_id
+            entry['timestamp'] = created_at
+            items.append(entry)
+
+        next_cursor = items[0]['id'] if has_more else None
+        return items, next_cursor
+
+    def clear(self, session_id):
+        self.connection.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,))
+        self.appends_since_compaction.pop(session_id, None)
+
+    def compact(self, session_id):
+        """Drop a session's oldest items beyond the per-session cap."""
+        self.connection.execute(
+            "DELETE FROM chat_history WHERE session_id = ? AND id <= ("
+            "SELECT id FROM chat_history WHERE session_id = ? "
+            "ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?)",
+            (session_id, session_id, self.max_items_per_session)
+        )
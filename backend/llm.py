@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import os
+import time
+
+try:
+    import tiktoken
+except ImportError:  # Optional; token counts fall back to a character heuristic
+    tiktoken = None
+
+FAKE_PROVIDER = "fake"
+FAKE_REPLY_WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+
+
+_token_encoding = None
+
+
+def _get_token_encoding():
+    """Load the tiktoken encoding once; None if tiktoken is missing or cannot load it."""
+    global _token_encoding, tiktoken
+    if _token_encoding is None and tiktoken is not None:
+        try:
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as error:
+            # The encoding is downloaded on first use, which fails offline
+            print(f"tiktoken unavailable, estimating token counts: {str(error)}")
+            tiktoken = None
+    return _token_encoding
+
+
+def estimate_tokens(text):
+    """Count tokens with tiktoken when available, otherwise estimate them.
+
+    The estimate counts each CJK character as one token and every four
+    other characters as one, which is close enough for budgeting.
+    """
+    if not text:
+        return 0
+    encoding = _get_token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk_chars = sum(1 for char in text if "\u4e00" <= char <= "\u9fff")
+    return cjk_chars + (len(text) - cjk_chars + 3) // 4
+
+
+# Providers that only cache prompt blocks explicitly marked with cache_control
+CACHE_CONTROL_PROVIDERS = {"anthropic"}
+
+
+def prompt_messages(system, human, static_prefix="", provider=None):
+    """Build the (role, content) messages for a call, marking the system prompt's static prefix for caching.
+
+    Prompts put what is the same on every call first, so providers can
+    serve that prefix from their prompt cache. OpenAI and DeepSeek do so
+    automatically; Anthropic only caches marked blocks, so the static
+    prefix becomes its own block with cache_control. Other providers get
+    plain strings.
+    """
+    if provider in CACHE_CONTROL_PROVIDERS and static_prefix and system.startswith(static_prefix):
+        system = [
+            {"type": "text", "text": static_prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": system[len(static_prefix):] or " "},
+        ]
+    return [("system", system), ("human", human)]
+
+
+def instruct_prompt(messages):
+    """Render (role, content) messages as one Llama 2 / Mixtral [INST] prompt, for plain completions endpoints."""
+    system = "\n\n".join(content for role, content in messages if role == "system")
+    human = "\n\n".join(content for role, content in messages if role == "human")
+    if system:
+        human = f"<<SYS>>\n{system}\n<</SYS>>\n\n{human}"
+    return f"[INST] {human} [/INST]"
+
+
+def usage_from_metadata(usage_metadata):
+    """Token usage from a LangChain message's usage_metadata, as prompt/completion/cached counts."""
+    if not usage_metadata:
+        return None
+    details = usage_metadata.get("input_token_details") or {}
+    return {
+        "prompt": usage_metadata.get("input_tokens", 0),
+        "completion": usage_metadata.get("output_tokens", 0),
+        "cached": details.get("cache_read") or 0,
+    }
+
+
+def agent_messages(role, goal, backstory, description, expected_output):
+    """Render a CrewAI agent's task as the chat messages a one-agent crew would send its model.
+
+    The agent's role and backstory come first, so the system prompt starts
+    with the same text on every turn.
+    """
+    return [
+        {"role": "system", "content": f"You are {role}. {backstory}\nYour personal goal is: {goal}"},
+        {"role": "user", "content": f"{description}\n\nThis is the expected criteria for your final answer: {expected_output}"},
+    ]
+
+
+def usage_from_crew_metrics(after, before):
+    """Token usage between two snapshots of a CrewAI LLM's counters, or None if the provider reported none."""
+    if after.successful_requests == before.successful_requests:
+        return None
+    return {
+        "prompt": after.prompt_tokens - before.prompt_tokens,
+        "completion": after.completion_tokens - before.completion_tokens,
+        "cached": after.cached_prompt_tokens - before.cached_prompt_tokens,
+    }
+
+
+def is_fake_model(model_name):
+    """Check whether a model name refers to the in-process fake LLM."""
+    return bool(model_name) and model_name.startswith("fake")
+
+
+class FakeStreamingLLM:
+    """Deterministic in-process chat model for local testing.
+
+    Streams its reply word by word with configurable latencies, so the
+    streaming path can be exercised without provider credentials.
+    """
+
+    def __init__(self, reply=None, first_token_latency=None, token_delay=None, reply_words=None, max_tokens=None):
+        self.reply = reply
+        self.max_tokens = max_tokens  # Words, standing in for tokens; the reply stops there like a capped provider call
+        self.reply_words = (
+            reply_words if reply_words is not None
+            else int(os.getenv("FAKE_LLM_REPLY_WORDS", "12"))
+        )
+        self.first_token_latency = (
+            first_token_latency if first_token_latency is not None
+            else float(os.getenv("FAKE_LLM_FIRST_TOKEN_LATENCY", "0.02"))
+        )
+        self.token_delay = (
+            token_delay if token_delay is not None
+            else float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.005"))
+        )
+        self.usage = None  # Not reported; callers estimate
+
+    def _reply_for(self, messages):
+        if self.reply is not None:
+            return self.reply
+        # Same prompt, same reply: the digest keeps transcripts comparable
+        prompt = messages[-1][1] if messages else ""
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        filler = " ".join(FAKE_REPLY_WORDS[i % len(FAKE_REPLY_WORDS)] for i in range(self.reply_words))
+        return f"Fake reply {digest}: {filler}"
+
+    def _words_for(self, messages):
+        words = self._reply_for(messages).split(" ")
+        return words[:self.max_tokens] if self.max_tokens else words
+
+    def stream(self, messages):
+        """Yield the reply as word-sized tokens."""
+        time.sleep(self.first_token_latency)
+        for index, word in enumerate(self._words_for(messages)):
+            if index > 0:
+                time.sleep(self.token_delay)
+                word = " " + word
+            yield word
+
+    def invoke(self, messages):
+        return "".join(self.stream(messages))
+
+    async def astream(self, messages):
+        await asyncio.sleep(self.first_token_latency)
+        for index, word in enumerate(self._words_for(messages)):
+            if index > 0:
+                await asyncio.sleep(self.token_delay)
+                word = " " + word
+            yield word
+
+    async def ainvoke(self, messages):
+        return "".join([token async for token in self.astream(messages)])
+
+
+class LangChainStreamingLLM:
+    """Adapt a LangChain chat model to the plain-text streaming interface.
+
+    After a call, ``usage`` holds the provider's token counts, or None if
+    it did not report them.
+    """
+
+    def __init__(self, chat_model):
+        self.chat_model = chat_model
+        self.usage = None
+
+    def stream(self, messages):
+        self.usage = None
+        for chunk in self.chat_model.stream(messages):
+            self._add_usage(chunk)
+            if chunk.content:
+                yield chunk.content
+
+    def invoke(self, messages):
+        response = self.chat_model.invoke(messages)
+        self.usage = usage_from_metadata(getattr(response, "usage_metadata", None))
+        return str(response.content)
+
+    async def astream(self, messages):
+        self.usage = None
+        async for chunk in self.chat_model.astream(messages):
+            self._add_usage(chunk)
+            if chunk.content:
+                yield chunk.content
+
+    async def ainvoke(self, messages):
+        response = await self.chat_model.ainvoke(messages)
+        self.usage = usage_from_metadata(getattr(response, "usage_metadata", None))
+        return str(response.content)
+
+    def _add_usage(self, chunk):
+        # Usage arrives on the final chunk, or split across chunks (Anthropic)
+        chunk_usage = usage_from_metadata(getattr(chunk, "usage_metadata", None))
+        if chunk_usage:
+            self.usage = chunk_usage if self.usage is None else {
+                key: self.usage[key] + chunk_usage[key] for key in chunk_usage
+            }
+
+
+def create_streaming_llm(chat_model, max_tokens=None):
+    """Wrap a provider chat model so it yields tokens as the provider produces them.
+
+    ``chat_model`` comes from ProviderRegistry.chat_model(), which applies
+    the reply limit itself; None selects the fake model, capped at
+    ``max_tokens``. Messages are passed as (role, content) tuples, e.g. ("system", "...").
+    """
+    if chat_model is None:
+        return FakeStreamingLLM(max_tokens=max_tokens)
+    return LangChainStreamingLLM(chat_model)
@@ -0,0 +1,184 @@
+"""Socket.IO load client for comparing serving modes; prints its measurements as JSON.
+
+    python load_client.py --url http://127.0.0.1:5000 --sessions 100
+
+Each session connects over WebSocket, runs one simulator batch and then
+sends one streamed single AI message, all sessions at once. Works against
+app.py (eventlet) and asgi_app.py (asyncio) alike.
+
+With ``--probe`` a single session keeps trying to connect to a server that
+is still starting, and reports when it first answered each kind of request.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import socketio
+
+
+def process_memory(pid):
+    """Resident set size of a local process in bytes (Linux), or 0 where unavailable."""
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+class LoadSession:
+    """One client connection, recording when each event arrives."""
+
+    def __init__(self, url, index, personality):
+        self.url = url
+        self.index = index
+        self.personality = personality
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.events = []  # (arrival time, event name)
+        self.arrived = asyncio.Event()
+        self.client.on('*', self.on_event)
+
+    async def on_event(self, event, data=None):
+        if event == 'messageStream' and data and data.get('isComplete'):
+            # The end of a single AI reply, told apart from its other chunks
+            event = 'messageComplete'
+        self.events.append((time.perf_counter(), event))
+        self.arrived.set()
+
+    async def wait_for(self, event_names, timeout):
+        """Wait for any of the events; an 'error' is recorded if none arrives in time."""
+        deadline = time.perf_counter() + timeout
+        while not any(name in event_names for _, name in self.events):
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), max(0, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                self.events.append((time.perf_counter(), 'timeout'))
+                return
+
+    def count(self, event_name):
+        return sum(name == event_name for _, name in self.events)
+
+    async def conversation(self, timeout):
+        self.events.clear()
+        started = time.perf_counter()
+        await self.client.emit('startConversation', {
+            'prompt': '深夜的便利店',
+            'personality': self.personality,
+            'models': {'A': 'fake-stream', 'B': 'fake-stream'},
+            'use_cache': False,
+            'session_id': f"engine-load-{os.getpid()}-{self.index}"
+        })
+        await self.wait_for(('batchComplete', 'conversationComplete', 'error'), timeout)
+        updates = [at for at, name in self.events if name == 'conversationUpdate']
+        return {
+            'first_event': (self.events[0][0] - started) * 1000,
+            'turns': len(updates),
+            'turn_gaps': [(later - earlier) * 1000 for earlier, later in zip(updates, updates[1:])],
+            'errors': self.count('error') + self.count('timeout')
+        }
+
+    async def single_ai_message(self, timeout):
+        self.events.clear()
+        started = time.perf_counter()
+        await self.client.emit('singleAIMessage', {
+            'message': '你好', 'model': 'fake-stream', 'use_cache': False, 'stream': True
+        })
+        await self.wait_for(('messageComplete', 'error'), timeout)
+        chunks = [at for at, name in self.events if name in ('messageStream', 'messageComplete')]
+        return {
+            # The first messageStream event is the model tag, sent before the provider call
+            'first_token': (chunks[1] - started) * 1000 if len(chunks) > 1 else None,
+            'complete': (chunks[-1] - started) * 1000 if chunks else None,
+            'errors': self.count('error') + self.count('timeout')
+        }
+
+
+async def probe(args):
+    """Unix timestamps of a starting server's first connect, persona list, single AI token and turn."""
+    session = LoadSession(args.url, 0, args.personality)
+    print("Waiting for the server", flush=True)
+    deadline = time.perf_counter() + args.timeout
+    while True:
+        try:
+            await session.client.connect(args.url, transports=['websocket'])
+            break
+        except socketio.exceptions.ConnectionError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.01)
+    # Event times are perf_counter readings; the caller compares against its own clock
+    clock_offset = time.time() - time.perf_counter()
+    times = {'connect': time.time()}
+    try:
+        await session.client.emit('getPersonas')
+        await session.wait_for(('personas',), args.timeout)
+        times['personas'] = clock_offset + session.events[-1][0]
+
+        # Single AI chat does not need CrewAI; the simulator does
+        await session.single_ai_message(args.timeout)
+        chunks = [at for at, name in session.events if name in ('messageStream', 'messageComplete')]
+        times['single_ai_first_token'] = clock_offset + chunks[1] if len(chunks) > 1 else None
+
+        result = await session.conversation(args.timeout)
+        updates = [at for at, name in session.events if name == 'conversationUpdate']
+        times['conversation_first_turn'] = clock_offset + updates[0] if updates else None
+        times['errors'] = result['errors']
+    finally:
+        await session.client.disconnect()
+    return times
+
+
+async def run(args):
+    sessions = [LoadSession(args.url, index, args.personality) for index in range(args.sessions)]
+    memory_before = process_memory(args.server_pid) if args.server_pid else 0
+    # Connect a few at a time: listen backlogs are small, and connecting is not what is measured
+    connecting = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(session):
+        async with connecting:
+            await session.client.connect(args.url, transports=['websocket'])
+    await asyncio.gather(*(connect(session) for session in sessions))
+    try:
+        start = time.perf_counter()
+        conversations = await asyncio.gather(*(session.conversation(args.timeout) for session in sessions))
+        conversation_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        messages = await asyncio.gather(*(session.single_ai_message(args.timeout) for session in sessions))
+        single_elapsed = time.perf_counter() - start
+
+        memory_after = process_memory(args.server_pid) if args.server_pid else 0
+    finally:
+        await asyncio.gather(*(session.client.disconnect() for session in sessions))
+
+    return {
+        'sessions': args.sessions,
+        'conversation_seconds': conversation_elapsed,
+        'single_ai_seconds': single_elapsed,
+        'turns': sum(result['turns'] for result in conversations),
+        'errors': sum(result['errors'] for result in conversations + messages),
+        'first_event': [result['first_event'] for result in conversations],
+        'turn_gaps': [gap for result in conversations for gap in result['turn_gaps']],
+        'first_token': [result['first_token'] for result in messages if result['first_token'] is not None],
+        'complete': [result['complete'] for result in messages if result['complete'] is not None],
+        'server_memory_per_session': (memory_after - memory_before) / args.sessions if args.server_pid else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--personality', default='SARCASTIC_NETIZEN')
+    parser.add_argument('--connect-concurrency', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=120, help="seconds to wait for each phase")
+    parser.add_argument('--server-pid', type=int, help="local server process to measure memory of")
+    parser.add_argument('--probe', action='store_true', help="time the first responses of a starting server")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(probe(args) if args.probe else run(args))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import json
+import time
+from contextlib import contextmanager
+
+# Seconds; spans cache hits through slow provider calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    def __init__(self, name, help_text, metric_type):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text, "counter")
+        self.values = {}  # sorted label tuple -> value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, "histogram")
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.series = {}  # sorted label tuple -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        lines = []
+        for key, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(key + (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Gauge or counter whose values are read from the app when scraped.
+
+    ``callback`` returns a number, or a list of (labels dict, number) pairs.
+    """
+
+    def __init__(self, name, help_text, callback, metric_type="gauge"):
+        super().__init__(name, help_text, metric_type)
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        return [
+            f"{self.name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class MetricsRegistry:
+    """Prometheus text-format metrics, plus optional JSON log lines for stage timings."""
+
+    def __init__(self, log_stages=False):
+        self.metrics = []
+        self.log_stages = log_stages
+        self.stage_seconds = self.histogram(
+            "multiai_stage_seconds", "Time spent in each stage of the conversation pipeline."
+        )
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def gauge_callback(self, name, help_text, callback):
+        return self.register(CallbackMetric(name, help_text, callback))
+
+    def counter_callback(self, name, help_text, callback):
+        return self.register(CallbackMetric(name, help_text, callback, "counter"))
+
+    def observe_stage(self, stage, seconds, **labels):
+        self.stage_seconds.observe(seconds, stage=stage, **labels)
+        if self.log_stages:
+            print(json.dumps({"event": "stage", "stage": stage, "ms": round(seconds * 1000, 2), **labels},
+                             ensure_ascii=False))
+
+    @contextmanager
+    def time_stage(self, stage, **labels):
+        """Record how long the block takes as a stage, whether or not it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start, **labels)
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
@@ -0,0 +1,232 @@
+"""Local mock of an OpenAI-compatible chat completions API.
+
+Lets the provider clients, connection pooling and model routing be
+exercised without credentials. Point a provider at it, e.g.
+
+    python mock_provider.py --port 8001 --latency 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock python app.py
+
+GET /stats reports how many TCP connections and requests it has served.
+Like OpenAI's automatic prompt caching, the longest prefix a prompt
+shares with earlier prompts is reported as cached prompt tokens.
+
+POST /v1/completions takes a list of prompts, as self-hosted inference
+servers do for batching. With ``--serial`` it stands in for one such
+server: a single engine generates for one request at a time, taking
+``--latency`` plus ``--item-latency`` for each prompt after the first.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_BLOCK_CHARS = 64
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so pooled clients can reuse connections
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self.send_json(200, self.server.stats)
+        else:
+            self.send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.endswith("/completions") and not self.path.endswith("/chat/completions"):
+            self.complete(request)
+            return
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found"}})
+            return
+        self.server.count('requests')
+        self.server.count('prompts')
+
+        model = request.get("model", "mock")
+        messages = request.get("messages", [{}])
+        prompt = messages[-1].get("content", "")
+        words = f"Mock reply from {model} to {len(prompt)} characters of prompt".split(" ")
+        usage = self.server.usage(messages, len(words))
+        self.server.generate(1)
+
+        if not request.get("stream"):
+            self.send_json(200, {
+                "id": "mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, word in enumerate(words):
+            self.send_chunk(model, {"content": word if index == 0 else " " + word}, None)
+        self.send_chunk(model, {}, "stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self.send_chunk(model, None, None, usage)
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def complete(self, request):
+        """Plain completions for one prompt or a batch of them, in one reply."""
+        self.server.count('requests')
+        model = request.get("model", "mock")
+        prompts = request.get("prompt", "")
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        self.server.count('prompts', len(prompts))
+        texts = [f"Mock reply from {model} to {len(prompt)} characters of prompt" for prompt in prompts]
+        prompt_tokens = sum(len(prompt) for prompt in prompts) // 4
+        completion_tokens = sum(len(text.split(" ")) for text in texts)
+        self.server.count("prompt_tokens", prompt_tokens)
+        self.server.generate(len(prompts))
+        self.send_json(200, {
+            "id": "mock",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {"index": index, "text": text, "logprobs": None, "finish_reason": "stop"}
+                for index, text in enumerate(texts)
+            ],
+            # One total for the batch, as servers report it
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    def send_chunk(self, model, delta, finish_reason, usage=None):
+        payload = {
+            "id": "mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            # The usage chunk has no choices, as with OpenAI's include_usage
+            "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        if usage:
+            payload["usage"] = usage
+        self.write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, item_latency=0.0, serial=False):
+        super().__init__(address, MockProviderHandler)
+        self.latency = latency
+        self.item_latency = item_latency
+        self.engine = threading.Lock() if serial else None
+        self.stats = {"connections": 0, "requests": 0, "prompts": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        self.stats_lock = threading.Lock()
+        self.recent_prompts = deque(maxlen=256)
+
+    def generate(self, batch_size):
+        """Take as long as generating for batch_size prompts at once, on the one engine if serial."""
+        duration = self.latency + self.item_latency * (batch_size - 1)
+        if self.engine is None:
+            time.sleep(duration)
+            return
+        with self.engine:
+            time.sleep(duration)
+
+    def count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
+
+    def usage(self, messages, completion_tokens):
+        """Token usage for a request, counting its longest prefix shared with a recent prompt as cached."""
+        prompt = "".join(str(message.get("content", "")) for message in messages)
+        prompt_tokens = len(prompt) // 4
+        with self.stats_lock:
+            shared = max((len(os.path.commonprefix([prompt, seen])) for seen in self.recent_prompts), default=0)
+            self.recent_prompts.append(prompt)
+        # Cached in whole blocks, as providers do
+        cached_tokens = shared // CACHE_BLOCK_CHARS * CACHE_BLOCK_CHARS // 4
+        self.count("prompt_tokens", prompt_tokens)
+        self.count("cached_tokens", cached_tokens)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_mock_provider(port, latency=0.0, item_latency=0.0, serial=False):
+    """Run the mock in a child process, outside any eventlet hub; returns its base URL and process."""
+    process = subprocess.Popen(
+        [sys.executable, __file__, '--port', str(port), '--latency', str(latency),
+         '--item-latency', str(item_latency)] + (['--serial'] if serial else []),
+        stdout=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}/v1"
+    for _ in range(100):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats"):
+                return base_url, process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"Mock provider did not start on port {port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before each reply")
+    parser.add_argument('--item-latency', type=float, default=0.0,
+                        help="extra seconds for each further prompt in a batched request")
+    parser.add_argument('--serial', action='store_true', help="generate for one request at a time")
+    args = parser.parse_args()
+    server = MockProviderServer(("127.0.0.1", args.port), args.latency, args.item_latency, args.serial)
+    print(f"Mock provider listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
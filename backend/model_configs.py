@@ -0,0 +1,99 @@
+import os
+
+from dotenv import load_dotenv
+
+from llm import FAKE_PROVIDER
+
+# Shared by both serving modes (app.py with eventlet, asgi_app.py with asyncio)
+load_dotenv()
+
+# Model configurations with provider grouping
+MODEL_CONFIGS = {
+    "providers": {
+        "openai": {
+            "name": "OpenAI",
+            "icon": "openai-icon.png",
+            "models": {
+                # GPT-4 Models
+                "gpt-4o-mini": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
+                "gpt-4-0125-preview": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
+                "gpt-4-1106-preview": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
+                "gpt-4": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
+                
+                # GPT-3.5 Models
+                "gpt-3.5-turbo-0125": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
+                "gpt-3.5-turbo-1106": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
+                "gpt-3.5-turbo": {"api_key": os.getenv("OPENAI_API_KEY"), "provider": "openai"},
+            },
+            "features": {
+                "voice_input": True,
+                "streaming": True
+            }
+        },
+        "anthropic": {
+            "name": "Anthropic",
+            "icon": "anthropic-icon.png",
+            "models": {
+                "claude-3-opus": {"api_key": os.getenv("ANTHROPIC_API_KEY"), "provider": "anthropic"},
+                "claude-3-sonnet": {"api_key": os.getenv("ANTHROPIC_API_KEY"), "provider": "anthropic"},
+                "claude-2.1": {"api_key": os.getenv("ANTHROPIC_API_KEY"), "provider": "anthropic"},
+            },
+            "features": {
+                "voice_input": True,
+                "streaming": True
+            }
+        },
+        "deepseek": {
+            "name": "DeepSeek",
+            "icon": "deepseek-icon.png",
+            "models": {
+                "deepseek-r1": {"api_key": os.getenv("DEEPSEEK_API_KEY"), "provider": "deepseek"},
+                "deepseek-chat": {"api_key": os.getenv("DEEPSEEK_API_KEY"), "provider": "deepseek"},
+                "deepseek-coder": {"api_key": os.getenv("DEEPSEEK_API_KEY"), "provider": "deepseek"},
+            },
+            "features": {
+                "voice_input": False,
+                "streaming": True
+            }
+        },
+        "llama": {
+            "name": "Llama",
+            "icon": "llama-icon.png",
+            "models": {
+                "llama-2-70b-chat": {"api_key": os.getenv("LLAMA_API_KEY"), "provider": "llama", "endpoint": os.getenv("LLAMA_API_ENDPOINT")},
+                "llama-2-13b-chat": {"api_key": os.getenv("LLAMA_API_KEY"), "provider": "llama", "endpoint": os.getenv("LLAMA_API_ENDPOINT")},
+                "llama-2-7b-chat": {"api_key": os.getenv("LLAMA_API_KEY"), "provider": "llama", "endpoint": os.getenv("LLAMA_API_ENDPOINT")},
+            },
+            "features": {
+                "voice_input": False,
+                "streaming": True
+            }
+        },
+        "mixtral": {
+            "name": "Mixtral",
+            "icon": "mixtral-icon.png",
+            "models": {
+                "mixtral-8x7b": {"api_key": os.getenv("MIXTRAL_API_KEY"), "provider": "mixtral", "endpoint": os.getenv("MIXTRAL_API_ENDPOINT")}
+            },
+            "features": {
+                "voice_input": False,
+                "streaming": True
+            }
+        }
+    },
+    "default_model": os.getenv("DEFAULT_MODEL", "gpt-4o-mini")
+}
+
+# In-process fake model for local testing without provider credentials
+if os.getenv("ENABLE_FAKE_LLM", "false").lower() == "true":
+    MODEL_CONFIGS["providers"][FAKE_PROVIDER] = {
+        "name": "Fake",
+        "icon": "fake-icon.png",
+        "models": {
+            "fake-stream": {"api_key": None, "provider": FAKE_PROVIDER},
+        },
+        "features": {
+            "voice_input": False,
+            "streaming": True
+        }
+    }
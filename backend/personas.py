@@ -0,0 +1,142 @@
+import json
+import os
+import re
+
+PERSONA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "personas")
+DEFAULT_PERSONA = "SARCASTIC_NETIZEN"
+
+# Single AI chat prompts, formatted with str.format
+SINGLE_AI_SYSTEM_MESSAGE = """You are a helpful AI assistant that provides clear and concise responses.
+        You are currently running as the {model} model.
+        Maintain a natural, conversational tone while being informative and accurate."""
+
+SINGLE_AI_CONTEXT_MESSAGE = """
+        
+        Previous conversation context:
+        {context}
+        
+        Remember the context above when responding to the user's next message."""
+
+
+def _text(value):
+    """Persona files may write long prompts as a list of lines."""
+    return "\n".join(value) if isinstance(value, list) else value
+
+
+class PromptTemplate:
+    """A prompt with $name placeholders, parsed once into literal text and fields.
+
+    Rendering is a join of the precomputed pieces. ``static_prefix`` is the
+    text before the first placeholder, identical for every render, which is
+    the part provider prompt caches can reuse.
+    """
+
+    # ASCII names, so a placeholder can run straight into Chinese text
+    PLACEHOLDER = re.compile(r"\$([A-Za-z_]\w*)", re.ASCII)
+
+    def __init__(self, text):
+        self.text = text
+        parts = self.PLACEHOLDER.split(text)
+        self.literals = parts[0::2]
+        self.fields = parts[1::2]
+        self.static_prefix = self.literals[0]
+
+    def render(self, **values):
+        return self._join(self.literals, self.fields, values)
+
+    def split(self, field, **values):
+        """Render everything except ``field``; returns the text before and after it.
+
+        Lets the parts that stay fixed for a conversation be rendered once
+        and the changing field be spliced in per turn.
+        """
+        if self.fields.count(field) != 1:
+            raise ValueError(f"Placeholder ${field} must appear exactly once, found {self.fields.count(field)}")
+        index = self.fields.index(field)
+        values = {**values, field: ""}
+        before = self._join(self.literals[:index + 1], self.fields[:index], values)
+        after = self._join(self.literals[index + 1:], self.fields[index + 1:], values)
+        return before, after
+
+    @staticmethod
+    def _join(literals, fields, values):
+        pieces = [literals[0]]
+        for field, literal in zip(fields, literals[1:]):
+            pieces.append(values[field])
+            pieces.append(literal)
+        return "".join(pieces)
+
+
+class AgentTemplate:
+    __slots__ = ('role', 'goal', 'backstory')
+
+    def __init__(self, role, goal, backstory):
+        self.role = role
+        self.goal = PromptTemplate(goal)
+        self.backstory = PromptTemplate(backstory)
+
+
+class Persona:
+    """A conversation mode: two agent templates and their per-turn task templates."""
+
+    def __init__(self, key, name, description, agents, task):
+        if len(agents) != 2 or len(task["opening"]) != 2:
+            raise ValueError(f"Persona {key} needs exactly two agents and two opening instructions")
+        self.key = key
+        self.name = name
+        self.description = description
+        self.agents = [
+            AgentTemplate(agent["role"], _text(agent["goal"]), _text(agent["backstory"]))
+            for agent in agents
+        ]
+        base = _text(task["base"])
+        # Base and turn instruction are compiled together, so a turn is a single render
+        self.opening_tasks = [PromptTemplate(base + _text(opening)) for opening in task["opening"]]
+        self.continue_task = PromptTemplate(base + _text(task["continue"]))
+        self.expected_output = task["expected_output"]
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as persona_file:
+            data = json.load(persona_file)
+        try:
+            return cls(data["key"], data["name"], data.get("description", ""), data["agents"], data["task"])
+        except KeyError as error:
+            raise ValueError(f"Persona file {path} is missing {error}") from None
+
+    def task_template(self, agent_index, is_first_round):
+        if is_first_round:
+            return self.opening_tasks[agent_index]
+        return self.continue_task
+
+    def summary(self):
+        return {
+            "key": self.key,
+            "name": self.name,
+            "description": self.description,
+            "roles": [agent.role for agent in self.agents]
+        }
+
+
+class PersonaRegistry:
+    """Personas loaded once from the JSON files in a directory.
+
+    Adding a persona is adding a file; unknown keys fall back to the default
+    persona, as the hard-coded modes did.
+    """
+
+    def __init__(self, directory=PERSONA_DIR, default=DEFAULT_PERSONA):
+        self.personas = {}
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith(".json"):
+                persona = Persona.from_file(os.path.join(directory, file_name))
+                self.personas[persona.key] = persona
+        if default not in self.personas:
+            raise ValueError(f"Default persona {default} not found in {directory}")
+        self.default = default
+
+    def get(self, key):
+        return self.personas.get(key) or self.personas[self.default]
+
+    def summaries(self):
+        return [persona.summary() for persona in self.personas.values()]
@@ -0,0 +1,262 @@
+import asyncio
+import importlib.util
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+from llm import FAKE_PROVIDER, is_fake_model
+
+# Base URLs of the OpenAI-compatible APIs; llama and mixtral use their configured "endpoint"
+PROVIDER_BASE_URLS = {
+    "openai": os.getenv("OPENAI_BASE_URL"),  # None: the SDK default
+    "deepseek": os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1"),
+    "anthropic": os.getenv("ANTHROPIC_BASE_URL"),
+}
+
+# HTTP/2 needs the optional h2 package; without it clients stay on keep-alive HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class ProviderRegistry:
+    """Resolve configured models to long-lived, connection-pooled provider clients.
+
+    Every provider gets one shared httpx client, reused by all of its models
+    across turns and sessions, and a semaphore capping how many calls it
+    serves at once. The shared clients are for calls made on the eventlet
+    hub; requests sent from worker threads use per-thread clients instead.
+    With ``async_clients`` the chat models also get a shared
+    httpx.AsyncClient, for ainvoke()/astream() on an asyncio event loop.
+    """
+
+    def __init__(self, model_configs, max_connections=20, max_concurrency=10, timeout=60.0, async_clients=False):
+        self.model_configs = model_configs
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.async_clients = async_clients
+        self.http_clients = {}  # (provider, base url) -> httpx.Client
+        self.async_http_clients = {}  # (provider, base url) -> httpx.AsyncClient
+        self.batch_http_clients = {}  # (provider, base url, worker thread) -> httpx.Client for complete_batch()
+        self.chat_models = {}  # (model name, max tokens) -> LangChain chat model
+        self.crew_llms = {}  # (model name, max tokens) -> idle CrewAI LLMs
+        self.limiters = {}  # provider -> Semaphore
+        self.async_limiters = {}  # provider -> asyncio.Semaphore
+
+    def get_model_config(self, model_name):
+        """Return a copy of a model's configuration, or None if it is not configured.
+
+        Any "fake*" name selects the in-process fake model, but only while
+        ENABLE_FAKE_LLM has added the fake provider to the configuration.
+        """
+        if is_fake_model(model_name):
+            if FAKE_PROVIDER not in self.model_configs["providers"]:
+                return None
+            return {"api_key": None, "provider": FAKE_PROVIDER}
+        for provider in self.model_configs["providers"].values():
+            if model_name in provider["models"]:
+                return dict(provider["models"][model_name])
+        return None
+
+    def base_url(self, model_config):
+        return model_config.get("endpoint") or PROVIDER_BASE_URLS.get(model_config["provider"])
+
+    def is_self_hosted(self, model_name):
+        """Whether a model is served from its own configured endpoint, like llama and mixtral."""
+        model_config = self.get_model_config(model_name) or {}
+        return bool(model_config.get("endpoint"))
+
+    def http_client(self, model_config):
+        """Return the shared keep-alive client for a model's provider and base URL."""
+        return self._pooled_client(self.http_clients, model_config, asynchronous=False)
+
+    def async_http_client(self, model_config):
+        """Return the shared keep-alive async client for a model's provider and base URL."""
+        return self._pooled_client(self.async_http_clients, model_config, asynchronous=True)
+
+    def _pooled_client(self, clients, model_config, asynchronous, owner=None):
+        key = (model_config["provider"], self.base_url(model_config))
+        if owner is not None:
+            key += (owner,)
+        client = clients.get(key)
+        if client is None:
+            # Imported with the first client rather than at startup
+            import httpx
+            client_class = httpx.AsyncClient if asynchronous else httpx.Client
+            client = client_class(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=self.timeout
+            )
+            clients[key] = client
+        return client
+
+    def chat_model(self, model_name, max_tokens=None):
+        """Return the shared LangChain chat model for a configured model.
+
+        invoke() makes one plain request, so its connection goes back to the
+        pool; stream() still streams tokens. ``max_tokens`` caps the reply;
+        each limit gets its own model instance on the same pooled client.
+        Returns None for the fake model, which is served in process.
+        Call it from the hub only: under eventlet the pooled client's locks
+        are green locks, which worker threads cannot share.
+        """
+        model_config = self.get_model_config(model_name)
+        if model_config is None:
+            raise ValueError(f"Invalid model configuration for {model_name}")
+        if model_config["provider"] == FAKE_PROVIDER:
+            return None
+
+        key = (model_name, max_tokens)
+        chat_model = self.chat_models.get(key)
+        if chat_model is None:
+            chat_model = self._create_chat_model(model_name, model_config, max_tokens)
+            self.chat_models[key] = chat_model
+        return chat_model
+
+    def _create_chat_model(self, model_name, model_config, max_tokens=None):
+        limits = {"max_tokens": max_tokens} if max_tokens else {}
+        if model_config["provider"] == "anthropic":
+            # Optional dependency; the Anthropic client keeps its own connection pool
+            from langchain_anthropic import ChatAnthropic
+            options = {"base_url": self.base_url(model_config)} if self.base_url(model_config) else {}
+            return ChatAnthropic(
+                model=model_name,
+                api_key=model_config["api_key"],
+                **options,
+                **limits
+            )
+
+        from langchain_openai import ChatOpenAI
+        options = {"http_async_client": self.async_http_client(model_config)} if self.async_clients else {}
+        return ChatOpenAI(
+            model=model_name,
+            api_key=model_config["api_key"],
+            base_url=self.base_url(model_config),
+            http_client=self.http_client(model_config),
+            stream_usage=True,  # Token usage, including cached prompt tokens, on streamed replies too
+            **options,
+            **limits
+        )
+
+    def crew_llm(self, model_name, max_tokens=None):
+        """Build a CrewAI LLM for a configured model, its replies capped at ``max_tokens``.
+
+        OpenAI-compatible providers, the self-hosted llama and mixtral
+        endpoints included, use CrewAI's native OpenAI client; Anthropic
+        models its native Anthropic client, which needs the anthropic package.
+        """
+        model_config = self.get_model_config(model_name)
+        if model_config is None or model_config["provider"] == FAKE_PROVIDER:
+            raise ValueError(f"Invalid model configuration for {model_name}")
+
+        import crewai
+        options = {"max_tokens": max_tokens} if max_tokens else {}
+        if self.base_url(model_config):
+            options["base_url"] = self.base_url(model_config)
+        return crewai.LLM(
+            model=model_name,
+            provider="anthropic" if model_config["provider"] == "anthropic" else "openai",
+            api_key=model_config["api_key"],
+            timeout=self.timeout,
+            **options
+        )
+
+    @contextmanager
+    def lend_crew_llm(self, model_name, max_tokens=None):
+        """Lend a CrewAI LLM to one call, building another when all are in use.
+
+        Each call has its instance to itself, so concurrent calls cannot mix
+        up its token counters, and gives it back with its connections kept
+        alive for the next call.
+        """
+        idle = self.crew_llms.setdefault((model_name, max_tokens), [])
+        llm = idle.pop() if idle else self.crew_llm(model_name, max_tokens)
+        try:
+            yield llm
+        finally:
+            idle.append(llm)
+
+    def complete_batch(self, model_name, prompts, max_tokens=None):
+        """Send several prompts to a self-hosted model's completions endpoint in one request.
+
+        OpenAI-compatible inference servers take a list of prompts there and
+        generate for them together. Returns the completions in prompt order.
+
+        Each worker thread gets a keep-alive client of its own: under eventlet
+        httpx's pool locks are green locks, which threads cannot wait on for
+        one another.
+        """
+        url, payload, headers = self._batch_request(model_name, prompts, max_tokens)
+        model_config = self.get_model_config(model_name)
+        client = self._pooled_client(
+            self.batch_http_clients, model_config, asynchronous=False, owner=threading.get_ident()
+        )
+        response = client.post(url, json=payload, headers=headers)
+        return self._batch_texts(response, len(prompts))
+
+    async def acomplete_batch(self, model_name, prompts, max_tokens=None):
+        """complete_batch() on an asyncio event loop."""
+        url, payload, headers = self._batch_request(model_name, prompts, max_tokens)
+        model_config = self.get_model_config(model_name)
+        response = await self.async_http_client(model_config).post(url, json=payload, headers=headers)
+        return self._batch_texts(response, len(prompts))
+
+    def _batch_request(self, model_name, prompts, max_tokens):
+        model_config = self.get_model_config(model_name)
+        if model_config is None:
+            raise ValueError(f"Invalid model configuration for {model_name}")
+        payload = {"model": model_name, "prompt": prompts}
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        headers = {"Authorization": f"Bearer {model_config['api_key']}"} if model_config.get("api_key") else {}
+        return f"{self.base_url(model_config).rstrip('/')}/completions", payload, headers
+
+    @staticmethod
+    def _batch_texts(response, prompt_count):
+        response.raise_for_status()
+        choices = sorted(response.json()["choices"], key=lambda choice: choice["index"])
+        indices = [choice["index"] for choice in choices]
+        if indices != list(range(prompt_count)):
+            # Completions cannot be matched to their prompts, so none of them is used
+            raise ValueError(f"Batch of {prompt_count} prompts returned completions for indices {indices}")
+        return [choice["text"] for choice in choices]
+
+    @contextmanager
+    def limit(self, model_name):
+        """Hold one of the provider's concurrent call slots for the duration of the block."""
+        model_config = self.get_model_config(model_name) or {}
+        provider = model_config.get("provider", "unknown")
+        limiter = self.limiters.get(provider)
+        if limiter is None:
+            from eventlet.semaphore import Semaphore
+            limiter = self.limiters[provider] = Semaphore(self.max_concurrency)
+        with limiter:
+            yield
+
+    @asynccontextmanager
+    async def async_limit(self, model_name):
+        """limit() for calls made on an asyncio event loop."""
+        model_config = self.get_model_config(model_name) or {}
+        provider = model_config.get("provider", "unknown")
+        limiter = self.async_limiters.get(provider)
+        if limiter is None:
+            limiter = self.async_limiters[provider] = asyncio.Semaphore(self.max_concurrency)
+        async with limiter:
+            yield
+
+    def close(self):
+        for clients in (self.http_clients, self.batch_http_clients):
+            for client in clients.values():
+                client.close()
+            clients.clear()
+        self.chat_models.clear()
+        self.crew_llms.clear()
+
+    async def aclose(self):
+        for client in self.async_http_clients.values():
+            await client.aclose()
+        self.async_http_clients.clear()
+        self.close()
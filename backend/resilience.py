@@ -0,0 +1,219 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+from admission import RateLimited
+from cancellation import GenerationCancelled
+from config import (
+    LLM_CALL_TIMEOUT, LLM_FALLBACK, LLM_HEDGE, LLM_HEDGE_AFTER_MS, LLM_HEDGE_MODEL, LLM_RETRIES, LLM_RETRY_BACKOFF,
+    LLM_RETRY_BACKOFF_MAX
+)
+
+
+class CallTimeout(Exception):
+    """Raised when a provider call takes longer than the policy allows."""
+
+
+class LatencyTracker:
+    """Recent successful call latencies per model, for picking a hedging delay."""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}  # model name -> deque of seconds
+
+    def record(self, model_name, seconds):
+        self.samples.setdefault(model_name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model_name, fraction):
+        """Return the latency percentile in seconds, or None until there are enough samples."""
+        samples = self.samples.get(model_name)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ResiliencePolicy:
+    """Retries with jittered backoff, per-call timeouts, hedging and a fallback model.
+
+    Each attempt calls the primary model and gives up on it after
+    ``timeout`` seconds. With ``hedge`` on, a second request goes to
+    ``hedge_model`` (the primary model when None) once the attempt has run
+    longer than ``hedge_after`` seconds, or the model's observed p95 when
+    that is None; the first reply wins. Failed attempts are retried
+    ``retries`` times with exponential backoff and full jitter, and then
+    ``fallback_model`` gets one last attempt.
+    """
+
+    def __init__(self, retries=2, backoff=0.5, backoff_max=8.0, timeout=60.0,
+                 hedge=False, hedge_after=None, hedge_model=None, fallback_model=None,
+                 latency_tracker=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_model = hedge_model
+        self.fallback_model = fallback_model
+        self.latency_tracker = latency_tracker or LatencyTracker()
+
+    @staticmethod
+    def is_retryable(error):
+        # Stops, admission rejections and bad configuration will not go away on retry
+        return not isinstance(error, (GenerationCancelled, RateLimited, ValueError))
+
+    def call(self, call_model, model_name):
+        """Return call_model(model) for the first model and attempt that succeeds.
+
+        Raises the last error once retries and the fallback are exhausted.
+        """
+        import eventlet  # Only the green paths need it; acall() runs without eventlet
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+                print(f"Retrying {model_name} in {delay:.2f}s after: {str(last_error)}")
+                eventlet.sleep(delay)
+            try:
+                return self._attempt(call_model, model_name)
+            except Exception as error:
+                if not self.is_retryable(error):
+                    raise
+                last_error = error
+
+        if self.fallback_model and self.fallback_model != model_name:
+            print(f"Falling back from {model_name} to {self.fallback_model} after: {str(last_error)}")
+            return self._attempt(call_model, self.fallback_model, hedge=False)
+        raise last_error
+
+    async def acall(self, call_model, model_name):
+        """call() for coroutines on an asyncio event loop: ``await call_model(model)``.
+
+        Retries, timeouts, hedging and the fallback work as in call().
+        """
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+                print(f"Retrying {model_name} in {delay:.2f}s after: {str(last_error)}")
+                await asyncio.sleep(delay)
+            try:
+                return await self._async_attempt(call_model, model_name)
+            except Exception as error:
+                if not self.is_retryable(error):
+                    raise
+                last_error = error
+
+        if self.fallback_model and self.fallback_model != model_name:
+            print(f"Falling back from {model_name} to {self.fallback_model} after: {str(last_error)}")
+            return await self._async_attempt(call_model, self.fallback_model, hedge=False)
+        raise last_error
+
+    async def _async_attempt(self, call_model, model_name, hedge=True):
+        """_attempt() for coroutines: the racers are tasks, and the losers are cancelled."""
+        async def race(racer_model):
+            start = time.monotonic()
+            result = await call_model(racer_model)
+            self.latency_tracker.record(racer_model, time.monotonic() - start)
+            return racer_model, result
+
+        hedge_delay = self._hedge_delay(model_name) if hedge else None
+        deadline = time.monotonic() + self.timeout
+        racers = [asyncio.ensure_future(race(model_name))]
+        running = set(racers)
+        try:
+            while True:
+                timeout = deadline - time.monotonic()
+                if hedge_delay is not None and len(racers) == 1:
+                    timeout = min(timeout, hedge_delay)
+                done, running = await asyncio.wait(
+                    running, timeout=max(0, timeout), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if time.monotonic() >= deadline:
+                        raise CallTimeout(f"{model_name} did not respond within {self.timeout:.0f}s")
+                    # Slower than usual: ask again and take whichever answers first
+                    racers.append(asyncio.ensure_future(race(self.hedge_model or model_name)))
+                    running.add(racers[-1])
+                    continue
+                for racer in done:
+                    if racer.exception() is None:
+                        racer_model, result = racer.result()
+                        if len(racers) > 1:
+                            print(f"Hedged request for {model_name} answered by {racer_model}")
+                        return result
+                if not running:
+                    raise next(iter(done)).exception()
+                # The other racer may still succeed
+        finally:
+            for racer in racers:
+                racer.cancel()
+
+    def _attempt(self, call_model, model_name, hedge=True):
+        """Race the model against a hedge request, if hedging kicks in, within the timeout."""
+        import eventlet.queue
+        results = eventlet.queue.LightQueue()
+        racers = []
+
+        def race(racer_model):
+            start = time.monotonic()
+            try:
+                result = call_model(racer_model)
+            except Exception as error:
+                results.put((racer_model, None, error))
+                return
+            self.latency_tracker.record(racer_model, time.monotonic() - start)
+            results.put((racer_model, result, None))
+
+        hedge_delay = self._hedge_delay(model_name) if hedge else None
+        deadline = time.monotonic() + self.timeout
+        racers.append(eventlet.spawn(race, model_name))
+        try:
+            failures = 0
+            while True:
+                timeout = deadline - time.monotonic()
+                if hedge_delay is not None and len(racers) == 1:
+                    timeout = min(timeout, hedge_delay)
+                try:
+                    racer_model, result, error = results.get(timeout=max(0, timeout))
+                except eventlet.queue.Empty:
+                    if time.monotonic() >= deadline:
+                        raise CallTimeout(f"{model_name} did not respond within {self.timeout:.0f}s")
+                    # Slower than usual: ask again and take whichever answers first
+                    racers.append(eventlet.spawn(race, self.hedge_model or model_name))
+                    continue
+                if error is None:
+                    if len(racers) > 1:
+                        print(f"Hedged request for {model_name} answered by {racer_model}")
+                    return result
+                failures += 1
+                if failures == len(racers):
+                    raise error
+                # The other racer may still succeed
+        finally:
+            for racer in racers:
+                racer.kill()
+
+    def _hedge_delay(self, model_name):
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        return self.latency_tracker.percentile(model_name, 0.95)
+
+
+def create_resilience_policy(default_model):
+    """Build the simulator turns' policy from the LLM_* settings, falling back to ``default_model``."""
+    return ResiliencePolicy(
+        retries=LLM_RETRIES,
+        backoff=LLM_RETRY_BACKOFF,
+        backoff_max=LLM_RETRY_BACKOFF_MAX,
+        timeout=LLM_CALL_TIMEOUT,
+        hedge=LLM_HEDGE,
+        hedge_after=float(LLM_HEDGE_AFTER_MS) / 1000 if LLM_HEDGE_AFTER_MS else None,
+        hedge_model=LLM_HEDGE_MODEL,
+        fallback_model=default_model if LLM_FALLBACK else None
+    )
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+class MemoryCacheBackend:
+    """In-process LRU store of (expires_at, value) entries."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires_at):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SQLiteCacheBackend:
+    """On-disk store so cached responses survive restarts and are shared by local workers."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at < time.time():
+            self.connection.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+        return value
+
+    def set(self, key, value, expires_at):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at)
+        )
+
+    def clear(self):
+        self.connection.execute("DELETE FROM response_cache")
+
+
+class ResponseCache:
+    """Cache of LLM responses keyed by a hash of everything that shapes the prompt."""
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, backstory, task_description, max_tokens):
+        """Key for a reply to this prompt, generated with this max_tokens (None when uncapped)."""
+        payload = json.dumps([model, backstory, task_description, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss."""
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, time.time() + self.ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_response_cache():
+    """Build the response cache configured by the RESPONSE_CACHE_* environment variables.
+
+    Returns None when RESPONSE_CACHE_BACKEND is "off".
+    """
+    backend_name = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds
+
+    if backend_name == "off":
+        return None
+    if backend_name == "sqlite":
+        backend = SQLiteCacheBackend(os.getenv("RESPONSE_CACHE_PATH", "response_cache.db"))
+    elif backend_name == "memory":
+        backend = MemoryCacheBackend(int(os.getenv("RESPONSE_CACHE_SIZE", "1000")))
+    else:
+        raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {backend_name}")
+    return ResponseCache(backend, ttl)
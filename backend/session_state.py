@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+STOP_CHANNEL = "multiai:stop"
+STATE_KEY_PREFIX = "multiai:session:"
+
+
+def issue_access_token():
+    """Return a new session's access token, for the client that started it, and the hash its state keeps."""
+    token = secrets.token_urlsafe(16)
+    return token, hash_access_token(token)
+
+
+def hash_access_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def check_access_token(token, token_hash):
+    """Whether a client's token opens the session whose state keeps ``token_hash``."""
+    if not token or not isinstance(token, str) or not token_hash:
+        return False
+    return hmac.compare_digest(hash_access_token(token), token_hash)
+
+
+def public_state(snapshot):
+    """A session state snapshot without its access token hash, to send to clients."""
+    if snapshot is None:
+        return None
+    return {key: value for key, value in snapshot.items() if key != 'access_token_hash'}
+
+
+class MemorySessionStateStore:
+    """Session state for a single worker, which already sees every stop request."""
+
+    def __init__(self, ttl, max_sessions):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.states = OrderedDict()  # session key -> (expires_at, snapshot)
+
+    def save(self, session_key, snapshot):
+        self.states[session_key] = (time.time() + self.ttl, snapshot)
+        self.states.move_to_end(session_key)
+        while len(self.states) > self.max_sessions:
+            self.states.popitem(last=False)
+
+    def load(self, session_key):
+        entry = self.states.get(session_key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def delete(self, session_key):
+        self.states.pop(session_key, None)
+
+    def publish_stop(self, session_key):
+        pass
+
+    def subscribe_stops(self, callback):
+        pass
+
+    async def listen_stops(self, callback):
+        pass
+
+
+class RedisSessionStateStore:
+    """Session state shared by every worker through a Redis-compatible server.
+
+    Snapshots are stored as JSON with a TTL, and stop requests are published
+    so whichever worker runs the conversation can abort it.
+    """
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+
+    def save(self, session_key, snapshot):
+        self.client.set(STATE_KEY_PREFIX + session_key, json.dumps(snapshot, ensure_ascii=False), ex=int(self.ttl))
+
+    def load(self, session_key):
+        value = self.client.get(STATE_KEY_PREFIX + session_key)
+        return json.loads(value) if value else None
+
+    def delete(self, session_key):
+        self.client.delete(STATE_KEY_PREFIX + session_key)
+
+    def publish_stop(self, session_key):
+        self.client.publish(STOP_CHANNEL, session_key)
+
+    def subscribe_stops(self, callback):
+        """Call callback(session_key) for every stop request, from a background greenlet."""
+        import eventlet
+        pubsub = self._subscribe_stops()
+
+        def listen():
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if message is None:
+                    eventlet.sleep(0.01)
+                    continue
+                self._handle_stop(message, callback)
+
+        eventlet.spawn(listen)
+
+    async def listen_stops(self, callback):
+        """subscribe_stops() for an asyncio event loop, as a coroutine that runs until cancelled.
+
+        The client blocks, so each wait for a message runs on a worker thread.
+        """
+        pubsub = self._subscribe_stops()
+        while True:
+            message = await asyncio.to_thread(pubsub.get_message, timeout=1.0)
+            if message is not None:
+                self._handle_stop(message, callback)
+
+    def _subscribe_stops(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(STOP_CHANNEL)
+        return pubsub
+
+    @staticmethod
+    def _handle_stop(message, callback):
+        session_key = message['data']
+        if isinstance(session_key, bytes):
+            session_key = session_key.decode('utf-8')
+        try:
+            callback(session_key)
+        except Exception as error:
+            print(f"Error handling stop for {session_key}: {str(error)}")
+
+
+def create_session_state_store(ttl, max_sessions):
+    """Build the store named by SESSION_STATE_URL.
+
+    Unset keeps state in process. redis://... shares it between workers,
+    and fakeredis:// uses an in-process fakeredis server as a stand-in.
+    """
+    url = os.getenv("SESSION_STATE_URL")
+    if not url:
+        return MemorySessionStateStore(ttl, max_sessions)
+    if url.startswith("fakeredis://"):
+        import fakeredis
+        return RedisSessionStateStore(fakeredis.FakeRedis(), ttl)
+
+    import redis
+    return RedisSessionStateStore(redis.Redis.from_url(url), ttl)
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+
+class StreamEmitter:
+    """Coalesce streamed tokens into fewer, larger messageStream packets.
+
+    Tokens are buffered and flushed once ``flush_bytes`` of UTF-8 have
+    built up or ``flush_interval`` seconds have passed since the last
+    flush. A token arriving after a quiet spell, such as the first one, goes
+    out at once; a timer flushes whatever is left when tokens stop
+    arriving mid-window. ``emit(payload)`` sends one packet.
+    """
+
+    def __init__(self, emit, flush_interval=0.03, flush_bytes=256):
+        self.emit = emit
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.pending = []
+        self.pending_bytes = 0
+        self.last_flush = 0.0
+        self.timer = None
+        self.packets = 0
+
+    def write(self, text):
+        if not text:
+            return
+        self.pending.append(text)
+        self.pending_bytes += len(text.encode('utf-8'))
+        if (self.pending_bytes >= self.flush_bytes
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+        elif self.timer is None:
+            import eventlet
+            self.timer = eventlet.spawn_after(self.last_flush + self.flush_interval - time.monotonic(), self.flush)
+
+    def flush(self, is_complete=False, **extra):
+        self._cancel_timer()
+        if not self.pending and not is_complete:
+            return
+        content = ''.join(self.pending)
+        self.pending = []
+        self.pending_bytes = 0
+        self.last_flush = time.monotonic()
+        self.packets += 1
+        self.emit({'content': content, 'isComplete': is_complete, **extra})
+
+    def close(self, **extra):
+        """Send what is left together with the completion marker."""
+        self.flush(is_complete=True, **extra)
+
+    def discard(self):
+        """Drop buffered tokens, e.g. when the generation is stopped."""
+        self._cancel_timer()
+        self.pending = []
+        self.pending_bytes = 0
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            # A no-op when called from the timer itself
+            self.timer.cancel()
+            self.timer = None
+
+
+async def coalesce_stream(tokens, flush_interval=0.03, flush_bytes=256):
+    """StreamEmitter for asyncio: yield an async token stream as fewer, larger chunks.
+
+    The first token is yielded at once; after that, tokens are joined until
+    ``flush_bytes`` of UTF-8 have built up or ``flush_interval`` seconds
+    have passed since the last chunk, whichever comes first.
+    """
+    tokens = tokens.__aiter__()
+    pending = []
+    pending_bytes = 0
+    last_flush = None
+    next_token = None
+    try:
+        while True:
+            if next_token is None:
+                next_token = asyncio.ensure_future(tokens.__anext__())
+            timeout = None
+            if pending:
+                timeout = max(0, last_flush + flush_interval - time.monotonic())
+            done, _ = await asyncio.wait((next_token,), timeout=timeout)
+            if not done:
+                # Window over with nothing new: send what is buffered
+                yield ''.join(pending)
+                pending, pending_bytes, last_flush = [], 0, time.monotonic()
+                continue
+            try:
+                token = next_token.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                next_token = None
+            if not token:
+                continue
+            pending.append(token)
+            pending_bytes += len(token.encode('utf-8'))
+            if (last_flush is None or pending_bytes >= flush_bytes
+                    or time.monotonic() - last_flush >= flush_interval):
+                yield ''.join(pending)
+                pending, pending_bytes, last_flush = [], 0, time.monotonic()
+        if pending:
+            yield ''.join(pending)
+    finally:
+        if next_token is not None:
+            next_token.cancel()
+
+
+def split_text(text, max_bytes):
+    """Split text into pieces of at most max_bytes UTF-8 bytes, never inside a character."""
+    pieces = []
+    start = 0
+    size = 0
+    for index, char in enumerate(text):
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > max_bytes and index > start:
+            pieces.append(text[start:index])
+            start = index
+            size = 0
+        size += char_size
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# Settings are read on import: keep history in memory, serve the fake model, no cached replies, no rate limits
+os.environ.setdefault("CHAT_HISTORY_PATH", ":memory:")
+os.environ.setdefault("ENABLE_FAKE_LLM", "true")
+os.environ.setdefault("STARTUP_WARMUP", "false")
+os.environ.setdefault("SESSION_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("PROVIDER_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("RESPONSE_CACHE_BACKEND", "off")
+os.environ.pop("SESSION_STATE_URL", None)
+os.environ.pop("SOCKETIO_MESSAGE_QUEUE", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class EmitLog:
+    """Stands in for the Socket.IO server's emit and rooms, recording what each room was sent."""
+
+    def __init__(self):
+        self.events = []
+
+    async def emit(self, event, data=None, room=None, **kwargs):
+        self.events.append((room, event, data))
+
+    async def enter_room(self, sid, room, namespace=None):
+        pass
+
+    def sent(self, room, event):
+        return [data for sent_room, sent_event, data in self.events if sent_room == room and sent_event == event]
+
+
+@pytest.fixture
+def emits(monkeypatch):
+    import asgi_app
+
+    log = EmitLog()
+    monkeypatch.setattr(asgi_app.sio, 'emit', log.emit)
+    monkeypatch.setattr(asgi_app.sio, 'enter_room', log.enter_room)
+    return log
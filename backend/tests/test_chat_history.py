@@ -0,0 +1,57 @@
+import asyncio
+
+import asgi_app
+from session_state import issue_access_token
+
+
+def start_session(session_key, sid):
+    """Register a session started by ``sid``, with one stored turn; returns its access token."""
+    conversation = asgi_app.conversations.get_or_create(session_key, sid)
+    access_token, conversation.access_token_hash = issue_access_token()
+    asgi_app.chat_history_store.append(session_key, {'round': 1, 'agent': 'Agent A', 'message': 'hello'})
+    return access_token
+
+
+def test_history_is_refused_without_the_session_token(emits):
+    access_token = start_session('history-owned', 'client-a')
+
+    async def scenario():
+        await asgi_app.handle_get_chat_history('client-b', {'session_id': 'history-owned'})
+        await asgi_app.handle_clear_chat_history('client-b', {'session_id': 'history-owned'})
+        await asgi_app.handle_get_chat_history(
+            'client-b', {'session_id': 'history-owned', 'access_token': 'not-the-token'}
+        )
+        await asgi_app.handle_get_chat_history('client-a', {'session_id': 'history-owned'})
+        await asgi_app.handle_get_chat_history(
+            'client-c', {'session_id': 'history-owned', 'access_token': access_token}
+        )
+
+    asyncio.run(scenario())
+
+    assert [error['message'] for error in emits.sent('client-b', 'error')] == [
+        "Not allowed to read this session's history",
+        "Not allowed to clear this session's history",
+        "Not allowed to read this session's history",
+    ]
+    assert emits.sent('client-b', 'chatHistory') == []
+    assert emits.sent('client-b', 'chatHistoryCleared') == []
+    # The refused clear left the history in place for the clients that may read it
+    for sid in ('client-a', 'client-c'):
+        [page] = emits.sent(sid, 'chatHistory')
+        assert [item['message'] for item in page['history']] == ['hello']
+
+
+def test_single_ai_message_cannot_write_to_another_clients_session(emits):
+    start_session('history-single-ai', 'client-a')
+
+    async def scenario():
+        await asgi_app.handle_single_ai_message(
+            'client-b', {'session_id': 'history-single-ai', 'message': 'hi', 'model': 'fake-stream'}
+        )
+
+    asyncio.run(scenario())
+
+    [error] = emits.sent('client-b', 'error')
+    assert error['message'] == "Not allowed to add to this session's history"
+    history, _ = asgi_app.chat_history_store.read('history-single-ai')
+    assert [item['message'] for item in history] == ['hello']
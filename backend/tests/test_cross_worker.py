@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+import pytest
+
+import asgi_app
+from conversation import ConversationRegistry
+from session_state import RedisSessionStateStore, issue_access_token
+
+fakeredis = pytest.importorskip("fakeredis")
+
+FAKE_MODELS = {'A': 'fake-stream', 'B': 'fake-stream'}
+
+
+def make_worker(server, worker_id, **limits):
+    """A worker's registry and its Redis state store, sharing ``server`` with the other workers."""
+    store = RedisSessionStateStore(fakeredis.FakeRedis(server=server), ttl=60)
+    registry = ConversationRegistry(
+        lambda session_key: asgi_app.AsyncConversation(session_key, store), store, worker_id=worker_id, **limits
+    )
+    return store, registry
+
+
+async def wait_for(condition, timeout=10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'timed out'
+        await asyncio.sleep(0.005)
+
+
+def test_stop_from_another_worker(emits, monkeypatch):
+    monkeypatch.setenv("FAKE_LLM_FIRST_TOKEN_LATENCY", "0.05")
+    server = fakeredis.FakeServer()
+    store_a, worker_a = make_worker(server, 'worker-a')
+    _, worker_b = make_worker(server, 'worker-b')
+
+    async def scenario():
+        listener = asyncio.create_task(store_a.listen_stops(worker_a.stop_local))
+        conversation = worker_a.get_or_create('cross-stop', 'client-a')
+        conversation.start({'prompt': 'a debate', 'models': FAKE_MODELS, 'max_response_length': 100000})
+        await wait_for(lambda: conversation.conversation_history)
+        running_elsewhere = worker_b.is_running_elsewhere('cross-stop')
+
+        worker_b.stop('cross-stop')
+        await asyncio.wait_for(asyncio.gather(conversation.task, return_exceptions=True), timeout=5)
+        listener.cancel()
+        return conversation, running_elsewhere
+
+    conversation, running_elsewhere = asyncio.run(scenario())
+
+    assert running_elsewhere
+    assert not worker_a.is_running_elsewhere('cross-stop')
+    assert len(emits.sent(conversation.room, 'conversationStopped')) == 1
+    state = worker_b.load_state('cross-stop')
+    assert state['worker_id'] == 'worker-a'
+    assert not state['is_running']
+    assert not worker_b.is_running_elsewhere('cross-stop')
+
+
+def test_join_and_continue_on_another_worker_need_the_token(emits, monkeypatch):
+    server = fakeredis.FakeServer()
+    _, worker_a = make_worker(server, 'worker-a')
+    _, worker_b = make_worker(server, 'worker-b')
+
+    async def scenario():
+        monkeypatch.setattr(asgi_app, 'conversations', worker_a)
+        await asgi_app.handle_start_conversation('client-a', {
+            'session_id': 'cross-join', 'prompt': 'a debate', 'models': FAKE_MODELS, 'max_response_length': 100000
+        })
+        await worker_a.get('cross-join').task
+
+        monkeypatch.setattr(asgi_app, 'conversations', worker_b)
+        [token] = emits.sent('client-a', 'sessionToken')
+        await asgi_app.handle_join_session('client-b', {'session_id': 'cross-join'})
+        await asgi_app.handle_join_session('client-b', {'session_id': 'cross-join', 'access_token': 'not-the-token'})
+        await asgi_app.handle_start_conversation('client-b', {'session_id': 'cross-join', 'is_continuation': True})
+        await asgi_app.handle_join_session(
+            'client-c', {'session_id': 'cross-join', 'access_token': token['access_token']}
+        )
+        await asgi_app.handle_start_conversation(
+            'client-c', {'session_id': 'cross-join', 'is_continuation': True, 'access_token': token['access_token']}
+        )
+        await worker_b.get('cross-join').task
+
+    asyncio.run(scenario())
+
+    assert [error['message'] for error in emits.sent('client-b', 'error')] == [
+        'Not allowed to join this session',
+        'Not allowed to join this session',
+        'Not allowed to continue this session',
+    ]
+    assert emits.sent('client-b', 'sessionState') == []
+    # The token opens the state worker A saved, and worker B continues from it
+    [joined] = emits.sent('client-c', 'sessionState')
+    assert [item['round'] for item in joined['state']['conversation_history']] == [1, 1, 2, 2, 3, 3]
+    assert 'access_token_hash' not in joined['state']
+    continued = worker_b.get('cross-join')
+    assert [item['round'] for item in continued.conversation_history] == [1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6]
+    assert worker_b.load_state('cross-join')['worker_id'] == 'worker-b'
+
+
+def test_eviction_keeps_running_sessions_and_shared_state(emits):
+    server = fakeredis.FakeServer()
+    _, worker_a = make_worker(server, 'worker-a', max_sessions=2, idle_ttl=60)
+    _, worker_b = make_worker(server, 'worker-b')
+
+    idle = worker_a.get_or_create('cross-idle', 'client-a')
+    access_token, idle.access_token_hash = issue_access_token()
+    idle.conversation_history = [{'round': 1, 'agent': 'Agent A', 'message': 'hello'}]
+    idle.save_state()
+    running = worker_a.get_or_create('cross-running', 'client-a')
+    running.is_running = True
+
+    worker_a.evict_idle(now=time.monotonic() + 61)
+
+    assert list(worker_a.sessions) == ['cross-running']
+    assert worker_a.sessions_for_sid('client-a') == [running]
+    # Evicted here, the session lives on in the shared store, still behind its token
+    assert not worker_b.can_access('cross-idle', 'client-b')
+    assert worker_b.can_access('cross-idle', 'client-b', access_token)
+    restored = worker_a.get_or_create('cross-idle')
+    assert restored is not idle
+    assert restored.conversation_history == idle.conversation_history
+
+    # Full of running sessions, the registry turns new ones away rather than evict one
+    restored.is_running = True
+    with pytest.raises(RuntimeError):
+        worker_a.get_or_create('cross-new')
@@ -0,0 +1,34 @@
+import asyncio
+
+import asgi_app
+
+FAKE_MODELS = {'A': 'fake-stream', 'B': 'fake-stream'}
+
+
+def test_parallel_opening_gives_both_agents_their_opening(emits, monkeypatch):
+    tasks = []
+    turn_prompt = asgi_app.AsyncConversation.turn_prompt
+
+    def recording_turn_prompt(self, persona, agent_index, is_first_round):
+        prompt = turn_prompt(self, persona, agent_index, is_first_round)
+        tasks.append(prompt[2])
+        return prompt
+
+    monkeypatch.setattr(asgi_app.AsyncConversation, 'turn_prompt', recording_turn_prompt)
+    conversation = asgi_app.AsyncConversation('parallel-opening')
+    persona = asgi_app.persona_registry.get('rap_battle')
+
+    async def scenario():
+        conversation.start({
+            'prompt': 'a debate', 'models': FAKE_MODELS, 'personality': 'rap_battle',
+            'pipeline_turns': True, 'parallel_opening': True, 'max_response_length': 100000
+        })
+        await conversation.task
+
+    asyncio.run(scenario())
+
+    opening = [template.render(scenario='a debate', conversation_history='') for template in persona.opening_tasks]
+    assert tasks[0].startswith(opening[0])
+    assert tasks[1].startswith(opening[1])
+    continue_task = persona.continue_task.render(scenario='a debate', conversation_history='')
+    assert not any(task.startswith(continue_task) for task in tasks[:2])
@@ -0,0 +1,22 @@
+import asyncio
+
+import asgi_app
+from admission import SessionRateLimiter
+
+
+def test_reconnecting_does_not_refill_the_request_limit(emits, monkeypatch):
+    monkeypatch.setattr(asgi_app, 'request_limiter', SessionRateLimiter(1, 2))
+    environs = {sid: {'asgi.scope': {'client': ('203.0.113.7', port)}} for sid, port in (('first', 5001), ('second', 5002))}
+    monkeypatch.setattr(asgi_app.sio, 'get_environ', lambda sid, namespace=None: environs.get(sid))
+
+    async def scenario():
+        admitted = [await asgi_app.admit_request('first'), await asgi_app.admit_request('first')]
+        await asgi_app.disconnect('first')
+        # Same address, new socket id: the bucket it emptied is still empty
+        admitted.append(await asgi_app.admit_request('second'))
+        admitted.append(await asgi_app.admit_request('elsewhere'))
+        return admitted
+
+    assert asyncio.run(scenario()) == [True, True, False, True]
+    [error] = emits.sent('second', 'error')
+    assert error['retry_after'] > 0
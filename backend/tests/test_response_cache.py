@@ -0,0 +1,27 @@
+import asyncio
+
+import asgi_app
+from response_cache import MemoryCacheBackend, ResponseCache
+
+
+def test_reply_cached_under_a_small_budget_is_not_served_with_the_full_one(monkeypatch):
+    cache = ResponseCache(MemoryCacheBackend(100), ttl=60)
+    monkeypatch.setattr(asgi_app, 'response_cache', cache)
+    monkeypatch.setenv("FAKE_LLM_REPLY_WORDS", "200")
+    conversation = asgi_app.AsyncConversation('cache-reply-limit')
+    conversation.config = {'max_response_length': 100000}
+
+    def reply():
+        return asyncio.run(conversation.generate_reply('fake-stream', 'system', 'task', ''))
+
+    full = reply()
+    # Little of the budget left: the reply limit drops, so the full-budget reply is not reused
+    conversation.response_length = 100000 - 40
+    short = reply()
+    assert len(short.split()) < len(full.split())
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    assert reply() == short
+    conversation.response_length = 0
+    assert reply() == full
+    assert (cache.hits, cache.misses) == (2, 2)
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+import asgi_app
+
+FAKE_MODELS = {'A': 'fake-stream', 'B': 'fake-stream'}
+
+
+async def wait_for(condition, timeout=10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'timed out'
+        await asyncio.sleep(0.005)
+
+
+def turns(conversation):
+    return [(item['round'], item['agent']) for item in conversation.conversation_history]
+
+
+@pytest.mark.parametrize('pipeline_turns', [False, True])
+def test_stop_mid_round_then_continue_finishes_the_round(emits, monkeypatch, pipeline_turns):
+    # Slow enough for the stop to land while a reply is being generated
+    monkeypatch.setenv("FAKE_LLM_FIRST_TOKEN_LATENCY", "0.05")
+    conversation = asgi_app.AsyncConversation(f'stop-continue-{pipeline_turns}')
+
+    async def scenario():
+        conversation.start({
+            'prompt': 'a debate', 'models': FAKE_MODELS, 'pipeline_turns': pipeline_turns,
+            'max_response_length': 100000
+        })
+        # Agent A has spoken in round 2, agent B's reply is in flight
+        await wait_for(lambda: len(conversation.conversation_history) == 3)
+        conversation.stop_conversation()
+        await asyncio.gather(conversation.task, return_exceptions=True)
+        stopped = (turns(conversation), conversation.current_round, conversation.is_running)
+
+        conversation.start({'is_continuation': True})
+        await conversation.task
+        return stopped
+
+    stopped_turns, stopped_round, stopped_running = asyncio.run(scenario())
+
+    assert stopped_turns == [(1, 'Agent A'), (1, 'Agent B'), (2, 'Agent A')]
+    assert stopped_round == 1
+    assert not stopped_running
+    [stopped] = emits.sent(conversation.room, 'conversationStopped')
+    assert stopped == {'current_round': 1, 'can_continue': True}
+
+    # The continuation finishes round 2, then runs the rest of its batch
+    assert turns(conversation) == [
+        (round, agent) for round in (1, 2, 3, 4) for agent in ('Agent A', 'Agent B')
+    ]
+    assert conversation.current_round == 4
+    assert emits.sent(conversation.room, 'batchComplete') == [{'current_round': 4, 'can_continue': True}]